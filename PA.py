@@ -1,102 +1,3583 @@
+import time
+# Início do arranque, para o relatório de --profile-startup.
+_INICIO_ARRANQUE = time.perf_counter()
 import sys
 import os
 import json
-from datetime import datetime, date, timedelta
-from typing import List, Dict, Any
+import queue
+import random
+import csv
+import heapq
+import sqlite3
+import socket
+import threading
+import unicodedata
+import argparse
+import atexit
+import importlib
+import importlib.util
+import secrets
+import hmac
+import hashlib
+import getpass
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from collections.abc import Mapping
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from itertools import compress
+from bisect import bisect_left
+from datetime import datetime, date, timedelta, timezone
+from typing import List, Dict, Any, Tuple, Optional, NamedTuple, Callable, Set, Iterable, Sequence
 
-# --- IMPORTAÇÕES DO FIREBASE ---
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtCore import Qt, QDate, QAbstractTableModel, QAbstractListModel, QModelIndex, QObject, QTimer, pyqtSignal
 from PyQt5.QtGui import QFont, QColor
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QMainWindow, QTabWidget, QMessageBox,
     QVBoxLayout, QHBoxLayout, QFormLayout, QLineEdit, QComboBox,
-    QDateEdit, QSpinBox, QPushButton, QTableWidget, QTableWidgetItem,
-    QLabel, QCheckBox, QFileDialog, QTextEdit, QGroupBox
+    QDateEdit, QSpinBox, QPushButton, QTableView, QListView,
+    QLabel, QFileDialog, QGroupBox, QProgressBar, QProgressDialog, QStyle,
+    QTableWidget, QTableWidgetItem, QHeaderView
 )
 
-try:
-    import pandas as pd
-except Exception:
-    pd = None
+# --- IMPORTAÇÕES DO FIREBASE ---
+# O firebase_admin.firestore traz o grpc e demora a importar: só é carregado no
+# primeiro uso, normalmente pela thread que faz a ligação durante o arranque.
+class _ImportacaoTardia:
+    def __init__(self, nome: str):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo: str):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return getattr(self._modulo, atributo)
+
+firebase_admin = _ImportacaoTardia("firebase_admin")
+credentials = _ImportacaoTardia("firebase_admin.credentials")
+firestore = _ImportacaoTardia("firebase_admin.firestore")
+
+_FIM_IMPORTACOES = time.perf_counter()
+
+# Avisos e falhas de funcionamento (cache, fila, relay...); o destino é definido em configurar_log.
+log = logging.getLogger("gestor_pa")
+
+@lru_cache(maxsize=None)
+def erros_transitorios() -> Tuple[type, ...]:
+    """Erros do Firestore que justificam tentar de novo (sem rede, timeout, servidor ocupado)."""
+    try:
+        from google.api_core import exceptions as gexc
+        return (
+            ConnectionError, TimeoutError,
+            gexc.ServiceUnavailable, gexc.DeadlineExceeded, gexc.Aborted,
+            gexc.InternalServerError, gexc.ResourceExhausted,
+        )
+    except Exception:
+        return (ConnectionError, TimeoutError)
+
+@lru_cache(maxsize=None)
+def erros_de_conflito() -> Tuple[type, ...]:
+    """Erros do Firestore de uma escrita condicional recusada: a pré-condição falhou ou o documento já não existe."""
+    try:
+        from google.api_core import exceptions as gexc
+        return (gexc.FailedPrecondition, gexc.NotFound)
+    except Exception:
+        return ()
+
+# ------------------------------
+# Funções Auxiliares
+# ------------------------------
+
+STATUS_CORES = {
+    "FINALIZADO": QColor(198, 239, 206),
+    "ANÁLISE": QColor(255, 242, 204),
+    "EM ABERTO": QColor(221, 235, 247),
+}
+
+def dias_restantes(vencimento: date) -> int:
+    return (vencimento - date.today()).days
+
+# Registos com até este número de dias restantes são destacados como "a vencer".
+DIAS_AVISO_PRAZO = 3
+
+# Dias até ao vencimento, contados da ABERTURA, para os tipos de P.A. com prazo fixo.
+PRAZOS_TIPO_PA = {"P.A 3 dias": 3, "P.A 7 dias": 7, "P.A 3 e 7 dias": 7}
+# Campo -> nome mostrado ao utilizador.
+CAMPOS_OBRIGATORIOS = {"ID SGD": "ID SGD", "CIDADE": "Cidade"}
+
+def calcular_vencimento(abertura: date, tipo_pa: str) -> Optional[date]:
+    """Vencimento automático do tipo de P.A., ou None se o tipo não tem prazo fixo."""
+    dias = PRAZOS_TIPO_PA.get(tipo_pa)
+    return abertura + timedelta(days=dias) if dias else None
+
+def campos_em_falta(dados: Dict[str, Any]) -> List[str]:
+    return [nome for campo, nome in CAMPOS_OBRIGATORIOS.items() if not str(dados.get(campo) or "").strip()]
+
+def pasta_base() -> str:
+    """Pasta do executável (quando empacotado) ou do script."""
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+CONFIG_PADRAO: Dict[str, Any] = {
+    # Grava o campo TEMPO RESTANTE nos documentos (compatibilidade com versões antigas).
+    # Desligado, os dias restantes são sempre calculados a partir do VENCIMENTO.
+    "persistir_tempo_restante": False,
+    "janela_agrupamento_ms": 100,
+    # Cache local (SQLite) na pasta base; vazio desliga a cache.
+    "ficheiro_cache": "cache_pa.sqlite3",
+    # Ao fechar, grava as métricas da aba Diagnóstico neste ficheiro JSON; vazio não grava.
+    "ficheiro_diagnostico": "",
+    # Só acompanha em tempo real os registos abertos nos últimos N dias (0 = sem limite).
+    "janela_abertura_dias": 0,
+    # Fila local (SQLite) das gravações ainda por enviar; vazio grava diretamente na nuvem.
+    "ficheiro_fila_escrita": "fila_escrita.sqlite3",
+    # Histórico de ações (JSON Lines, com rotação) na pasta base; vazio guarda só em memória.
+    "ficheiro_historico": "historico_pa.jsonl",
+    # Avisos e falhas de funcionamento (com rotação) na pasta base; vazio mostra-os só no terminal.
+    "ficheiro_log": "gestor_pa.log",
+    # "máquina:porta" de um relay (python PA.py --relay) na rede local; vazio ouve o Firestore diretamente.
+    "relay": "",
+    # Chave partilhada entre o relay e as janelas que se ligam a ele.
+    "chave_relay": "",
+}
+
+def carregar_config() -> Dict[str, Any]:
+    """Lê o app_config.json da pasta base, completando com os valores por omissão."""
+    config = dict(CONFIG_PADRAO)
+    caminho = os.path.join(pasta_base(), "app_config.json")
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            config.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning("Não foi possível ler '%s': %s", caminho, e)
+    return config
+
+def converter_documento(doc) -> "Registo":
+    """Converte um documento do Firestore no registo usado pela aplicação."""
+    return converter_dados(doc.id, doc.to_dict(), versao_documento(doc))
+
+def converter_dados(doc_id: str, dados: Dict[str, Any], versao: Optional[str] = None) -> "Registo":
+    """Registo compacto a partir dos campos do documento (ABERTURA e VENCIMENTO passam a date)."""
+    dados['id'] = doc_id
+    if versao:
+        dados['_versao'] = versao
+    return Registo(dados)
+
+def versao_documento(doc) -> Optional[str]:
+    """update_time de um documento (ou de um WriteResult) em RFC 3339: a versão lida, para as pré-condições."""
+    instante = getattr(doc, "update_time", None)
+    if instante is None:
+        return None
+    if hasattr(instante, "rfc3339"):
+        return instante.rfc3339()
+    return instante.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def instante_versao(versao: str) -> datetime:
+    try:
+        from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+    except ImportError:
+        return datetime.strptime(versao, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    return DatetimeWithNanoseconds.from_rfc3339(versao)
+
+def limite_abertura(janela_dias: int) -> Optional[date]:
+    """Primeiro dia de abertura acompanhado em tempo real; None sem janela."""
+    if janela_dias <= 0:
+        return None
+    return date.today() - timedelta(days=janela_dias)
+
+def dentro_da_janela(reg: Dict[str, Any], janela_dias: int) -> bool:
+    """Indica se o registo foi aberto dentro da janela de abertura (sempre, sem janela)."""
+    limite = limite_abertura(janela_dias)
+    if limite is None:
+        return True
+    abertura = reg.get("ABERTURA")
+    return isinstance(abertura, date) and abertura >= limite
+
+def consulta_ao_vivo(colecao_ref, janela_dias: int):
+    """Consulta dos registos acompanhados em tempo real: os não finalizados, abertos dentro da janela.
+
+    Com janela de abertura, a consulta tem desigualdades em dois campos e
+    precisa do índice composto (STATUS, ABERTURA) no Firestore.
+    """
+    consulta = colecao_ref.where("STATUS", "!=", "FINALIZADO")
+    limite = limite_abertura(janela_dias)
+    if limite is not None:
+        consulta = consulta.where("ABERTURA", ">=", datetime.combine(limite, datetime.min.time()))
+    return consulta
+
+def caminho_campo(campo: str) -> str:
+    """Nome de campo como caminho do Firestore (update() e consultas): com espaços ou acentos vai entre crases."""
+    if campo.isascii() and campo.isidentifier():
+        return campo
+    return "`" + campo.replace("\\", "\\\\").replace("`", "\\`") + "`"
+
+def chave_ordem(reg: Dict[str, Any]) -> Tuple[float, str]:
+    """Chave crescente equivalente a ordenar por CRIADO_EM do mais recente para o mais antigo."""
+    criado = reg.get('CRIADO_EM')
+    ts = criado.timestamp() if isinstance(criado, datetime) else float('-inf')
+    return (-ts, reg.get('id', ''))
+
+def msg(parent, title, text, icon=QMessageBox.Information):
+    box = QMessageBox(parent)
+    box.setWindowTitle(title)
+    box.setText(text)
+    box.setIcon(icon)
+    box.exec_()
+
+# ------------------------------
+# Registo Compacto
+# ------------------------------
+
+# Campo do documento -> atributo do Registo. Campos fora desta lista ficam num dicionário à parte.
+ATRIBUTOS_REGISTO = {
+    "id": "id", "ID SGD": "id_sgd", "CIDADE": "cidade", "BASE GED": "base_ged",
+    "CAIXA MAPA": "caixa_mapa", "CAIXA SISTEMA": "caixa_sistema", "Quantidade HP": "qtd_hp",
+    "PA": "pa", "ABERTO POR": "aberto_por", "ABERTURA": "abertura", "VENCIMENTO": "vencimento",
+    "TEMPO RESTANTE": "tempo_restante", "STATUS": "status", "CONCLUSAO": "conclusao", "TIPO PA": "tipo_pa",
+    "CRIADO_EM": "criado_em", "ATUALIZADO_EM": "atualizado_em", "_versao": "versao",
+}
+# Campos com poucos valores distintos: o texto é internado e partilhado por todos os registos.
+CAMPOS_INTERNADOS = {"CIDADE", "BASE GED", "PA", "ABERTO POR", "STATUS", "CONCLUSAO", "TIPO PA"}
+CAMPOS_DATA = {"ABERTURA", "VENCIMENTO"}
+
+_AUSENTE = object()
+_datas_partilhadas: Dict[int, date] = {}
+
+def data_partilhada(valor):
+    """Um só objeto date por dia, partilhado por todos os registos (um datetime passa a date)."""
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    if not isinstance(valor, date):
+        return valor
+    return _datas_partilhadas.setdefault(valor.toordinal(), valor)
+
+class Registo(Mapping):
+    """Um registo de P.A. em memória, com __slots__ em vez de um dict por documento.
+
+    Lê-se como um dicionário só de leitura (get, [], in, items, dict(reg)), por
+    isso quem o usa não precisa de saber a diferença. Os textos de poucos valores
+    são internados e as datas partilhadas, um objeto por dia. Um campo que não
+    vem no documento fica com o atributo por definir, como a chave ausente do
+    dict. Não se altera: cada snapshot traz o documento inteiro e cria outro.
+    """
+
+    __slots__ = tuple(ATRIBUTOS_REGISTO.values()) + ("_extra",)
+
+    def __init__(self, dados: Dict[str, Any]):
+        extra = None
+        for campo, valor in dados.items():
+            atributo = ATRIBUTOS_REGISTO.get(campo)
+            if atributo is None:
+                if extra is None:
+                    extra = {}
+                extra[campo] = valor
+                continue
+            if campo in CAMPOS_INTERNADOS and type(valor) is str:
+                valor = sys.intern(valor)
+            elif campo in CAMPOS_DATA:
+                valor = data_partilhada(valor)
+            setattr(self, atributo, valor)
+        if extra is not None:
+            self._extra = extra
+
+    def get(self, campo: str, padrao=None):
+        atributo = ATRIBUTOS_REGISTO.get(campo)
+        if atributo is not None:
+            return getattr(self, atributo, padrao)
+        extra = getattr(self, "_extra", None)
+        return padrao if extra is None else extra.get(campo, padrao)
+
+    def __getitem__(self, campo: str):
+        atributo = ATRIBUTOS_REGISTO.get(campo)
+        try:
+            return getattr(self, atributo) if atributo is not None else self._extra[campo]
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def __contains__(self, campo) -> bool:
+        return self.get(campo, _AUSENTE) is not _AUSENTE
+
+    def __iter__(self):
+        for campo, atributo in ATRIBUTOS_REGISTO.items():
+            if hasattr(self, atributo):
+                yield campo
+        yield from getattr(self, "_extra", None) or ()
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Registo({dict(self)!r})"
+
+    # Leitura direta dos atributos: a tabela e a exportação percorrem todos os registos.
+    def valores(self) -> list:
+        """Os valores das COLUNAS, pela mesma ordem; TEMPO RESTANTE fica None (depende do dia)."""
+        g = getattr
+        return [
+            g(self, "id_sgd", ""), g(self, "cidade", ""), g(self, "base_ged", ""), g(self, "caixa_mapa", ""),
+            g(self, "caixa_sistema", ""), g(self, "qtd_hp", 0), g(self, "pa", ""), g(self, "aberto_por", ""),
+            g(self, "abertura", None), g(self, "vencimento", None), None,
+            g(self, "status", ""), g(self, "conclusao", ""), g(self, "tipo_pa", ""),
+        ]
+
+# ------------------------------
+# Instrumentação
+# ------------------------------
+
+# Cada métrica guarda só as últimas amostras: memória fixa, mesmo em sessões longas.
+AMOSTRAS_POR_METRICA = 1024
+# Atrasos do ciclo de eventos abaixo disto não contam como bloqueio da interface.
+LIMIAR_BLOQUEIO_MS = 50
+INTERVALO_PULSO_MS = 100
+
+class Metrica:
+    """Buffer circular de amostras de uma métrica, com percentis calculados a pedido."""
+
+    def __init__(self, unidade: str = "ms"):
+        self.unidade = unidade
+        self.amostras: "deque[float]" = deque(maxlen=AMOSTRAS_POR_METRICA)
+        self.total = 0
+        # registar() é chamado de várias threads: "total += 1" não é atómico e o
+        # deque não pode mudar enquanto resumo() o percorre.
+        self._lock = threading.Lock()
+
+    def registar(self, valor: float):
+        with self._lock:
+            self.amostras.append(valor)
+            self.total += 1
+
+    def resumo(self) -> Dict[str, Any]:
+        with self._lock:
+            amostras, total = list(self.amostras), self.total
+        valores = sorted(amostras)
+        if not valores:
+            return {"unidade": self.unidade, "total": total}
+
+        def percentil(p: float) -> float:
+            return round(valores[min(len(valores) - 1, int(len(valores) * p))], 2)
+
+        return {
+            "unidade": self.unidade, "total": total, "ultimo": round(amostras[-1], 2),
+            "p50": percentil(0.5), "p90": percentil(0.9), "p99": percentil(0.99), "max": round(valores[-1], 2),
+        }
+
+class Instrumentacao:
+    """Tempos e contagens dos caminhos críticos, para a aba Diagnóstico.
+
+    Registar uma amostra custa um perf_counter e um append sob um lock
+    quase sempre livre, por isso fica sempre ligada.
+    """
+
+    def __init__(self):
+        self._metricas: Dict[str, Metrica] = {}
+        self._lock = threading.Lock()
+
+    def registar(self, nome: str, valor: float, unidade: str = "ms"):
+        metrica = self._metricas.get(nome)
+        if metrica is None:
+            with self._lock:
+                metrica = self._metricas.setdefault(nome, Metrica(unidade))
+        metrica.registar(valor)
+
+    @contextmanager
+    def medir(self, nome: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registar(nome, (time.perf_counter() - inicio) * 1000)
+
+    def resumo(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            metricas = dict(self._metricas)
+        return {nome: metricas[nome].resumo() for nome in sorted(metricas)}
+
+    def limpar(self):
+        with self._lock:
+            self._metricas = {}
+
+    def gravar_json(self, caminho: str):
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump({"gerado_em": datetime.now().isoformat(timespec="seconds"), "metricas": self.resumo()},
+                      f, ensure_ascii=False, indent=2)
+
+metricas = Instrumentacao()
+
+class DetetorBloqueios(QObject):
+    """Mede quanto tempo o ciclo de eventos da interface esteve sem responder.
+
+    Um QTimer dispara a cada INTERVALO_PULSO_MS; o atraso com que chega é o
+    tempo em que a thread da interface esteve ocupada com outra coisa.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._ultimo = time.perf_counter()
+        self._timer = QTimer(self)
+        self._timer.setInterval(INTERVALO_PULSO_MS)
+        self._timer.timeout.connect(self._pulso)
+        self._timer.start()
+
+    def _pulso(self):
+        agora = time.perf_counter()
+        atraso = (agora - self._ultimo) * 1000 - INTERVALO_PULSO_MS
+        self._ultimo = agora
+        if atraso >= LIMIAR_BLOQUEIO_MS:
+            metricas.registar("ui.bloqueio", atraso)
+
+class PerfilArranque:
+    """Marcos do arranque (ms desde o início do processo), ativados com --profile-startup."""
+
+    def __init__(self):
+        self.ativo = False
+        self.concluido = False
+        self._marcos: List[Tuple[float, str, str]] = []
+        self._lock = threading.Lock()
+
+    def marcar(self, nome: str, instante: Optional[float] = None):
+        if not self.ativo or self.concluido:
+            return
+        ms = ((instante if instante is not None else time.perf_counter()) - _INICIO_ARRANQUE) * 1000
+        with self._lock:
+            self._marcos.append((ms, nome, threading.current_thread().name))
+
+    def relatar(self):
+        """Imprime os marcos uma única vez, com o tempo de cada passo dentro da sua thread."""
+        if not self.ativo or self.concluido:
+            return
+        self.concluido = True
+        with self._lock:
+            marcos = sorted(self._marcos)
+        anteriores: Dict[str, float] = {}
+        print("--- Perfil de arranque (ms desde o início) ---", file=sys.stderr)
+        for ms, nome, thread in marcos:
+            passo = ms - anteriores.get(thread, 0.0)
+            anteriores[thread] = ms
+            print(f"{ms:9.1f}  (+{passo:8.1f})  [{thread}] {nome}", file=sys.stderr)
+
+perfil_arranque = PerfilArranque()
+
+# ------------------------------
+# Índices de Busca
+# ------------------------------
+
+CAMPOS_TEXTO_BUSCA = ("CIDADE", "CAIXA MAPA", "CAIXA SISTEMA")
+CAMPOS_CATEGORICOS_BUSCA = ("STATUS", "BASE GED", "TIPO PA")
+# Marcador de início de texto: as chaves "\x02\x02a" e "\x02ab" formam o índice de prefixo.
+_INICIO = "\x02"
+
+def normalizar(texto: Any) -> str:
+    """Minúsculas e sem acentos, para a busca não depender de "São"/"sao"."""
+    return _normalizar(str(texto or ""))
+
+@lru_cache(maxsize=1 << 16)
+def _normalizar(texto: str) -> str:
+    if texto.isascii():
+        return texto.casefold().strip()
+    texto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in texto if not unicodedata.combining(c)).strip()
+
+def _trigramas(texto: str) -> Set[str]:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def _prefixos(texto: str) -> Set[str]:
+    """Chaves das buscas de 1 e 2 letras, que procuram o início do texto."""
+    t = _INICIO * 2 + texto
+    return {t[i:i + 3] for i in range(min(2, len(t) - 2))}
+
+def _bits_para_slots(mascara: int) -> List[int]:
+    bits = format(mascara, "b")[::-1]
+    return [i for i, bit in enumerate(bits) if bit == "1"]
+
+def _bitmap(slots: Iterable[int], tamanho: int) -> int:
+    dados = bytearray((tamanho >> 3) + 1)
+    for s in slots:
+        dados[s >> 3] |= 1 << (s & 7)
+    return int.from_bytes(dados, "little")
+
+class CriteriosFiltro(NamedTuple):
+    texto: str = ""  # já normalizado
+    status: str = ""
+    base: str = ""
+    tipo: str = ""
+
+    def ativo(self) -> bool:
+        return any(self)
+
+    def categorias(self) -> Tuple[Tuple[str, str], ...]:
+        return tuple((campo, valor) for campo, valor in zip(CAMPOS_CATEGORICOS_BUSCA, self[1:]) if valor)
+
+class IndiceBusca:
+    """Índices em memória para a barra de filtro da aba Registos.
+
+    - ID SGD: hash do texto normalizado e trigramas que apontam diretamente
+      para as posições (os IDs são quase todos diferentes);
+    - CIDADE/CAIXA MAPA/CAIXA SISTEMA: trigramas que apontam para os valores
+      distintos, e de cada valor para as posições;
+    - as 1-2 primeiras letras de qualquer destes textos apontam diretamente
+      para as posições, porque uma busca tão curta apanha muitos registos;
+    - STATUS/BASE GED/TIPO PA: um bitmap (int) por valor, um bit por posição.
+
+    As posições são os slots do ModeloRegistros e tudo é atualizado registo a
+    registo, à medida que chegam os snapshots.
+    """
+
+    def __init__(self):
+        self._id_sgd: Dict[str, Set[int]] = {}
+        self._valores_por_trigrama: Dict[str, Set[str]] = {}
+        self._slots_por_valor: Dict[str, Set[int]] = {}
+        self._slots_por_prefixo: Dict[str, Set[int]] = {}
+        self._slots_por_trigrama_id: Dict[str, Set[int]] = {}
+        self._bitmaps: Dict[str, Dict[str, int]] = {campo: {} for campo in CAMPOS_CATEGORICOS_BUSCA}
+        # slot -> (ID SGD normalizado, textos normalizados, valores categóricos)
+        self._entradas: Dict[int, Tuple[str, Tuple[str, ...], Tuple[str, ...]]] = {}
+
+    @staticmethod
+    def _entrada(reg: Dict[str, Any]) -> Tuple[str, Tuple[str, ...], Tuple[str, ...]]:
+        return (
+            normalizar(reg.get("ID SGD", "")),
+            tuple(sys.intern(normalizar(reg.get(campo, ""))) for campo in CAMPOS_TEXTO_BUSCA),
+            tuple(sys.intern(str(reg.get(campo, "") or "")) for campo in CAMPOS_CATEGORICOS_BUSCA),
+        )
+
+    def reconstruir(self, pares: Iterable[Tuple[int, Dict[str, Any]]]):
+        """Carga inicial: os bitmaps são montados de uma vez, não bit a bit."""
+        self.__init__()
+        por_valor: Dict[str, Dict[str, List[int]]] = {campo: {} for campo in CAMPOS_CATEGORICOS_BUSCA}
+        maior = 0
+        for slot, reg in pares:
+            entrada = self._entrada(reg)
+            self._indexar_textos(slot, entrada)
+            for campo, valor in zip(CAMPOS_CATEGORICOS_BUSCA, entrada[2]):
+                por_valor[campo].setdefault(valor, []).append(slot)
+            maior = max(maior, slot)
+        for campo, valores in por_valor.items():
+            self._bitmaps[campo] = {valor: _bitmap(slots, maior) for valor, slots in valores.items()}
+
+    def adicionar(self, slot: int, reg: Dict[str, Any]):
+        entrada = self._entrada(reg)
+        self._indexar_textos(slot, entrada)
+        bit = 1 << slot
+        for campo, valor in zip(CAMPOS_CATEGORICOS_BUSCA, entrada[2]):
+            mapa = self._bitmaps[campo]
+            mapa[valor] = mapa.get(valor, 0) | bit
+
+    def _indexar_textos(self, slot: int, entrada):
+        self._entradas[slot] = entrada
+        self._id_sgd.setdefault(entrada[0], set()).add(slot)
+        for t in _trigramas(entrada[0]):
+            self._slots_por_trigrama_id.setdefault(t, set()).add(slot)
+        textos = [valor for valor in entrada[1] if valor]
+        for valor in textos:
+            slots = self._slots_por_valor.get(valor)
+            if slots is None:
+                slots = self._slots_por_valor[valor] = set()
+                for t in _trigramas(valor):
+                    self._valores_por_trigrama.setdefault(t, set()).add(valor)
+            slots.add(slot)
+        for chave in set().union(_prefixos(entrada[0]) if entrada[0] else (), *map(_prefixos, textos)):
+            self._slots_por_prefixo.setdefault(chave, set()).add(slot)
+
+    def remover(self, slot: int):
+        entrada = self._entradas.pop(slot, None)
+        if entrada is None:
+            return
+        id_norm, textos, categorias = entrada
+        self._descartar(self._id_sgd, id_norm, slot)
+        for t in _trigramas(id_norm):
+            self._descartar(self._slots_por_trigrama_id, t, slot)
+        textos = [valor for valor in textos if valor]
+        for valor in textos:
+            if self._descartar(self._slots_por_valor, valor, slot):
+                for t in _trigramas(valor):
+                    self._descartar(self._valores_por_trigrama, t, valor)
+        for chave in set().union(_prefixos(id_norm) if id_norm else (), *map(_prefixos, textos)):
+            self._descartar(self._slots_por_prefixo, chave, slot)
+        mascara = ~(1 << slot)
+        for campo, valor in zip(CAMPOS_CATEGORICOS_BUSCA, categorias):
+            mapa = self._bitmaps[campo]
+            restante = mapa.get(valor, 0) & mascara
+            if restante:
+                mapa[valor] = restante
+            else:
+                mapa.pop(valor, None)
+
+    @staticmethod
+    def _descartar(mapa: Dict[Any, set], chave, elemento) -> bool:
+        """Remove o elemento; devolve True se a chave ficou vazia (e foi apagada)."""
+        conjunto = mapa.get(chave)
+        if conjunto is None:
+            return False
+        conjunto.discard(elemento)
+        if not conjunto:
+            del mapa[chave]
+            return True
+        return False
+
+    def valores(self, campo: str) -> List[str]:
+        return sorted(v for v in self._bitmaps[campo] if v)
+
+    def contem_id(self, texto_normalizado: str) -> bool:
+        return texto_normalizado in self._id_sgd
+
+    def _slots_com_texto(self, q: str) -> Set[int]:
+        if len(q) < 3:
+            return set(self._slots_por_prefixo.get(_INICIO * (3 - len(q)) + q, ()))
+        trigramas = [q[i:i + 3] for i in range(len(q) - 2)]
+        conjuntos = sorted((self._valores_por_trigrama.get(t, set()) for t in trigramas), key=len)
+        valores = conjuntos[0].intersection(*conjuntos[1:])
+        conjuntos = sorted((self._slots_por_trigrama_id.get(t, set()) for t in trigramas), key=len)
+        slots = conjuntos[0].intersection(*conjuntos[1:])
+        if len(q) > 3:
+            # Ter todos os trigramas não chega: "abcxbcd" tem os de "abcd".
+            valores = [v for v in valores if q in v]
+            slots = {s for s in slots if q in self._entradas[s][0]}
+        return slots.union(*map(self._slots_por_valor.__getitem__, valores))
+
+    def consultar(self, criterios: CriteriosFiltro) -> Optional[Set[int]]:
+        """Slots que satisfazem os critérios (None quando não há filtro)."""
+        if not criterios.ativo():
+            return None
+        candidatos: Optional[Set[int]] = None
+        if criterios.texto:
+            candidatos = self._slots_com_texto(criterios.texto)
+        mascara: Optional[int] = None
+        for campo, valor in criterios.categorias():
+            bits = self._bitmaps[campo].get(valor, 0)
+            mascara = bits if mascara is None else mascara & bits
+        if mascara is None:
+            return candidatos
+        if candidatos is None:
+            return set(_bits_para_slots(mascara))
+        if len(candidatos) < 4096:
+            dados = mascara.to_bytes((mascara.bit_length() >> 3) + 1, "little")
+            return {s for s in candidatos if (s >> 3) < len(dados) and dados[s >> 3] >> (s & 7) & 1}
+        return candidatos.intersection(_bits_para_slots(mascara))
+
+    def corresponde(self, slot: int, criterios: CriteriosFiltro) -> bool:
+        """Avalia um só registo (usado nas alterações incrementais)."""
+        entrada = self._entradas.get(slot)
+        if entrada is None:
+            return False
+        q = criterios.texto
+        if q:
+            textos = (entrada[0],) + entrada[1]
+            if len(q) < 3:
+                if not any(t.startswith(q) for t in textos):
+                    return False
+            elif not any(q in t for t in textos):
+                return False
+        return all(entrada[2][CAMPOS_CATEGORICOS_BUSCA.index(campo)] == valor
+                   for campo, valor in criterios.categorias())
+
+# ------------------------------
+# Modelo da Tabela de Registos
+# ------------------------------
+
+COLUNAS = [
+    "ID SGD","CIDADE","BASE GED","CAIXA MAPA","CAIXA SISTEMA","Quantidade HP",
+    "PA","ABERTO POR","ABERTURA","VENCIMENTO","TEMPO RESTANTE","STATUS",
+    "CONCLUSAO","TIPO PA"
+]
+COL_QTD_HP, COL_ABERTURA, COL_VENCIMENTO, COL_TEMPO, COL_STATUS = 5, 8, 9, 10, 11
+# Colunas com poucos valores distintos: os textos são internados e partilhados entre linhas.
+COLUNAS_CATEGORICAS = {1, 2, 5, 7, 8, 9, 10, 11, 12, 13}
+
+COR_VENCIDO = QColor(255, 100, 100)
+COR_A_VENCER = QColor(255, 180, 90)
+COR_TEXTO_DESTAQUE = QColor("black")
+# Estado da gravação local de uma linha (pendente/falhou/conflito), ou None se está igual à nuvem.
+PAPEL_ESTADO_ESCRITA = Qt.UserRole + 1
+
+# As datas dos registos são partilhadas (ver data_partilhada): cada dia é formatado uma só vez.
+@lru_cache(maxsize=1 << 12)
+def texto_data(valor) -> str:
+    return valor.strftime("%d/%m/%Y") if valor else ""
+
+def texto_valor(valor) -> str:
+    """Valor de um campo como é mostrado ao utilizador (datas em dd/mm/aaaa)."""
+    if isinstance(valor, date):
+        return texto_data(valor)
+    return "" if valor is None else str(valor)
+
+def _ordinal(valor) -> int:
+    return valor.toordinal() if isinstance(valor, date) else 0
+
+class ModeloRegistros(QAbstractTableModel):
+    """Modelo da tabela de registos, guardado por colunas.
+
+    Cada registo ocupa uma posição ("slot") em listas paralelas, uma por coluna,
+    com os textos já formatados. Cores e alinhamentos só são calculados em
+    data(), ou seja, para as linhas que a vista está de facto a desenhar.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._textos: List[List[str]] = [[] for _ in COLUNAS]
+        self._ids: List[Optional[str]] = []
+        self._chave_padrao: List[Tuple[float, str]] = []
+        self._qtd_hp: List[int] = []
+        self._abertura: List[int] = []
+        self._vencimento: List[int] = []
+        # TEMPO RESTANTE não é guardado: sai de VENCIMENTO e do dia de hoje.
+        self._hoje = date.today().toordinal()
+        self._slot_por_id: Dict[str, int] = {}
+        self._livres: List[int] = []
+        # id -> (estado, erro) das linhas com gravações locais por confirmar.
+        self._estado_escrita: Dict[str, Tuple[str, str]] = {}
+        self.indice = IndiceBusca()
+        # Todos os slots por ordem crescente da chave de ordenação, com as chaves
+        # ao lado para o bisect; _linhas/_chaves_linhas são os que passam o filtro
+        # (as mesmas listas quando não há filtro). Em ordem decrescente a vista lê
+        # a lista de trás para a frente.
+        self._linhas_total: List[int] = []
+        self._chaves_total: List[tuple] = []
+        self._linhas = self._linhas_total
+        self._chaves_linhas = self._chaves_total
+        self._criterios = CriteriosFiltro()
+        self._coluna_ordem = -1
+        self._ordem = Qt.AscendingOrder
+
+    # --- API usada pela janela ---
+    def redefinir(self, registros: List[Registo]):
+        self.beginResetModel()
+        self._textos = [[] for _ in COLUNAS]
+        self._ids, self._chave_padrao = [], []
+        self._qtd_hp, self._abertura, self._vencimento = [], [], []
+        self._slot_por_id, self._livres = {}, []
+        pares = []
+        for reg in registros:
+            slot = self._alocar(reg['id'])
+            self._gravar(slot, reg, indexar=False)
+            pares.append((slot, reg))
+        self.indice.reconstruir(pares)
+        self._reordenar()
+        self.endResetModel()
+
+    def inserir(self, reg: Registo):
+        slot = self._alocar(reg['id'])
+        self._gravar(slot, reg)
+        self._inserir_ordenado(slot)
+
+    def atualizar(self, reg: Registo):
+        slot = self._slot_por_id.get(reg['id'])
+        if slot is None:
+            self.inserir(reg)
+            return
+        chave_antiga = self._chave(slot)
+        linha = self._linha_do_slot(slot)
+        self._gravar(slot, reg)
+        if self._chave(slot) == chave_antiga and linha is not None and self._passa_filtro(slot):
+            self.dataChanged.emit(self.index(linha, 0), self.index(linha, len(COLUNAS) - 1))
+        else:
+            self._remover_ordenado(slot, chave_antiga)
+            self._inserir_ordenado(slot)
+
+    def remover(self, doc_id: str):
+        slot = self._slot_por_id.pop(doc_id, None)
+        if slot is None:
+            return
+        self._remover_ordenado(slot, self._chave(slot))
+        self.indice.remover(slot)
+        self._ids[slot] = None
+        for coluna in self._textos:
+            coluna[slot] = ""
+        self._livres.append(slot)
+
+    def definir_hoje(self, hoje: date):
+        """Muda o dia de referência e repinta só a coluna TEMPO RESTANTE.
+
+        A ordem das linhas não muda: todos os prazos andam um dia ao mesmo tempo.
+        """
+        self._hoje = hoje.toordinal()
+        if self._linhas:
+            self.dataChanged.emit(self.index(0, COL_TEMPO), self.index(len(self._linhas) - 1, COL_TEMPO))
+
+    def _tempo(self, slot: int) -> Optional[int]:
+        vencimento = self._vencimento[slot]
+        return vencimento - self._hoje if vencimento else None
+
+    def id_na_linha(self, linha: int) -> Optional[str]:
+        return self._ids[self._linhas[self._indice(linha)]]
+
+    def total(self) -> int:
+        return len(self._linhas_total)
+
+    def estado_escrita(self, doc_id: str) -> Optional[str]:
+        return self._estado_escrita.get(doc_id, (None, ""))[0]
+
+    def definir_estado_escrita(self, doc_id: str, estado: str, erro: str = ""):
+        if estado:
+            self._estado_escrita[doc_id] = (estado, erro)
+        elif self._estado_escrita.pop(doc_id, None) is None:
+            return
+        slot = self._slot_por_id.get(doc_id)
+        linha = self._linha_do_slot(slot) if slot is not None else None
+        if linha is not None:
+            self.dataChanged.emit(self.index(linha, 0), self.index(linha, len(COLUNAS) - 1))
+
+    def ids_visiveis(self) -> List[str]:
+        """IDs das linhas que passam o filtro, pela ordem em que a vista as mostra."""
+        ids = [self._ids[slot] for slot in self._linhas]
+        if self._ordem != Qt.AscendingOrder:
+            ids.reverse()
+        return ids
+
+    def definir_filtro(self, criterios: CriteriosFiltro):
+        if criterios == self._criterios:
+            return
+        self.beginResetModel()
+        self._criterios = criterios
+        with metricas.medir("tabela.filtrar"):
+            self._refiltrar()
+        self.endResetModel()
+
+    # --- Armazenamento ---
+    def _alocar(self, doc_id: str) -> int:
+        if self._livres:
+            slot = self._livres.pop()
+            self._ids[slot] = doc_id
+        else:
+            slot = len(self._ids)
+            self._ids.append(doc_id)
+            for coluna in self._textos:
+                coluna.append("")
+            self._chave_padrao.append((0.0, ""))
+            self._qtd_hp.append(0)
+            self._abertura.append(0)
+            self._vencimento.append(0)
+        self._slot_por_id[doc_id] = slot
+        return slot
+
+    def _gravar(self, slot: int, reg: Registo, indexar: bool = True):
+        if indexar:
+            self.indice.remover(slot)
+            self.indice.adicionar(slot, reg)
+        valores = reg.valores()
+        textos = list(map(str, valores))
+        textos[COL_ABERTURA] = texto_data(valores[COL_ABERTURA])
+        textos[COL_VENCIMENTO] = texto_data(valores[COL_VENCIMENTO])
+        textos[COL_TEMPO] = ""
+        for c, v in enumerate(textos):
+            self._textos[c][slot] = sys.intern(v) if c in COLUNAS_CATEGORICAS else v
+        self._chave_padrao[slot] = chave_ordem(reg)
+        try:
+            self._qtd_hp[slot] = int(valores[COL_QTD_HP])
+        except (TypeError, ValueError):
+            self._qtd_hp[slot] = 0
+        self._abertura[slot] = _ordinal(valores[COL_ABERTURA])
+        self._vencimento[slot] = _ordinal(valores[COL_VENCIMENTO])
+
+    # --- Ordenação ---
+    def _chave(self, slot: int) -> tuple:
+        c = self._coluna_ordem
+        padrao = self._chave_padrao[slot]
+        if c < 0:
+            return padrao
+        if c == COL_QTD_HP:
+            valor = self._qtd_hp[slot]
+        elif c == COL_ABERTURA:
+            valor = self._abertura[slot]
+        elif c in (COL_VENCIMENTO, COL_TEMPO):
+            # Ordenar pelos dias restantes é ordenar pelo vencimento.
+            valor = self._vencimento[slot] or float('inf')
+        else:
+            valor = self._textos[c][slot].casefold()
+        return (valor, padrao)
+
+    def _indice(self, linha: int) -> int:
+        """Converte linha da vista em índice de self._linhas (e vice-versa)."""
+        if self._ordem == Qt.AscendingOrder:
+            return linha
+        return len(self._linhas) - 1 - linha
+
+    _linha = _indice
+
+    def _linha_do_slot(self, slot: int) -> Optional[int]:
+        """Linha da vista onde o slot está, ou None se não passa o filtro."""
+        i = bisect_left(self._chaves_linhas, self._chave(slot))
+        if i < len(self._linhas) and self._linhas[i] == slot:
+            return self._linha(i)
+        return None
+
+    def _reordenar(self):
+        with metricas.medir("tabela.ordenar"):
+            pares = sorted((self._chave(slot), slot) for slot in self._slot_por_id.values())
+            self._chaves_total = [chave for chave, _ in pares]
+            self._linhas_total = [slot for _, slot in pares]
+        self._refiltrar()
+
+    def _refiltrar(self):
+        conjunto = self.indice.consultar(self._criterios)
+        if conjunto is None:
+            self._linhas, self._chaves_linhas = self._linhas_total, self._chaves_total
+            return
+        if len(conjunto) == len(self._linhas_total):
+            # Todos passam (por exemplo, "sgd" num ID SGD comum a todos): basta copiar a ordem.
+            self._linhas, self._chaves_linhas = list(self._linhas_total), list(self._chaves_total)
+            return
+        if len(conjunto) < len(self._linhas_total) >> 4:
+            # Poucos resultados: mais barato ordená-los do que percorrer todos os slots.
+            pares = sorted((self._chave(slot), slot) for slot in conjunto)
+            self._chaves_linhas = [chave for chave, _ in pares]
+            self._linhas = [slot for _, slot in pares]
+            return
+        # Muitos resultados: uma passagem sobre a ordem total preserva a ordenação.
+        mascara = list(map(conjunto.__contains__, self._linhas_total))
+        self._chaves_linhas = list(compress(self._chaves_total, mascara))
+        self._linhas = list(compress(self._linhas_total, mascara))
+
+    def _filtrado(self) -> bool:
+        return self._linhas is not self._linhas_total
+
+    def _passa_filtro(self, slot: int) -> bool:
+        return not self._filtrado() or self.indice.corresponde(slot, self._criterios)
+
+    def _inserir_ordenado(self, slot: int):
+        chave = self._chave(slot)
+        if self._filtrado():
+            i = bisect_left(self._chaves_total, chave)
+            self._chaves_total.insert(i, chave)
+            self._linhas_total.insert(i, slot)
+            if not self.indice.corresponde(slot, self._criterios):
+                return
+        i = bisect_left(self._chaves_linhas, chave)
+        linha = i if self._ordem == Qt.AscendingOrder else len(self._linhas) - i
+        self.beginInsertRows(QModelIndex(), linha, linha)
+        self._chaves_linhas.insert(i, chave)
+        self._linhas.insert(i, slot)
+        self.endInsertRows()
+
+    def _remover_ordenado(self, slot: int, chave: tuple):
+        if self._filtrado():
+            i = bisect_left(self._chaves_total, chave)
+            if i < len(self._linhas_total) and self._linhas_total[i] == slot:
+                del self._chaves_total[i]
+                del self._linhas_total[i]
+        i = bisect_left(self._chaves_linhas, chave)
+        if i >= len(self._linhas) or self._linhas[i] != slot:
+            return
+        linha = self._linha(i)
+        self.beginRemoveRows(QModelIndex(), linha, linha)
+        del self._chaves_linhas[i]
+        del self._linhas[i]
+        self.endRemoveRows()
+
+    def sort(self, coluna: int, ordem=Qt.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        persistentes = self.persistentIndexList()
+        slots = [self._linhas[self._indice(p.row())] for p in persistentes]
+        self._coluna_ordem = coluna
+        self._ordem = ordem
+        self._reordenar()
+        novos = [
+            self.index(self._linha(bisect_left(self._chaves_linhas, self._chave(slot))), p.column())
+            for p, slot in zip(persistentes, slots)
+        ]
+        self.changePersistentIndexList(persistentes, novos)
+        self.layoutChanged.emit()
+
+    # --- Interface QAbstractTableModel ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._linhas)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUNAS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUNAS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        slot = self._linhas[self._indice(index.row())]
+        c = index.column()
+        if role == Qt.DisplayRole:
+            if c == COL_TEMPO:
+                tempo = self._tempo(slot)
+                return str(tempo) if tempo is not None else ""
+            return self._textos[c][slot]
+        if role == Qt.TextAlignmentRole:
+            if c in (COL_QTD_HP, COL_TEMPO):
+                return int(Qt.AlignRight | Qt.AlignVCenter)
+            return None
+        if role == Qt.BackgroundRole:
+            return self._cor_fundo(slot, c)
+        if role == Qt.ForegroundRole:
+            return COR_TEXTO_DESTAQUE if self._cor_fundo(slot, c) is not None else None
+        if role == Qt.UserRole:
+            return self._ids[slot]
+        if self._estado_escrita:
+            return self._dados_escrita(self._ids[slot], c, role)
+        return None
+
+    def _dados_escrita(self, doc_id: str, c: int, role: int):
+        estado, erro = self._estado_escrita.get(doc_id, (None, ""))
+        if estado is None:
+            return None
+        if role == PAPEL_ESTADO_ESCRITA:
+            return estado
+        if role == Qt.FontRole:
+            fonte = QFont()
+            fonte.setItalic(True)
+            return fonte
+        if role == Qt.DecorationRole and c == 0:
+            icone = {ESTADO_FALHOU: QStyle.SP_MessageBoxCritical,
+                     ESTADO_CONFLITO: QStyle.SP_MessageBoxWarning}.get(estado, QStyle.SP_BrowserReload)
+            return QApplication.style().standardIcon(icone)
+        if role == Qt.ToolTipRole:
+            if estado == ESTADO_FALHOU:
+                return f"Falha ao gravar na nuvem: {erro}"
+            if estado == ESTADO_CONFLITO:
+                return f"Edição em conflito com a nuvem: {erro}"
+            return "Gravação local ainda por enviar para a nuvem."
+        return None
+
+    def _cor_fundo(self, slot: int, c: int) -> Optional[QColor]:
+        status = self._textos[COL_STATUS][slot]
+        if c == COL_TEMPO and status != "FINALIZADO":
+            tr = self._tempo(slot)
+            if tr is not None and tr <= 0:
+                return COR_VENCIDO
+            if tr is not None and tr <= DIAS_AVISO_PRAZO:
+                return COR_A_VENCER
+        return STATUS_CORES.get(status)
+
+class TabelaRegistos(QTableView):
+    """QTableView que mede o tempo de cada pintura (métrica tabela.desenhar)."""
+
+    def paintEvent(self, event):
+        with metricas.medir("tabela.desenhar"):
+            super().paintEvent(event)
+
+# ------------------------------
+# Despacho dos Snapshots do Firestore
+# ------------------------------
+
+# Snapshots que chegam dentro desta janela são aplicados numa só atualização da interface.
+JANELA_AGRUPAMENTO_MS = 100
+
+class LoteSnapshot(NamedTuple):
+    """Snapshot já convertido: ou a coleção completa, ou a lista de alterações."""
+    completo: Optional[List[Dict[str, Any]]] = None
+    alteracoes: List[Tuple[str, str, Optional[Dict[str, Any]]]] = []
+    # Maior ATUALIZADO_EM/EXCLUIDO_EM visto no lote (marca de sincronização).
+    marca: Optional[datetime] = None
+    # perf_counter() da chegada do snapshot mais antigo do lote (para a instrumentação).
+    recebido_em: Optional[float] = None
+    # Token do relay depois deste lote, para retomar a partir daqui (None se veio do Firestore).
+    retomar: Optional[str] = None
+    # Primeiro snapshot de um listener (ou ligação ao relay): a tabela já reflete o servidor.
+    inicial: bool = False
+
+def maior_marca(*marcas: Optional[datetime]) -> Optional[datetime]:
+    validas = [m for m in marcas if m is not None]
+    return max(validas) if validas else None
+
+def fundir_lotes(lotes: List[LoteSnapshot]) -> LoteSnapshot:
+    """Junta vários lotes num só, ficando apenas o último estado de cada documento."""
+    completo: Optional[Dict[str, Dict[str, Any]]] = None
+    alteracoes: Dict[str, Tuple[str, Optional[Dict[str, Any]]]] = {}
+    marca = maior_marca(*(lote.marca for lote in lotes))
+    recebido_em = min((lote.recebido_em for lote in lotes if lote.recebido_em is not None), default=None)
+    retomar = next((lote.retomar for lote in reversed(lotes) if lote.retomar is not None), None)
+    inicial = any(lote.inicial for lote in lotes)
+    for lote in lotes:
+        if lote.completo is not None:
+            completo = {reg['id']: reg for reg in lote.completo}
+            alteracoes = {}
+            continue
+        for tipo, doc_id, reg in lote.alteracoes:
+            if completo is not None:
+                if tipo == 'REMOVED':
+                    completo.pop(doc_id, None)
+                else:
+                    completo[doc_id] = reg
+                continue
+            anterior = alteracoes.get(doc_id)
+            if tipo == 'REMOVED':
+                if anterior is not None and anterior[0] == 'ADDED':
+                    # Criado e apagado dentro da mesma janela: nada a aplicar.
+                    del alteracoes[doc_id]
+                else:
+                    alteracoes[doc_id] = ('REMOVED', None)
+            elif anterior is None:
+                alteracoes[doc_id] = (tipo, reg)
+            elif anterior[0] == 'ADDED':
+                alteracoes[doc_id] = ('ADDED', reg)
+            else:
+                alteracoes[doc_id] = ('MODIFIED', reg)
+    if completo is not None:
+        return LoteSnapshot(completo=list(completo.values()), marca=marca, recebido_em=recebido_em,
+                            retomar=retomar, inicial=inicial)
+    return LoteSnapshot(alteracoes=[(tipo, doc_id, reg) for doc_id, (tipo, reg) in alteracoes.items()],
+                        marca=marca, recebido_em=recebido_em, retomar=retomar, inicial=inicial)
+
+class DespachanteSnapshots(QObject):
+    """Leva os snapshots da thread do listener do Firestore para a thread da interface.
+
+    O callback do listener só enfileira. Uma thread de trabalho converte os
+    documentos e emite `lote_decodificado`, que o Qt entrega na thread da
+    interface; aí os lotes recebidos dentro da janela de agrupamento são
+    fundidos e passados de uma só vez a `aplicar`.
+    """
+
+    lote_decodificado = pyqtSignal(object)
+
+    def __init__(self, aplicar: Callable[[LoteSnapshot], None], janela_ms: int = JANELA_AGRUPAMENTO_MS, parent=None):
+        super().__init__(parent)
+        self._aplicar = aplicar
+        self._entrada: "queue.Queue" = queue.Queue()
+        self._pendentes: List[LoteSnapshot] = []
+        self._inicial_convertido = False
+        # O próximo snapshot do listener principal é o primeiro desde que foi ligado.
+        self._aguarda_inicial = True
+        self._lock = threading.Lock()
+        self.contadores = {"enfileirados": 0, "coalescidos": 0, "aplicados": 0}
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(janela_ms)
+        self._timer.timeout.connect(self._descarregar)
+        self.lote_decodificado.connect(self._receber)
+
+        self._thread = threading.Thread(target=self._trabalhar, name="decodificador-snapshots", daemon=True)
+        self._thread.start()
+
+    def enfileirar(self, doc_snapshot, changes, read_time):
+        """Chamado na thread do listener: não converte nada, só enfileira."""
+        with self._lock:
+            self.contadores["enfileirados"] += 1
+        self._entrada.put(("snapshot", doc_snapshot, changes, time.perf_counter()))
+
+    def enfileirar_exclusoes(self, doc_snapshot, changes, read_time):
+        """Callback do listener das exclusões: cada documento novo é um registo apagado."""
+        with self._lock:
+            self.contadores["enfileirados"] += 1
+        self._entrada.put(("exclusoes", doc_snapshot, changes, time.perf_counter()))
+
+    def enfileirar_lote(self, lote: LoteSnapshot):
+        """Um lote já convertido (vindo do relay): segue pela mesma fila, para manter a ordem."""
+        with self._lock:
+            self.contadores["enfileirados"] += 1
+        self._entrada.put(("lote", lote, None, time.perf_counter()))
+
+    def definir_proximo_completo(self, completo: bool):
+        """Indica se o próximo snapshot traz a coleção inteira ou só alterações.
+
+        Passa pela fila para valer a partir do listener que vai ser ligado a seguir.
+        """
+        self._entrada.put(("modo", completo, None, None))
+
+    def parar(self):
+        self._entrada.put(None)
+
+    def _trabalhar(self):
+        while True:
+            item = self._entrada.get()
+            if item is None:
+                return
+            tipo, doc_snapshot, changes, recebido_em = item
+            if tipo == "modo":
+                self._inicial_convertido = not doc_snapshot
+                self._aguarda_inicial = True
+                continue
+            if tipo == "lote":
+                metricas.registar("snapshot.espera_fila", (time.perf_counter() - recebido_em) * 1000)
+                self.lote_decodificado.emit(doc_snapshot._replace(recebido_em=recebido_em))
+                continue
+            inicio = time.perf_counter()
+            metricas.registar("snapshot.espera_fila", (inicio - recebido_em) * 1000)
+            metricas.registar("snapshot.documentos", len(changes), "docs")
+            try:
+                if tipo == "exclusoes":
+                    docs = [c.document for c in changes if c.type.name != 'REMOVED']
+                    lote = LoteSnapshot(
+                        alteracoes=[('REMOVED', doc.id, None) for doc in docs],
+                        marca=maior_marca(*(doc.to_dict().get("EXCLUIDO_EM") for doc in docs)),
+                    )
+                elif not self._inicial_convertido:
+                    registros = [converter_documento(doc) for doc in doc_snapshot]
+                    lote = LoteSnapshot(completo=registros,
+                                        marca=maior_marca(*(reg.get("ATUALIZADO_EM") for reg in registros)))
+                    self._inicial_convertido = True
+                else:
+                    alteracoes = [
+                        (c.type.name, c.document.id,
+                         None if c.type.name == 'REMOVED' else converter_documento(c.document))
+                        for c in changes
+                    ]
+                    lote = LoteSnapshot(alteracoes=alteracoes, marca=maior_marca(
+                        *(reg.get("ATUALIZADO_EM") for _, _, reg in alteracoes if reg is not None)))
+                if tipo == "snapshot":
+                    lote = lote._replace(inicial=self._aguarda_inicial)
+                    self._aguarda_inicial = False
+            except Exception as e:
+                log.exception("Falha ao converter snapshot do Firestore: %s", e)
+                continue
+            metricas.registar("snapshot.decodificar", (time.perf_counter() - inicio) * 1000)
+            self.lote_decodificado.emit(lote._replace(recebido_em=recebido_em))
+
+    def _receber(self, lote: LoteSnapshot):
+        self._pendentes.append(lote)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _descarregar(self):
+        lotes, self._pendentes = self._pendentes, []
+        if not lotes:
+            return
+        with self._lock:
+            self.contadores["coalescidos"] += len(lotes) - 1
+            self.contadores["aplicados"] += 1
+        lote = fundir_lotes(lotes)
+        with metricas.medir("snapshot.aplicar"):
+            self._aplicar(lote)
+        if lote.recebido_em is not None:
+            # Da chegada ao callback até a tabela estar atualizada (inclui a janela de agrupamento).
+            metricas.registar("snapshot.receber_ate_aplicar", (time.perf_counter() - lote.recebido_em) * 1000)
+
+# ------------------------------
+# Cache Local
+# ------------------------------
+
+# Aumentar sempre que mudar o formato dos registos guardados: a cache antiga é descartada.
+VERSAO_ESQUEMA_CACHE = 2
+
+# Documentos gravados sem ATUALIZADO_EM (por versões antigas ou pela consola) escapam às
+# consultas incrementais: passado este tempo desde a última leitura completa, lê-se tudo de novo.
+IDADE_MAXIMA_LEITURA_COMPLETA = timedelta(days=1)
+
+def _json_padrao(valor):
+    if isinstance(valor, Registo):
+        return dict(valor)
+    if isinstance(valor, datetime):
+        return {"$dt": valor.isoformat()}
+    if isinstance(valor, date):
+        return {"$d": valor.isoformat()}
+    if valor is firestore.SERVER_TIMESTAMP:
+        return {"$servidor": True}
+    raise TypeError(f"Tipo não suportado na cache: {type(valor).__name__}")
+
+def _json_objeto(d: Dict[str, Any]):
+    if len(d) == 1:
+        if "$dt" in d:
+            return datetime.fromisoformat(d["$dt"])
+        if "$d" in d:
+            return date.fromisoformat(d["$d"])
+        if "$servidor" in d:
+            return firestore.SERVER_TIMESTAMP
+    return d
+
+class CacheLocal:
+    """Cópia local (SQLite) dos registos e da marca da última sincronização.
+
+    A leitura é feita no arranque, para a tabela aparecer logo. As escritas
+    correm numa thread própria, pela ordem em que foram pedidas; cada lote e
+    a respetiva marca são gravados na mesma transação.
+    """
+
+    def __init__(self, caminho: str, assinatura: str = ""):
+        self.caminho = caminho
+        self._fila: "queue.Queue" = queue.Queue()
+        self._preparar(assinatura)
+        self._thread = threading.Thread(target=self._escrever, name="cache-local", daemon=True)
+        self._thread.start()
+
+    def _ligar(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.caminho)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+        con.execute("CREATE TABLE IF NOT EXISTS registros (id TEXT PRIMARY KEY, dados TEXT NOT NULL)")
+        return con
+
+    def _preparar(self, assinatura: str):
+        """Descarta a cache se mudou o formato dos registos ou o filtro com que foi criada."""
+        with closing(self._ligar()) as con, con:
+            meta = dict(con.execute("SELECT chave, valor FROM meta WHERE chave IN ('versao', 'filtro')"))
+            if meta.get('versao') != str(VERSAO_ESQUEMA_CACHE) or meta.get('filtro', '') != assinatura:
+                con.execute("DELETE FROM registros")
+                con.execute("DELETE FROM meta")
+                con.execute("INSERT INTO meta VALUES ('versao', ?)", (str(VERSAO_ESQUEMA_CACHE),))
+                con.execute("INSERT INTO meta VALUES ('filtro', ?)", (assinatura,))
+
+    def carregar(self) -> Tuple[List[Registo], Optional[datetime]]:
+        with closing(self._ligar()) as con:
+            registros = [Registo(json.loads(dados, object_hook=_json_objeto))
+                         for (dados,) in con.execute("SELECT dados FROM registros")]
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'marca'").fetchone()
+        return registros, (datetime.fromisoformat(linha[0]) if linha else None)
+
+    def aplicar(self, lote: LoteSnapshot, marca: Optional[datetime]):
+        self._fila.put(("lote", lote, marca))
+
+    def retomar_relay(self) -> Optional[str]:
+        """Token com que o relay envia só o que mudou desde a última sessão."""
+        with closing(self._ligar()) as con:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'relay'").fetchone()
+        return linha[0] if linha else None
+
+    def leitura_completa_em(self) -> Optional[datetime]:
+        """Quando foi gravado o último conjunto completo lido da nuvem."""
+        with closing(self._ligar()) as con:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'completo_em'").fetchone()
+        return datetime.fromisoformat(linha[0]) if linha else None
+
+    def invalidar(self, assinatura: Optional[str] = None):
+        """Esvazia a cache; com `assinatura`, passa a guardar registos desse filtro."""
+        self._fila.put(("invalidar", None, assinatura))
+
+    def fechar(self):
+        self._fila.put(None)
+        self._thread.join(timeout=5)
+
+    def _escrever(self):
+        con = self._ligar()
+        while True:
+            item = self._fila.get()
+            if item is None:
+                break
+            acao, lote, marca = item
+            try:
+                with con:
+                    if acao == "invalidar":
+                        con.execute("DELETE FROM registros")
+                        con.execute("DELETE FROM meta WHERE chave IN ('marca', 'relay', 'completo_em')")
+                        if marca is not None:
+                            con.execute("INSERT OR REPLACE INTO meta VALUES ('filtro', ?)", (marca,))
+                        continue
+                    if lote.completo is not None:
+                        con.execute("DELETE FROM registros")
+                        con.executemany("INSERT INTO registros VALUES (?, ?)", (
+                            (reg['id'], json.dumps(reg, default=_json_padrao)) for reg in lote.completo
+                        ))
+                        con.execute("INSERT OR REPLACE INTO meta VALUES ('completo_em', ?)",
+                                    (datetime.now(timezone.utc).isoformat(),))
+                    else:
+                        for tipo, doc_id, reg in lote.alteracoes:
+                            if tipo == 'REMOVED':
+                                con.execute("DELETE FROM registros WHERE id = ?", (doc_id,))
+                            else:
+                                con.execute("INSERT OR REPLACE INTO registros VALUES (?, ?)",
+                                            (doc_id, json.dumps(reg, default=_json_padrao)))
+                    if marca is not None:
+                        con.execute("INSERT OR REPLACE INTO meta VALUES ('marca', ?)", (marca.isoformat(),))
+                    if lote.retomar is not None:
+                        con.execute("INSERT OR REPLACE INTO meta VALUES ('relay', ?)", (lote.retomar,))
+            except Exception as e:
+                log.exception("Falha ao gravar a cache local: %s", e)
+        con.close()
+
+# ------------------------------
+# Escrita em Lote no Firestore
+# ------------------------------
+
+# O Firestore recusa lotes com mais de 500 operações.
+LIMITE_OPERACOES_LOTE = 500
+MAX_THREADS_ESCRITA = 4
+MAX_TENTATIVAS_ESCRITA = 5
+
+class OperacaoEscrita(NamedTuple):
+    tipo: str  # 'set', 'update' ou 'delete'
+    ref: Any
+    dados: Optional[Dict[str, Any]] = None
+    rotulo: str = ""  # normalmente o ID SGD, usado no relatório de falhas
+
+class ResultadoEscrita(NamedTuple):
+    total: int
+    sucesso: int
+    falhas: List[Tuple[str, str]]  # (rótulo, erro)
+
+def dividir_em_lotes(operacoes: List[OperacaoEscrita], tamanho: int = LIMITE_OPERACOES_LOTE) -> List[List[OperacaoEscrita]]:
+    return [operacoes[i:i + tamanho] for i in range(0, len(operacoes), tamanho)]
+
+class EscritorEmLote(QObject):
+    """Grava uma lista de operações em lotes de até 500, em paralelo e fora da thread da interface.
+
+    Cada lote é confirmado por uma thread de um pool limitado, com novas
+    tentativas e espera exponencial quando o erro é transitório. No fim é
+    emitido um único ResultadoEscrita com o total e as falhas.
+    """
+
+    progresso = pyqtSignal(int, int)  # operações concluídas, total
+    concluido = pyqtSignal(object)    # ResultadoEscrita
+
+    def __init__(self, db, operacoes: List[OperacaoEscrita], parent=None, metrica: str = "escrita.lote"):
+        super().__init__(parent)
+        self.db = db
+        self.operacoes = operacoes
+        self.metrica = metrica  # nome da métrica com a latência de cada commit
+
+    def iniciar(self):
+        threading.Thread(target=self._executar, name="escritor-em-lote", daemon=True).start()
+
+    def _executar(self):
+        total = len(self.operacoes)
+        feitas, sucesso = 0, 0
+        falhas: List[Tuple[str, str]] = []
+        with ThreadPoolExecutor(max_workers=MAX_THREADS_ESCRITA) as pool:
+            futuros = {pool.submit(confirmar_lote, self.db, lote, self.metrica): lote
+                       for lote in dividir_em_lotes(self.operacoes)}
+            for futuro in as_completed(futuros):
+                lote = futuros[futuro]
+                try:
+                    futuro.result()
+                    sucesso += len(lote)
+                except Exception as e:
+                    # Um lote é atómico: se falhou, nenhuma das suas operações foi gravada.
+                    falhas.extend((op.rotulo, str(e)) for op in lote)
+                feitas += len(lote)
+                self.progresso.emit(feitas, total)
+        self.concluido.emit(ResultadoEscrita(total, sucesso, falhas))
+
+def confirmar_lote(db, lote: List[OperacaoEscrita], metrica: str = "escrita.lote"):
+    """Confirma um lote, tentando de novo com espera exponencial se o erro for transitório."""
+    for tentativa in range(MAX_TENTATIVAS_ESCRITA):
+        batch = db.batch()
+        for op in lote:
+            if op.tipo == 'delete':
+                batch.delete(op.ref)
+            elif op.tipo == 'update':
+                batch.update(op.ref, op.dados)
+            else:
+                batch.set(op.ref, op.dados)
+        try:
+            with metricas.medir(metrica):
+                batch.commit()
+            return
+        except erros_transitorios():
+            if tentativa == MAX_TENTATIVAS_ESCRITA - 1:
+                raise
+            time.sleep(0.5 * 2 ** tentativa + random.uniform(0, 0.25))
+
+def expirar_exclusoes(db, exclusoes_ref, limite: datetime) -> int:
+    """Apaga as marcas de exclusão anteriores a `limite` e devolve quantas eram.
+
+    As consultas incrementais só partem de marcas posteriores à última leitura
+    completa, e uma leitura com mais de IDADE_MAXIMA_LEITURA_COMPLETA é repetida:
+    marcas mais antigas do que isso já ninguém as lê.
+    """
+    consulta = exclusoes_ref.where("EXCLUIDO_EM", "<", limite)
+    operacoes = [OperacaoEscrita('delete', doc.reference) for doc in consulta.stream(timeout=TEMPO_LIMITE_ENVIO_S)]
+    for lote in dividir_em_lotes(operacoes):
+        confirmar_lote(db, lote, "escrita.exclusoes_expiradas")
+    return len(operacoes)
+
+# ------------------------------
+# Fila de Gravações (write-behind)
+# ------------------------------
+
+ESTADO_PENDENTE, ESTADO_FALHOU, ESTADO_CONFLITO = "pendente", "falhou", "conflito"
+TEMPO_LIMITE_ENVIO_S = 30
+ESPERA_MAXIMA_REENVIO_S = 60
+# Campos que não contam como alteração numa edição (nem como conflito com a nuvem).
+CAMPOS_SEM_DIFERENCA = {"CRIADO_EM", "ATUALIZADO_EM"}
+
+# Mesmo alfabeto e tamanho dos IDs automáticos do Firestore.
+_CARACTERES_ID = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+def gerar_id_documento() -> str:
+    """ID para um documento novo, gerado sem precisar da ligação ao Firestore."""
+    return "".join(secrets.choice(_CARACTERES_ID) for _ in range(20))
+
+def _valor_comparavel(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    return "" if valor is None else valor
+
+def campos_alterados(base: Dict[str, Any], novos: Dict[str, Any]) -> Dict[str, Any]:
+    """Os campos de `novos` que diferem do registo aberto para edição."""
+    return {campo: valor for campo, valor in novos.items()
+            if campo not in CAMPOS_SEM_DIFERENCA and _valor_comparavel(valor) != _valor_comparavel(base.get(campo))}
+
+def campos_em_conflito(base: Dict[str, Any], alteracoes: Dict[str, Any], remoto: Dict[str, Any]) -> List[str]:
+    """Campos editados que outra pessoa também mudou na nuvem, para um valor diferente do nosso."""
+    return [campo for campo, valor in alteracoes.items() if campo not in CAMPOS_SEM_DIFERENCA
+            and _valor_comparavel(remoto.get(campo)) not in (_valor_comparavel(base.get(campo)), _valor_comparavel(valor))]
+
+def conflito_de_versao(erro: Exception) -> bool:
+    """A pré-condição falhou (FailedPrecondition) ou o documento já não existe (NotFound)."""
+    return isinstance(erro, erros_de_conflito())
+
+def enviar_edicao(db, ref, alteracoes: Dict[str, Any], versao: Optional[str],
+                  timeout: Optional[float] = None) -> Optional[str]:
+    """Grava só os campos alterados, se o documento ainda estiver na versão lida; devolve a nova versão."""
+    opcao = db.write_option(last_update_time=instante_versao(versao)) if versao else None
+    resultado = ref.update({caminho_campo(campo): valor for campo, valor in alteracoes.items()},
+                           option=opcao, timeout=timeout)
+    return versao_documento(resultado)
+
+class EntradaFila(NamedTuple):
+    seq: int
+    doc_id: str
+    dados: Dict[str, Any]
+    estado: str
+    erro: str
+    operacao: str = 'set'  # 'set' grava o registo inteiro; 'update' só os campos editados
+    base: Optional[Dict[str, Any]] = None  # valores dos campos editados quando o registo foi aberto
+    versao: Optional[str] = None  # versão do documento em que a edição se baseia
+    remoto: Optional[Dict[str, Any]] = None  # documento na nuvem, quando há conflito (None se foi apagado)
+
+def registro_local(doc_id: str, dados: Dict[str, Any]) -> Registo:
+    """O registo como ficará na nuvem, para o mostrar antes de a gravação ser confirmada."""
+    agora = datetime.now()
+    return converter_dados(doc_id, {
+        campo: agora if valor is firestore.SERVER_TIMESTAMP else valor for campo, valor in dados.items()
+    })
+
+def _json_ou_none(valor) -> Optional[str]:
+    return None if valor is None else json.dumps(valor, default=_json_padrao)
+
+def _de_json_ou_none(texto: Optional[str]):
+    return None if texto is None else json.loads(texto, object_hook=_json_objeto)
+
+class FilaEscrita(QObject):
+    """Gravações de registos à espera de serem enviadas ao Firestore.
+
+    Cada gravação fica primeiro num ficheiro SQLite, o que faz com que sobreviva
+    a falhas de rede e ao fecho da aplicação. Depois de criado o ficheiro, todo
+    o acesso a ele a pedido da interface (guardar, listar, repetir, descartar)
+    é feito por uma thread própria, pela ordem dos pedidos; as respostas chegam
+    à thread da interface pela função `ao_concluir` de cada pedido.
+    Outra thread envia-as pela ordem em que foram feitas, uma de cada vez; erros transitórios
+    (sem rede, timeout) são repetidos com espera exponencial, os restantes
+    marcam a gravação como falhada. Uma gravação falhada bloqueia as seguintes
+    do mesmo documento, mas não as dos outros.
+
+    As edições levam só os campos alterados e a versão do documento em que se
+    basearam. Se entretanto outra pessoa gravou o documento, a edição é
+    reaplicada sobre a nova versão quando os campos mudados não coincidem;
+    caso contrário fica em conflito até o utilizador escolher qual manter.
+    """
+
+    # doc_id, estado (ESTADO_PENDENTE, ESTADO_FALHOU, ESTADO_CONFLITO ou "" quando já não há nada por enviar), erro
+    estado_alterado = pyqtSignal(str, str, str)
+    # ao_concluir, resultado: emitido pela thread "fila-pedidos", entregue na thread da interface.
+    _resposta = pyqtSignal(object, object)
+
+    def __init__(self, caminho: str, parent=None):
+        super().__init__(parent)
+        self.caminho = caminho
+        self.db = None
+        self.colecao_ref = None
+        # Só aqui o ficheiro é aberto na thread da interface: se não puder ser criado, a janela grava sem fila.
+        with closing(sqlite3.connect(caminho, timeout=10)) as con, con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS fila ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT NOT NULL, dados TEXT NOT NULL,"
+                f" estado TEXT NOT NULL DEFAULT '{ESTADO_PENDENTE}', erro TEXT NOT NULL DEFAULT '')"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS fila_doc ON fila (doc_id, seq)")
+            # Colunas acrescentadas depois da primeira versão da fila.
+            existentes = {linha[1] for linha in con.execute("PRAGMA table_info(fila)")}
+            for coluna, definicao in (("operacao", "TEXT NOT NULL DEFAULT 'set'"), ("base", "TEXT"),
+                                      ("versao", "TEXT"), ("remoto", "TEXT")):
+                if coluna not in existentes:
+                    con.execute(f"ALTER TABLE fila ADD COLUMN {coluna} {definicao}")
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._resposta.connect(self._entregar_resposta)
+        # (função, ao_concluir): a thread "fila-pedidos" corre-as pela ordem em que chegam.
+        self._pedidos: "queue.Queue" = queue.Queue()
+        self._atendedor = threading.Thread(target=self._atender_pedidos, name="fila-pedidos", daemon=True)
+        self._atendedor.start()
+
+    def iniciar(self, db, colecao_ref):
+        """Começa a enviar, quando a ligação ao Firestore está pronta; até lá as gravações só se acumulam."""
+        self.db = db
+        self.colecao_ref = colecao_ref
+        self._thread = threading.Thread(target=self._executar, name="fila-escrita", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        """Para o envio; o que ficou por enviar segue no próximo arranque."""
+        self._pedidos.put(None)
+        self._atendedor.join(timeout=5)
+        self._parar.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def _pedir(self, funcao: Callable[[sqlite3.Connection], Any], ao_concluir: Optional[Callable[[Any], None]] = None):
+        self._pedidos.put((funcao, ao_concluir))
+
+    def _atender_pedidos(self):
+        con = sqlite3.connect(self.caminho, timeout=10)
+        while True:
+            pedido = self._pedidos.get()
+            if pedido is None:
+                break
+            funcao, ao_concluir = pedido
+            try:
+                resultado = funcao(con)
+            except Exception as e:
+                log.exception("Fila de gravações: falha ao aceder ao ficheiro local: %s", e)
+                continue
+            if ao_concluir is not None:
+                self._resposta.emit(ao_concluir, resultado)
+            self._acordar.set()
+        con.close()
+
+    def _entregar_resposta(self, ao_concluir: Callable[[Any], None], resultado):
+        ao_concluir(resultado)
+
+    def entradas(self, ao_concluir: Callable[[List[EntradaFila]], None], estado: Optional[str] = None):
+        def ler(con) -> List[EntradaFila]:
+            sql = "SELECT seq, doc_id, dados, estado, erro, operacao, base, versao, remoto FROM fila"
+            linhas = con.execute(sql + (" WHERE estado = ? ORDER BY seq" if estado else " ORDER BY seq"),
+                                 (estado,) if estado else ()).fetchall()
+            return [EntradaFila(seq, doc_id, json.loads(dados, object_hook=_json_objeto), estado, erro, operacao,
+                                _de_json_ou_none(base), versao, _de_json_ou_none(remoto))
+                    for seq, doc_id, dados, estado, erro, operacao, base, versao, remoto in linhas]
+        self._pedir(ler, ao_concluir)
+
+    def enfileirar(self, doc_id: str, dados: Dict[str, Any], base: Optional[Dict[str, Any]] = None,
+                   versao: Optional[str] = None, ao_concluir: Optional[Callable[[str], None]] = None):
+        """Guarda a gravação; `ao_concluir` recebe o estado do documento (falhado ou em conflito se uma anterior o bloqueia).
+
+        Com `base`, é uma edição: `dados` tem só os campos alterados e `versao`
+        é a versão do documento que foi aberta para edição.
+        """
+        linha = (doc_id, json.dumps(dados, default=_json_padrao), 'set' if base is None else 'update',
+                 _json_ou_none(base), versao)
+
+        def guardar(con) -> str:
+            try:
+                with con:
+                    bloqueio = con.execute(
+                        f"SELECT estado FROM fila WHERE doc_id = ? AND estado != '{ESTADO_PENDENTE}'"
+                        " ORDER BY seq LIMIT 1", (doc_id,)).fetchone()
+                    con.execute("INSERT INTO fila (doc_id, dados, operacao, base, versao) VALUES (?, ?, ?, ?, ?)",
+                                linha)
+            except sqlite3.Error as e:
+                erro = f"Falha ao guardar a gravação localmente: {e}"
+                self.estado_alterado.emit(doc_id, ESTADO_FALHOU, erro)
+                return ESTADO_FALHOU
+            return bloqueio[0] if bloqueio else ESTADO_PENDENTE
+        self._pedir(guardar, ao_concluir)
+
+    def repetir_falhadas(self, ao_concluir: Callable[[List[str]], None]):
+        """Volta a pôr as gravações falhadas por enviar; `ao_concluir` recebe os documentos."""
+        def repetir(con) -> List[str]:
+            with con:
+                ids = self._ids_falhados(con)
+                con.execute(f"UPDATE fila SET estado = '{ESTADO_PENDENTE}', erro = '' WHERE estado = '{ESTADO_FALHOU}'")
+            return ids
+        self._pedir(repetir, ao_concluir)
+
+    def descartar_falhadas(self, ao_concluir: Callable[[List[Tuple[str, bool]]], None]):
+        """Apaga as gravações falhadas; `ao_concluir` recebe (doc_id, ainda tem gravações pendentes)."""
+        def descartar(con) -> List[Tuple[str, bool]]:
+            with con:
+                ids = self._ids_falhados(con)
+                con.execute(f"DELETE FROM fila WHERE estado = '{ESTADO_FALHOU}'")
+                restantes = {doc_id for (doc_id,) in con.execute("SELECT DISTINCT doc_id FROM fila")}
+            return [(doc_id, doc_id in restantes) for doc_id in ids]
+        self._pedir(descartar, ao_concluir)
+
+    def reaplicar(self, entrada: EntradaFila, dados: Dict[str, Any]):
+        """Resolve um conflito: envia `dados` sobre a versão atual da nuvem.
+
+        Se o documento foi apagado, `dados` é o registo completo e volta a ser criado.
+        """
+        if entrada.remoto is None:
+            sql = (f"UPDATE fila SET estado = '{ESTADO_PENDENTE}', erro = '', operacao = 'set', dados = ?,"
+                   " base = NULL, versao = NULL, remoto = NULL WHERE seq = ?")
+            parametros = (json.dumps(dados, default=_json_padrao), entrada.seq)
+        else:
+            base = {campo: entrada.remoto.get(campo) for campo in dados if campo not in CAMPOS_SEM_DIFERENCA}
+            sql = (f"UPDATE fila SET estado = '{ESTADO_PENDENTE}', erro = '', dados = ?, base = ?, versao = ?,"
+                   " remoto = NULL WHERE seq = ?")
+            parametros = (json.dumps(dados, default=_json_padrao), json.dumps(base, default=_json_padrao),
+                          entrada.remoto.get('_versao'), entrada.seq)
+
+        def reaplicar(con):
+            with con:
+                con.execute(sql, parametros)
+        self._pedir(reaplicar)
+
+    def descartar(self, seq: int, ao_concluir: Callable[[bool], None]):
+        """Apaga uma gravação; `ao_concluir` recebe se o documento ainda tem outras por enviar."""
+        def descartar(con) -> bool:
+            with con:
+                doc_id = con.execute("SELECT doc_id FROM fila WHERE seq = ?", (seq,)).fetchone()
+                con.execute("DELETE FROM fila WHERE seq = ?", (seq,))
+                return doc_id is not None and con.execute(
+                    "SELECT 1 FROM fila WHERE doc_id = ? LIMIT 1", doc_id).fetchone() is not None
+        self._pedir(descartar, ao_concluir)
+
+    @staticmethod
+    def _ids_falhados(con) -> List[str]:
+        return [doc_id for (doc_id,) in con.execute(
+            f"SELECT DISTINCT doc_id FROM fila WHERE estado = '{ESTADO_FALHOU}'")]
+
+    def _executar(self):
+        con = sqlite3.connect(self.caminho, timeout=10)
+        tentativa = 0
+        while not self._parar.is_set():
+            self._acordar.clear()
+            # A gravação mais antiga de cada documento, se não estiver falhada nem em conflito.
+            proxima = con.execute(
+                f"SELECT seq, doc_id, dados, operacao, base, versao FROM fila f WHERE estado = '{ESTADO_PENDENTE}'"
+                " AND NOT EXISTS (SELECT 1 FROM fila g WHERE g.doc_id = f.doc_id AND g.seq < f.seq)"
+                " ORDER BY seq LIMIT 1"
+            ).fetchone()
+            if proxima is None:
+                self._acordar.wait()
+                continue
+            seq, doc_id, dados, operacao, base, versao = proxima
+            dados = json.loads(dados, object_hook=_json_objeto)
+            ref = self.colecao_ref.document(doc_id)
+            try:
+                with metricas.medir("escrita.gravar"):
+                    if operacao == 'update':
+                        nova_versao = enviar_edicao(self.db, ref, dados, versao, TEMPO_LIMITE_ENVIO_S)
+                    else:
+                        nova_versao = versao_documento(ref.set(dados, timeout=TEMPO_LIMITE_ENVIO_S))
+            except erros_transitorios():
+                # Sem rede: tenta de novo mais tarde, sem passar à frente de nada.
+                self._acordar.wait(min(0.5 * 2 ** tentativa, ESPERA_MAXIMA_REENVIO_S) + random.uniform(0, 0.25))
+                tentativa += 1
+                continue
+            except Exception as e:
+                if operacao == 'update' and conflito_de_versao(e):
+                    try:
+                        self._tratar_conflito(con, seq, ref, dados, _de_json_ou_none(base))
+                    except erros_transitorios():
+                        self._acordar.wait(min(0.5 * 2 ** tentativa, ESPERA_MAXIMA_REENVIO_S))
+                        tentativa += 1
+                    continue
+                self._marcar(con, seq, doc_id, ESTADO_FALHOU, str(e))
+                continue
+            tentativa = 0
+            with con:
+                con.execute("DELETE FROM fila WHERE seq = ?", (seq,))
+                if nova_versao:
+                    # As edições seguintes do documento partiram da versão que esta gravação substituiu.
+                    con.execute("UPDATE fila SET versao = ? WHERE doc_id = ? AND operacao = 'update' AND versao IS ?",
+                                (nova_versao, doc_id, versao))
+                resta = con.execute("SELECT 1 FROM fila WHERE doc_id = ? LIMIT 1", (doc_id,)).fetchone()
+            self.estado_alterado.emit(doc_id, ESTADO_PENDENTE if resta else "", "")
+        con.close()
+
+    def _tratar_conflito(self, con, seq: int, ref, dados: Dict[str, Any], base: Dict[str, Any]):
+        """O documento mudou na nuvem depois de a edição ter sido feita."""
+        try:
+            snap = ref.get(timeout=TEMPO_LIMITE_ENVIO_S)
+        except erros_transitorios():
+            raise
+        except Exception as e:
+            self._marcar(con, seq, ref.id, ESTADO_FALHOU, str(e))
+            return
+        remoto = snap.to_dict() if snap.exists else None
+        colisoes = campos_em_conflito(base or {}, dados, remoto) if remoto is not None else []
+        if remoto is not None and not colisoes:
+            # Mudaram outros campos: a edição continua válida sobre a versão atual.
+            with con:
+                con.execute("UPDATE fila SET versao = ? WHERE seq = ?", (versao_documento(snap), seq))
+            return
+        if remoto is None:
+            erro = "O registo foi apagado na nuvem."
+        else:
+            remoto['_versao'] = versao_documento(snap)
+            erro = "Alterado na nuvem por outra pessoa: " + ", ".join(colisoes)
+        self._marcar(con, seq, ref.id, ESTADO_CONFLITO, erro, remoto)
+
+    def _marcar(self, con, seq: int, doc_id: str, estado: str, erro: str, remoto: Optional[Dict[str, Any]] = None):
+        with con:
+            con.execute("UPDATE fila SET estado = ?, erro = ?, remoto = ? WHERE seq = ?",
+                        (estado, erro, _json_ou_none(remoto), seq))
+        self.estado_alterado.emit(doc_id, estado, erro)
+
+# ------------------------------
+# Exportação
+# ------------------------------
+
+# Linhas escritas entre cada atualização do progresso (e verificação de cancelamento).
+PASSO_EXPORTACAO = 1000
+FORMATOS_EXPORTACAO = {
+    ".xlsx": "Planilha Excel (*.xlsx)",
+    ".csv": "CSV separado por ponto e vírgula (*.csv)",
+    ".parquet": "Parquet (*.parquet)",
+}
+
+class ExportacaoCancelada(Exception):
+    pass
+
+def linhas_exportacao(registros: Iterable[Registo]) -> Iterable[list]:
+    """Gera uma linha por registo, com os valores na ordem de COLUNAS.
+
+    As datas seguem como date (ou None) e o TEMPO RESTANTE é calculado no momento.
+    """
+    for r in registros:
+        linha = r.valores()
+        vencimento = linha[COL_VENCIMENTO]
+        linha[COL_TEMPO] = dias_restantes(vencimento) if vencimento else None
+        yield linha
+
+def formato_disponivel(extensao: str, operacao: str = "exportação") -> Optional[str]:
+    """Devolve None se o formato pode ser usado, ou a mensagem a mostrar se falta uma biblioteca."""
+    if extensao == ".xlsx" and importlib.util.find_spec("openpyxl") is None:
+        return f"A {operacao} para Excel requer a biblioteca 'openpyxl'. Instale com:\n\n    pip install openpyxl"
+    if extensao == ".parquet" and importlib.util.find_spec("pyarrow") is None:
+        return f"A {operacao} para Parquet requer a biblioteca 'pyarrow'. Instale com:\n\n    pip install pyarrow"
+    return None
+
+def _escrever_xlsx(caminho: str, linhas: Iterable[list]):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    # Modo write-only: as linhas vão directamente para o ficheiro, sem manter a folha em memória.
+    livro = Workbook(write_only=True)
+    folha = livro.create_sheet("Registos")
+    folha.append(COLUNAS)
+    for linha in linhas:
+        celulas = []
+        for valor in linha:
+            if isinstance(valor, date):
+                celula = WriteOnlyCell(folha, value=valor)
+                celula.number_format = "DD/MM/YYYY"
+                celulas.append(celula)
+            else:
+                celulas.append(valor)
+        folha.append(celulas)
+    livro.save(caminho)
+
+def _escrever_csv(caminho: str, linhas: Iterable[list]):
+    # utf-8-sig e ';' para o Excel em português abrir o ficheiro sem assistente de importação.
+    with open(caminho, "w", newline="", encoding="utf-8-sig") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(COLUNAS)
+        for linha in linhas:
+            escritor.writerow([texto_data(v) if isinstance(v, date) else ("" if v is None else v) for v in linha])
+
+def _escrever_parquet(caminho: str, linhas: Iterable[list]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tipos = {COL_QTD_HP: pa.int64(), COL_ABERTURA: pa.date32(), COL_VENCIMENTO: pa.date32(), COL_TEMPO: pa.int64()}
+    esquema = pa.schema([(nome, tipos.get(c, pa.string())) for c, nome in enumerate(COLUNAS)])
+
+    def grupo(bloco: List[list]):
+        return pa.Table.from_arrays(
+            [pa.array([linha[c] for linha in bloco], type=campo.type) for c, campo in enumerate(esquema)],
+            schema=esquema,
+        )
+
+    with pq.ParquetWriter(caminho, esquema) as escritor:
+        bloco: List[list] = []
+        for linha in linhas:
+            bloco.append(linha)
+            if len(bloco) >= PASSO_EXPORTACAO * 10:
+                escritor.write_table(grupo(bloco))
+                bloco = []
+        if bloco:
+            escritor.write_table(grupo(bloco))
+
+ESCRITORES_EXPORTACAO: Dict[str, Callable[[str, Iterable[list]], None]] = {
+    ".xlsx": _escrever_xlsx,
+    ".csv": _escrever_csv,
+    ".parquet": _escrever_parquet,
+}
+
+class ExportadorRegistos(QObject):
+    """Grava os registos num ficheiro fora da thread da interface.
+
+    As linhas são geradas à medida que o ficheiro é escrito, por isso a memória
+    usada não cresce com o número de registos. O ficheiro é escrito com um nome
+    temporário e só substitui o destino no fim; se a exportação for cancelada ou
+    falhar, o destino fica intacto.
+    """
+
+    progresso = pyqtSignal(int, int)  # linhas escritas, total
+    concluido = pyqtSignal(object)    # None se correu bem, ou a exceção
+
+    def __init__(self, registros: List[Registo], caminho: str, parent=None):
+        super().__init__(parent)
+        self.registros = registros
+        self.caminho = caminho
+        self._cancelar = threading.Event()
+
+    def iniciar(self):
+        threading.Thread(target=self._executar, name="exportador", daemon=True).start()
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    def _linhas(self) -> Iterable[list]:
+        total = len(self.registros)
+        for n, linha in enumerate(linhas_exportacao(self.registros), 1):
+            yield linha
+            if n % PASSO_EXPORTACAO == 0 or n == total:
+                if self._cancelar.is_set():
+                    raise ExportacaoCancelada()
+                self.progresso.emit(n, total)
+
+    def _executar(self):
+        extensao = os.path.splitext(self.caminho)[1].lower()
+        temporario = self.caminho + ".parcial"
+        try:
+            ESCRITORES_EXPORTACAO[extensao](temporario, self._linhas())
+            os.replace(temporario, self.caminho)
+            erro = None
+        except Exception as e:
+            erro = e
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+        self.concluido.emit(erro)
+
+# ------------------------------
+# Importação
+# ------------------------------
+
+FORMATOS_IMPORTACAO = "Planilha ou CSV (*.xlsx *.csv)"
+# Consultas "in" do Firestore aceitam até 30 valores.
+LIMITE_CONSULTA_IN = 30
+# Colunas que não são lidas: TEMPO RESTANTE é sempre calculado a partir do VENCIMENTO.
+COLUNAS_IGNORADAS_IMPORTACAO = {"TEMPO RESTANTE"}
+
+class ErroImportacao(NamedTuple):
+    linha: int   # linha do ficheiro (o cabeçalho é a linha 1)
+    id_sgd: str
+    motivo: str
+
+class RelatorioImportacao(NamedTuple):
+    lidas: int
+    importadas: int  # numa simulação, as que seriam importadas
+    erros: List[ErroImportacao]
+    simulacao: bool
+    interrompida: bool = False  # cancelada: as linhas seguintes não foram lidas
+
+def gravar_relatorio_importacao(caminho: str, erros: Iterable[ErroImportacao]):
+    with open(caminho, "w", newline="", encoding="utf-8-sig") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(["Linha", "ID SGD", "Motivo"])
+        escritor.writerows(erros)
+
+def _texto_celula(valor) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        # O Excel guarda "12345" como 12345.0.
+        valor = int(valor)
+    return str(valor).strip()
+
+def _data_celula(valor) -> Optional[date]:
+    """Aceita datas do Excel e textos dd/mm/aaaa (como na exportação) ou aaaa-mm-dd."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = _texto_celula(valor)
+    if not texto:
+        return None
+    for formato in ("%d/%m/%Y", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(texto)
+
+def _ler_csv(caminho: str) -> Iterable[list]:
+    with open(caminho, newline="", encoding="utf-8-sig") as f:
+        cabecalho = f.readline()
+        delimitador = ";" if cabecalho.count(";") >= cabecalho.count(",") else ","
+        f.seek(0)
+        yield from csv.reader(f, delimiter=delimitador)
+
+def _ler_xlsx(caminho: str) -> Iterable[tuple]:
+    from openpyxl import load_workbook
+    # Modo read-only: as linhas são lidas do ficheiro à medida, sem carregar a folha inteira.
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        folha = livro["Registos"] if "Registos" in livro.sheetnames else livro.active
+        yield from folha.iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+LEITORES_IMPORTACAO: Dict[str, Callable[[str], Iterable[Sequence]]] = {
+    ".xlsx": _ler_xlsx,
+    ".csv": _ler_csv,
+}
+
+def contar_linhas_importacao(caminho: str) -> int:
+    """Número aproximado de linhas de dados, para a barra de progresso (0 se desconhecido)."""
+    try:
+        if caminho.lower().endswith(".xlsx"):
+            from openpyxl import load_workbook
+            livro = load_workbook(caminho, read_only=True)
+            try:
+                folha = livro["Registos"] if "Registos" in livro.sheetnames else livro.active
+                # Nem todos os ficheiros guardam as dimensões da folha: nesse caso fica desconhecido.
+                return max(0, (folha.max_row or 1) - 1)
+            finally:
+                livro.close()
+        with open(caminho, "rb") as f:
+            return max(0, sum(bloco.count(b"\n") for bloco in iter(lambda: f.read(1 << 20), b"")) - 1)
+    except Exception:
+        return 0
+
+def linhas_importacao(caminho: str) -> Iterable[Tuple[int, Dict[str, Any]]]:
+    """Lê o ficheiro à medida, devolvendo (número da linha, {coluna: valor}) por linha não vazia.
+
+    As colunas são reconhecidas pelo cabeçalho, com os nomes de COLUNAS (como na
+    exportação), sem distinguir maiúsculas nem acentos; as restantes são ignoradas.
+    """
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao not in LEITORES_IMPORTACAO:
+        raise ValueError(f"Formato não suportado: {extensao or caminho}")
+    linhas = iter(LEITORES_IMPORTACAO[extensao](caminho))
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        return
+    por_nome = {normalizar(c): c for c in COLUNAS if c not in COLUNAS_IGNORADAS_IMPORTACAO}
+    colunas = [(i, por_nome[normalizar(nome)]) for i, nome in enumerate(cabecalho)
+               if normalizar(nome) in por_nome]
+    if "ID SGD" not in {c for _, c in colunas}:
+        raise ValueError("O ficheiro não tem a coluna 'ID SGD' no cabeçalho.")
+    for numero, valores in enumerate(linhas, 2):
+        if not any(_texto_celula(v) for v in valores):
+            continue
+        yield numero, {coluna: valores[i] if i < len(valores) else None for i, coluna in colunas}
+
+def registo_importado(valores: Dict[str, Any], persistir_tempo_restante: bool = False) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Converte e valida uma linha com as regras do formulário; devolve (dados, "") ou (None, motivo)."""
+    dados = {c: _texto_celula(valores.get(c)) for c in COLUNAS
+             if c not in COLUNAS_IGNORADAS_IMPORTACAO and c not in ("Quantidade HP", "ABERTURA", "VENCIMENTO")}
+    faltando = campos_em_falta(dados)
+    if faltando:
+        return None, f"Campos obrigatórios em falta: {', '.join(faltando)}"
+    try:
+        texto_qtd = _texto_celula(valores.get("Quantidade HP"))
+        dados["Quantidade HP"] = int(float(texto_qtd.replace(",", "."))) if texto_qtd else 0
+    except ValueError:
+        return None, f"Quantidade HP inválida: '{valores.get('Quantidade HP')}'"
+    datas: Dict[str, Optional[date]] = {}
+    for campo in ("ABERTURA", "VENCIMENTO"):
+        try:
+            datas[campo] = _data_celula(valores.get(campo))
+        except ValueError as e:
+            return None, f"{campo} inválida: '{e}'"
+    abertura, vencimento = datas["ABERTURA"], datas["VENCIMENTO"]
+    if abertura is None:
+        return None, "ABERTURA em falta"
+    if vencimento is None:
+        vencimento = calcular_vencimento(abertura, dados["TIPO PA"])
+        if vencimento is None:
+            return None, "VENCIMENTO em falta e o TIPO PA não tem prazo automático"
+    dados["STATUS"] = dados["STATUS"] or "EM ABERTO"
+    dados["ABERTURA"] = datetime.combine(abertura, datetime.min.time())
+    dados["VENCIMENTO"] = datetime.combine(vencimento, datetime.min.time())
+    if persistir_tempo_restante:
+        dados["TEMPO RESTANTE"] = dias_restantes(vencimento)
+    dados["CRIADO_EM"] = datetime.now()
+    dados["ATUALIZADO_EM"] = firestore.SERVER_TIMESTAMP
+    return dados, ""
+
+def ids_existentes(colecao_ref, ids: List[str]) -> Set[str]:
+    """ID SGD da lista que já existem na coleção (uma consulta "in" por cada 30)."""
+    existentes: Set[str] = set()
+    for i in range(0, len(ids), LIMITE_CONSULTA_IN):
+        consulta = colecao_ref.where(caminho_campo("ID SGD"), "in", ids[i:i + LIMITE_CONSULTA_IN])
+        existentes.update(doc.to_dict().get("ID SGD") for doc in consulta.stream(timeout=TEMPO_LIMITE_ENVIO_S))
+    return existentes
+
+def importar_registos(db, colecao_ref, caminho: str, simular: bool = False, persistir_tempo_restante: bool = False,
+                      ao_progresso: Optional[Callable[[int], None]] = None,
+                      cancelado: Optional[Callable[[], bool]] = None) -> RelatorioImportacao:
+    """Importa um .xlsx/.csv para a coleção, em lotes de até 500 gravados em paralelo.
+
+    As linhas são lidas à medida e validadas; as que repetem um ID SGD do
+    próprio ficheiro ou já existente na nuvem são rejeitadas. Cada lote é
+    verificado contra a nuvem e gravado por uma thread do pool, com no máximo
+    2 × MAX_THREADS_ESCRITA lotes em curso, para a memória não crescer com o
+    tamanho do ficheiro. Com simular=True nada é gravado.
+    """
+    erros: List[ErroImportacao] = []
+    vistos: Dict[str, int] = {}
+    lidas = importadas = 0
+    interrompida = False
+
+    def processar(lote: List[Tuple[int, Dict[str, Any]]]) -> Tuple[int, List[ErroImportacao]]:
+        existentes = ids_existentes(colecao_ref, [d["ID SGD"] for _, d in lote])
+        rejeitadas = [ErroImportacao(n, d["ID SGD"], "ID SGD já existe na nuvem")
+                      for n, d in lote if d["ID SGD"] in existentes]
+        novos = [(n, d) for n, d in lote if d["ID SGD"] not in existentes]
+        if novos and not simular:
+            operacoes = [OperacaoEscrita('set', colecao_ref.document(gerar_id_documento()), d, d["ID SGD"])
+                         for _, d in novos]
+            try:
+                confirmar_lote(db, operacoes, "escrita.importacao")
+            except Exception as e:
+                # Um lote é atómico: se falhou, nenhuma das suas linhas foi gravada.
+                return 0, rejeitadas + [ErroImportacao(n, d["ID SGD"], f"Falha ao gravar: {e}") for n, d in novos]
+        return len(novos), rejeitadas
+
+    def recolher(futuro):
+        nonlocal importadas
+        feitas, rejeitadas = futuro.result()
+        importadas += feitas
+        erros.extend(rejeitadas)
+
+    with ThreadPoolExecutor(max_workers=MAX_THREADS_ESCRITA) as pool:
+        em_curso = set()
+        lote: List[Tuple[int, Dict[str, Any]]] = []
+
+        def submeter():
+            nonlocal lote
+            if lote:
+                em_curso.add(pool.submit(processar, lote))
+                lote = []
+            while len(em_curso) >= 2 * MAX_THREADS_ESCRITA:
+                terminado = next(as_completed(em_curso))
+                em_curso.discard(terminado)
+                recolher(terminado)
+
+        for numero, valores in linhas_importacao(caminho):
+            lidas += 1
+            dados, motivo = registo_importado(valores, persistir_tempo_restante)
+            if dados is None:
+                erros.append(ErroImportacao(numero, _texto_celula(valores.get("ID SGD")), motivo))
+            elif dados["ID SGD"] in vistos:
+                erros.append(ErroImportacao(numero, dados["ID SGD"],
+                                            f"ID SGD repetido no ficheiro (linha {vistos[dados['ID SGD']]})"))
+            else:
+                vistos[dados["ID SGD"]] = numero
+                lote.append((numero, dados))
+                if len(lote) >= LIMITE_OPERACOES_LOTE:
+                    submeter()
+            if lidas % PASSO_EXPORTACAO == 0:
+                if cancelado is not None and cancelado():
+                    # Os lotes já enviados terminam; o que ficou por enviar é descartado.
+                    interrompida = True
+                    break
+                if ao_progresso is not None:
+                    ao_progresso(lidas)
+        if not interrompida:
+            submeter()
+        for futuro in as_completed(em_curso):
+            recolher(futuro)
+    if ao_progresso is not None:
+        ao_progresso(lidas)
+    erros.sort()
+    return RelatorioImportacao(lidas, importadas, erros, simular, interrompida)
+
+class ImportadorRegistos(QObject):
+    """Corre importar_registos fora da thread da interface."""
+
+    progresso = pyqtSignal(int, int)  # linhas lidas, total estimado (0 se desconhecido)
+    concluido = pyqtSignal(object)    # RelatorioImportacao, ou a exceção
+
+    def __init__(self, db, colecao_ref, caminho: str, simular: bool, persistir_tempo_restante: bool, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.colecao_ref = colecao_ref
+        self.caminho = caminho
+        self.simular = simular
+        self.persistir_tempo_restante = persistir_tempo_restante
+        self._cancelar = threading.Event()
+
+    def iniciar(self):
+        threading.Thread(target=self._executar, name="importador", daemon=True).start()
+
+    def cancelar(self):
+        self._cancelar.set()
+
+    def _executar(self):
+        total = contar_linhas_importacao(self.caminho)
+        try:
+            resultado = importar_registos(
+                self.db, self.colecao_ref, self.caminho, self.simular, self.persistir_tempo_restante,
+                ao_progresso=lambda lidas: self.progresso.emit(lidas, total),
+                cancelado=self._cancelar.is_set,
+            )
+        except Exception as e:
+            resultado = e
+        self.concluido.emit(resultado)
+
+# ------------------------------
+# Agenda de Prazos
+# ------------------------------
+
+FAIXA_A_VENCER, FAIXA_VENCIDO = 1, 2
+# Avisos que chegam dentro desta janela são mostrados juntos.
+JANELA_AVISOS_MS = 1500
+# O temporizador nunca espera mais do que isto, para corrigir o atraso após suspensão/hibernação.
+ESPERA_MAXIMA_AGENDA_MS = 60 * 60 * 1000
+
+def faixa_prazo(vencimento: date, hoje: date) -> int:
+    dias = (vencimento - hoje).days
+    if dias <= 0:
+        return FAIXA_VENCIDO
+    if dias <= DIAS_AVISO_PRAZO:
+        return FAIXA_A_VENCER
+    return 0
+
+def proxima_mudanca_faixa(vencimento: date, faixa: int) -> Optional[date]:
+    """Dia em que um registo na faixa indicada passa para a seguinte (None se já está vencido)."""
+    if faixa == 0:
+        return vencimento - timedelta(days=DIAS_AVISO_PRAZO)
+    if faixa == FAIXA_A_VENCER:
+        return vencimento
+    return None
+
+class AgendaPrazos(QObject):
+    """Acompanha os prazos dos registos em aberto e avisa quando mudam de faixa.
+
+    Mantém um heap com a próxima mudança de faixa de cada registo (a vencer em
+    até DIAS_AVISO_PRAZO dias, depois vencido) e um único QTimer armado para a
+    mais próxima. As entradas de registos alterados ou removidos não são
+    retiradas do heap: são ignoradas quando chegam ao topo.
+    Cada registo é avisado uma só vez por faixa, enquanto o VENCIMENTO não mudar;
+    ao ser esquecido (removido ou finalizado) perde também os avisos já dados.
+    """
+
+    avisos = pyqtSignal(object)  # List[Tuple[doc_id, faixa, vencimento]]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._heap: List[Tuple[date, str, date]] = []  # (próxima mudança, doc_id, vencimento)
+        # doc_id -> (vencimento, próxima mudança): uma entrada do heap só é válida se coincidir.
+        self._seguidos: Dict[str, Tuple[date, Optional[date]]] = {}
+        self._avisados: Dict[str, Tuple[date, int]] = {}
+        self._pendentes: Dict[str, Tuple[int, date]] = {}
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.verificar)
+        self._timer_avisos = QTimer(self)
+        self._timer_avisos.setSingleShot(True)
+        self._timer_avisos.setInterval(JANELA_AVISOS_MS)
+        self._timer_avisos.timeout.connect(self._emitir_avisos)
+
+    def __len__(self) -> int:
+        return len(self._seguidos)
+
+    def redefinir(self, registros: Iterable[Dict[str, Any]]):
+        hoje = date.today()
+        self._heap = []
+        self._seguidos = {}
+        for reg in registros:
+            self._registar(reg, hoje, empilhar=False)
+        heapq.heapify(self._heap)
+        self._armar()
+
+    def acompanhar(self, reg: Dict[str, Any]):
+        """Regista (ou atualiza) um registo; os finalizados e sem vencimento deixam de ser seguidos."""
+        self._registar(reg, date.today(), empilhar=True)
+        self._armar()
+
+    def esquecer(self, doc_id: str):
+        self._seguidos.pop(doc_id, None)
+        self._avisados.pop(doc_id, None)
+        self._pendentes.pop(doc_id, None)
+
+    def verificar(self, hoje: Optional[date] = None):
+        """Processa as mudanças de faixa que já chegaram e volta a armar o temporizador."""
+        hoje = hoje or date.today()
+        while self._heap and self._heap[0][0] <= hoje:
+            entrada = heapq.heappop(self._heap)
+            if self._valida(entrada):
+                self._avaliar(entrada[1], entrada[2], hoje, empilhar=True)
+        self._armar()
+
+    def _registar(self, reg: Dict[str, Any], hoje: date, empilhar: bool):
+        doc_id, vencimento = reg['id'], reg.get("VENCIMENTO")
+        if reg.get("STATUS") == "FINALIZADO" or not isinstance(vencimento, date):
+            self.esquecer(doc_id)
+            return
+        seguido = self._seguidos.get(doc_id)
+        if seguido is not None and seguido[0] == vencimento:
+            return
+        self._avaliar(doc_id, vencimento, hoje, empilhar)
+        # Entradas obsoletas acumulam-se com as edições; de vez em quando o heap é refeito.
+        if empilhar and len(self._heap) > 2 * len(self._seguidos) + 64:
+            self._heap = [e for e in self._heap if self._valida(e)]
+            heapq.heapify(self._heap)
+
+    def _valida(self, entrada: Tuple[date, str, date]) -> bool:
+        proxima, doc_id, vencimento = entrada
+        return self._seguidos.get(doc_id) == (vencimento, proxima)
+
+    def _avaliar(self, doc_id: str, vencimento: date, hoje: date, empilhar: bool):
+        faixa = faixa_prazo(vencimento, hoje)
+        avisado = self._avisados.get(doc_id)
+        if faixa and (avisado is None or avisado[0] != vencimento or avisado[1] < faixa):
+            self._avisados[doc_id] = (vencimento, faixa)
+            self._pendentes[doc_id] = (faixa, vencimento)
+            if not self._timer_avisos.isActive():
+                self._timer_avisos.start()
+        proxima = proxima_mudanca_faixa(vencimento, faixa)
+        self._seguidos[doc_id] = (vencimento, proxima)
+        if proxima is not None:
+            entrada = (proxima, doc_id, vencimento)
+            if empilhar:
+                heapq.heappush(self._heap, entrada)
+            else:
+                self._heap.append(entrada)
+
+    def _armar(self):
+        while self._heap and not self._valida(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            self._timer.stop()
+            return
+        # As faixas mudam à meia-noite; um segundo de folga para date.today() já devolver o novo dia.
+        instante = datetime.combine(self._heap[0][0], datetime.min.time()) + timedelta(seconds=1)
+        espera = int((instante - datetime.now()).total_seconds() * 1000)
+        self._timer.start(max(0, min(espera, ESPERA_MAXIMA_AGENDA_MS)))
+
+    def _emitir_avisos(self):
+        # Registos que entretanto deixaram de ser seguidos (finalizados, apagados) não são avisados.
+        avisos = [(doc_id, faixa, vencimento) for doc_id, (faixa, vencimento) in self._pendentes.items()
+                  if self._seguidos.get(doc_id, (None,))[0] == vencimento]
+        self._pendentes = {}
+        if avisos:
+            self.avisos.emit(avisos)
+
+# ------------------------------
+# Agregados do Painel
+# ------------------------------
+
+DIMENSOES_AGREGADOS = ("BASE GED", "STATUS", "CIDADE")
+
+class Contagem:
+    __slots__ = ("registos", "em_aberto", "vencidos", "a_vencer", "qtd_hp")
+
+    def __init__(self):
+        self.registos = self.em_aberto = self.vencidos = self.a_vencer = self.qtd_hp = 0
+
+class _Contribuicao(NamedTuple):
+    grupos: Tuple[str, ...]  # um valor por dimensão
+    qtd_hp: int
+    aberto: bool
+    vencimento: int          # ordinal, 0 sem vencimento
+    faixa: int
+
+class Agregados:
+    """Contagens e somas por BASE GED, STATUS e CIDADE, mantidas a cada alteração.
+
+    Guarda a contribuição de cada registo: atualizar é subtrair a antiga e somar
+    a nova, sem voltar a percorrer os registos. Os registos em aberto estão
+    também indexados por dia de vencimento, para que a mudança de dia só
+    reavalie os que mudam de faixa (os que vencem hoje ou entram nos
+    DIAS_AVISO_PRAZO dias).
+    """
+
+    def __init__(self, dimensoes: Tuple[str, ...] = DIMENSOES_AGREGADOS):
+        self.dimensoes = dimensoes
+        self._hoje = date.today().toordinal()
+        # Aumenta a cada alteração: a vista só se redesenha se mudou.
+        self.versao = 0
+        self.redefinir([])
+
+    def redefinir(self, registros: Iterable[Dict[str, Any]], hoje: Optional[date] = None):
+        if hoje is not None:
+            self._hoje = hoje.toordinal()
+        self._grupos: List[Dict[str, Contagem]] = [{} for _ in self.dimensoes]
+        self._total = Contagem()
+        self._contribuicoes: Dict[str, _Contribuicao] = {}
+        self._por_vencimento: Dict[int, Set[str]] = {}
+        self.versao += 1
+        for reg in registros:
+            self.acompanhar(reg)
+
+    def acompanhar(self, reg: Dict[str, Any]):
+        """Acrescenta ou atualiza um registo."""
+        doc_id = reg['id']
+        try:
+            qtd_hp = int(reg.get("Quantidade HP", 0))
+        except (TypeError, ValueError):
+            qtd_hp = 0
+        aberto = reg.get("STATUS") != "FINALIZADO"
+        vencimento = _ordinal(reg.get("VENCIMENTO"))
+        nova = _Contribuicao(
+            tuple(sys.intern(str(reg.get(campo) or "")) for campo in self.dimensoes),
+            qtd_hp, aberto, vencimento, self._faixa(aberto, vencimento),
+        )
+        antiga = self._contribuicoes.get(doc_id)
+        if antiga == nova:
+            return
+        if antiga is not None:
+            self._aplicar(doc_id, antiga, -1)
+        self._aplicar(doc_id, nova, 1)
+
+    def esquecer(self, doc_id: str):
+        antiga = self._contribuicoes.get(doc_id)
+        if antiga is not None:
+            self._aplicar(doc_id, antiga, -1)
+
+    def definir_hoje(self, hoje: date):
+        """Muda o dia de referência, reavaliando só os registos que podem mudar de faixa."""
+        novo, antigo = hoje.toordinal(), self._hoje
+        if novo == antigo:
+            return
+        self._hoje = novo
+        inicio, fim = min(novo, antigo), max(novo, antigo)
+        # A faixa de um vencimento v muda quando v - hoje atravessa 0 ou DIAS_AVISO_PRAZO.
+        dias = set(range(inicio + 1, fim + 1)) | set(range(inicio + 1 + DIAS_AVISO_PRAZO, fim + 1 + DIAS_AVISO_PRAZO))
+        if len(dias) > len(self._por_vencimento):
+            dias = set(self._por_vencimento)
+        for vencimento in dias:
+            for doc_id in list(self._por_vencimento.get(vencimento, ())):
+                antiga = self._contribuicoes[doc_id]
+                faixa = self._faixa(antiga.aberto, antiga.vencimento)
+                if faixa != antiga.faixa:
+                    self._aplicar(doc_id, antiga, -1)
+                    self._aplicar(doc_id, antiga._replace(faixa=faixa), 1)
+
+    def grupos(self, dimensao: str) -> Dict[str, Contagem]:
+        return self._grupos[self.dimensoes.index(dimensao)]
+
+    def total(self) -> Contagem:
+        return self._total
+
+    def __len__(self) -> int:
+        return len(self._contribuicoes)
+
+    def _faixa(self, aberto: bool, vencimento: int) -> int:
+        if not aberto or not vencimento:
+            return 0
+        dias = vencimento - self._hoje
+        if dias <= 0:
+            return FAIXA_VENCIDO
+        return FAIXA_A_VENCER if dias <= DIAS_AVISO_PRAZO else 0
+
+    def _aplicar(self, doc_id: str, contribuicao: _Contribuicao, sinal: int):
+        if sinal > 0:
+            self._contribuicoes[doc_id] = contribuicao
+        else:
+            del self._contribuicoes[doc_id]
+        if contribuicao.aberto and contribuicao.vencimento:
+            if sinal > 0:
+                self._por_vencimento.setdefault(contribuicao.vencimento, set()).add(doc_id)
+            else:
+                ids = self._por_vencimento[contribuicao.vencimento]
+                ids.discard(doc_id)
+                if not ids:
+                    del self._por_vencimento[contribuicao.vencimento]
+        vencido = contribuicao.faixa == FAIXA_VENCIDO
+        a_vencer = contribuicao.faixa == FAIXA_A_VENCER
+        for grupos, valor in zip(self._grupos, contribuicao.grupos):
+            contagem = grupos.get(valor)
+            if contagem is None:
+                contagem = grupos[valor] = Contagem()
+            self._somar(contagem, contribuicao, vencido, a_vencer, sinal)
+            if not contagem.registos:
+                del grupos[valor]
+        self._somar(self._total, contribuicao, vencido, a_vencer, sinal)
+        self.versao += 1
+
+    @staticmethod
+    def _somar(contagem: Contagem, contribuicao: _Contribuicao, vencido: bool, a_vencer: bool, sinal: int):
+        contagem.registos += sinal
+        contagem.em_aberto += sinal * contribuicao.aberto
+        contagem.vencidos += sinal * vencido
+        contagem.a_vencer += sinal * a_vencer
+        contagem.qtd_hp += sinal * contribuicao.qtd_hp
+
+# ------------------------------
+# Histórico de Ações
+# ------------------------------
+
+# Linhas mantidas em memória (e mostradas na aba Histórico); as mais antigas ficam só no ficheiro.
+CAPACIDADE_HISTORICO = 5000
+# O ficheiro de histórico roda ao chegar a este tamanho, guardando esta quantidade de cópias antigas.
+TAMANHO_FICHEIRO_HISTORICO = 5 * 2 ** 20
+COPIAS_FICHEIRO_HISTORICO = 5
+# A pesquisa devolve no máximo as últimas N entradas que coincidem.
+RESULTADOS_PESQUISA_HISTORICO = 2000
+
+class EntradaHistorico(NamedTuple):
+    instante: datetime
+    acao: str
+    texto: str
+    utilizador: str = ""
+    id_sgd: str = ""
+    repeticoes: int = 1
+
+    def linha(self) -> str:
+        texto = f"[{self.instante.strftime('%d/%m/%Y %H:%M:%S')}] {self.texto}"
+        return texto if self.repeticoes == 1 else f"{texto} (×{self.repeticoes})"
+
+    def para_json(self) -> str:
+        return json.dumps({
+            "em": self.instante.isoformat(timespec="seconds"), "utilizador": self.utilizador,
+            "acao": self.acao, "id_sgd": self.id_sgd, "texto": self.texto,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def de_json(cls, linha: str) -> "EntradaHistorico":
+        d = json.loads(linha)
+        return cls(datetime.fromisoformat(d["em"]), d.get("acao", ""), d.get("texto", ""),
+                   d.get("utilizador", ""), d.get("id_sgd", ""))
+
+def utilizador_atual() -> str:
+    try:
+        return getpass.getuser()
+    except Exception:
+        return ""
+
+class ModeloHistorico(QAbstractListModel):
+    """Lista de entradas do histórico; com capacidade, as mais antigas saem ao entrar novas."""
+
+    def __init__(self, capacidade: Optional[int] = None, parent=None):
+        super().__init__(parent)
+        self._entradas: deque = deque(maxlen=capacidade)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._entradas)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entrada = self._entradas[index.row()]
+        if role == Qt.DisplayRole:
+            return entrada.linha()
+        if role == Qt.ToolTipRole:
+            partes = [f"Ação: {entrada.acao}"]
+            if entrada.utilizador:
+                partes.append(f"Utilizador: {entrada.utilizador}")
+            if entrada.id_sgd:
+                partes.append(f"ID SGD: {entrada.id_sgd}")
+            return "\n".join(partes)
+        return None
+
+    def ultima(self) -> Optional[EntradaHistorico]:
+        return self._entradas[-1] if self._entradas else None
+
+    def acrescentar(self, entrada: EntradaHistorico):
+        if len(self._entradas) == self._entradas.maxlen:
+            self.beginRemoveRows(QModelIndex(), 0, 0)
+            self._entradas.popleft()
+            self.endRemoveRows()
+        n = len(self._entradas)
+        self.beginInsertRows(QModelIndex(), n, n)
+        self._entradas.append(entrada)
+        self.endInsertRows()
+
+    def substituir_ultima(self, entrada: EntradaHistorico):
+        self._entradas[-1] = entrada
+        indice = self.index(len(self._entradas) - 1)
+        self.dataChanged.emit(indice, indice)
+
+    def definir(self, entradas: Iterable[EntradaHistorico]):
+        self.beginResetModel()
+        self._entradas = deque(entradas, maxlen=self._entradas.maxlen)
+        self.endResetModel()
+
+class RegistoHistorico(QObject):
+    """Ficheiro JSON Lines com rotação, escrito numa thread à parte, e pesquisa nas sessões anteriores.
+
+    As entradas passam por um QueueHandler: a thread da interface só as põe
+    numa fila e o QueueListener escreve-as no RotatingFileHandler.
+    """
+
+    resultados = pyqtSignal(int, object)  # geração da pesquisa, [EntradaHistorico]
+
+    def __init__(self, caminho: str, parent=None):
+        super().__init__(parent)
+        self.caminho = caminho
+        self._geracao = 0
+        ficheiro = RotatingFileHandler(caminho, maxBytes=TAMANHO_FICHEIRO_HISTORICO,
+                                       backupCount=COPIAS_FICHEIRO_HISTORICO, encoding="utf-8")
+        ficheiro.setFormatter(logging.Formatter("%(message)s"))
+        self._listener = QueueListener(queue.Queue(), ficheiro)
+        self._logger = logging.getLogger(f"gestor_pa.historico.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(QueueHandler(self._listener.queue))
+        self._listener.start()
+
+    def registar(self, entrada: EntradaHistorico):
+        self._logger.info(entrada.para_json())
+
+    def fechar(self):
+        """Escreve o que ainda está na fila e fecha o ficheiro."""
+        self._geracao += 1
+        for handler in list(self._logger.handlers):
+            self._logger.removeHandler(handler)
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+    def ficheiros(self) -> List[str]:
+        """Do mais antigo (última cópia da rotação) para o atual."""
+        copias = [f"{self.caminho}.{i}" for i in range(COPIAS_FICHEIRO_HISTORICO, 0, -1)]
+        return [c for c in copias + [self.caminho] if os.path.exists(c)]
+
+    def pesquisar(self, termo: str) -> int:
+        """Procura em segundo plano; o resultado chega pelo sinal resultados com a geração devolvida.
+
+        Uma pesquisa nova torna obsoleta a anterior, que termina sem emitir.
+        """
+        self._geracao += 1
+        geracao = self._geracao
+        threading.Thread(target=self._executar_pesquisa, args=(normalizar(termo), geracao),
+                         name="historico-pesquisa", daemon=True).start()
+        return geracao
+
+    def _executar_pesquisa(self, termo: str, geracao: int):
+        encontradas: deque = deque(maxlen=RESULTADOS_PESQUISA_HISTORICO)
+        for caminho in self.ficheiros():
+            try:
+                with open(caminho, encoding="utf-8") as f:
+                    for linha in f:
+                        if geracao != self._geracao:
+                            return
+                        # Filtro rápido na linha inteira antes de interpretar o JSON.
+                        if termo not in normalizar(linha):
+                            continue
+                        try:
+                            encontradas.append(EntradaHistorico.de_json(linha))
+                        except (ValueError, KeyError):
+                            continue
+            except OSError as e:
+                log.warning("Não foi possível ler '%s': %s", caminho, e)
+        if geracao == self._geracao:
+            self.resultados.emit(geracao, list(encontradas))
+
+def configurar_log(config: Dict[str, Any]) -> QueueListener:
+    """Envia o log "gestor_pa" para o terminal e, com ficheiro_log, para um ficheiro com rotação.
+
+    Tal como no histórico, quem regista só põe a mensagem numa fila; a escrita
+    é feita pelo QueueListener, numa thread à parte.
+    """
+    consola = logging.StreamHandler()
+    consola.setFormatter(logging.Formatter("%(message)s"))
+    handlers: List[logging.Handler] = [consola]
+    if config.get("ficheiro_log"):
+        caminho = os.path.join(pasta_base(), config["ficheiro_log"])
+        try:
+            ficheiro = RotatingFileHandler(caminho, maxBytes=TAMANHO_FICHEIRO_HISTORICO,
+                                           backupCount=COPIAS_FICHEIRO_HISTORICO, encoding="utf-8")
+            ficheiro.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+            handlers.append(ficheiro)
+        except OSError as e:
+            log.warning("Ficheiro de log indisponível: %s", e)
+    ouvinte = QueueListener(queue.Queue(), *handlers)
+    log.addHandler(QueueHandler(ouvinte.queue))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    ouvinte.start()
+    return ouvinte
+
+# ------------------------------
+# Relay na Rede Local
+# ------------------------------
+
+PORTA_RELAY = 8765
+# Mensagens de alterações guardadas pelo relay, para quem volta a ligar-se receber só o que perdeu.
+CAPACIDADE_HISTORICO_RELAY = 10000
+# Mensagens por enviar a um cliente antes de o desligar por estar lento (volta a ligar e retoma).
+LIMITE_FILA_CLIENTE_RELAY = 2000
+# Sem alterações, o relay envia um pulso a este intervalo; o cliente desliga-se ao fim de três em falta.
+INTERVALO_PULSO_RELAY_S = 10
+TEMPO_LIGACAO_RELAY_S = 5
+ESPERA_MAXIMA_RELIGAR_S = 30
+
+def _linha_relay(mensagem: Dict[str, Any]) -> bytes:
+    """Uma mensagem do protocolo do relay: um objeto JSON por linha, com as datas como na cache local."""
+    return json.dumps(mensagem, default=_json_padrao, ensure_ascii=False).encode("utf-8") + b"\n"
+
+PULSO_RELAY = _linha_relay({"tipo": "pulso"})
+
+def prova_relay(chave: str, nonce: str) -> str:
+    """Resposta ao desafio do relay: mostra que se conhece a chave sem a enviar pela rede."""
+    return hmac.new(chave.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+def janela_cabe(janela_dias: int, janela_relay: int) -> bool:
+    """Indica se o relay, com a sua janela de abertura, tem todos os registos que a janela acompanha (0 = sem janela)."""
+    return janela_relay <= 0 or 0 < janela_dias <= janela_relay
+
+def endereco_relay(texto: str, porta: int = PORTA_RELAY) -> Tuple[str, int]:
+    """'máquina:porta' (ou só 'máquina') -> (máquina, porta)."""
+    maquina, separador, numero = texto.strip().rpartition(":")
+    if not separador:
+        return texto.strip(), porta
+    return maquina, int(numero)
+
+class _LigacaoRelay:
+    """Um cliente ligado ao relay; as mensagens esperam numa fila própria até serem enviadas."""
+
+    def __init__(self, con: socket.socket, endereco):
+        self.con = con
+        self.endereco = endereco
+        self.fila: "queue.Queue" = queue.Queue(LIMITE_FILA_CLIENTE_RELAY)
+
+    def enviar(self, linha: bytes) -> bool:
+        try:
+            self.fila.put_nowait(linha)
+            return True
+        except queue.Full:
+            return False
+
+    def fechar(self):
+        try:
+            self.con.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+class ServidorRelay:
+    """Um só listener do Firestore, partilhado pelas janelas da rede local.
+
+    Guarda em memória o conjunto ao vivo (os registos não finalizados) e as
+    últimas mensagens de alterações, numeradas. Cada alteração é codificada
+    uma vez e posta na fila de cada cliente. Ao ligar-se, o cliente envia o
+    token de retoma que recebeu por último ("época:número"). Se as mensagens
+    seguintes ainda estiverem guardadas, recebe só essas; senão recebe o
+    conjunto completo. Não precisa de Qt: corre sem interface (--relay).
+    """
+
+    def __init__(self, db, endereco: Tuple[str, int] = ("", PORTA_RELAY), chave: str = "",
+                 capacidade: int = CAPACIDADE_HISTORICO_RELAY, janela_dias: int = 0):
+        self.db = db
+        self.chave = chave
+        self.janela_dias = janela_dias
+        # Muda a cada arranque: tokens de outra execução do relay obrigam ao conjunto completo.
+        self.epoca = secrets.token_hex(6)
+        self.listener = None
+        self._registos: Dict[str, Dict[str, Any]] = {}
+        self._seq = 0
+        self._marca: Optional[datetime] = None
+        self._historico: deque = deque(maxlen=capacidade)  # (número, linha codificada)
+        self._clientes: Set[_LigacaoRelay] = set()
+        self._lock = threading.Lock()
+        self._pronto = threading.Event()
+        self._parar = threading.Event()
+        self._socket = socket.create_server(endereco)
+        self.endereco = self._socket.getsockname()[:2]
+
+    def iniciar(self):
+        # A mesma consulta que a janela usaria sem relay, com a janela de abertura do app_config.json.
+        consulta = consulta_ao_vivo(self.db.collection('registros_pa'), self.janela_dias)
+        self.listener = consulta.on_snapshot(self._on_snapshot)
+        threading.Thread(target=self._aceitar, name="relay-aceitar", daemon=True).start()
+        if self.janela_dias > 0:
+            threading.Thread(target=self._virar_os_dias, name="relay-virada-dia", daemon=True).start()
+
+    def parar(self):
+        self._parar.set()
+        if self.listener is not None:
+            self.listener.unsubscribe()
+        try:
+            # Sem shutdown, o accept() bloqueado noutra thread mantém a porta aberta.
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        with self._lock:
+            clientes = list(self._clientes)
+        for cliente in clientes:
+            cliente.fechar()
+
+    def clientes(self) -> int:
+        with self._lock:
+            return len(self._clientes)
+
+    def _on_snapshot(self, doc_snapshot, changes, read_time):
+        # Na thread do Firestore: aqui não há interface a bloquear, converte-se já.
+        alteracoes = [(c.type.name, c.document.id, None if c.type.name == 'REMOVED' else converter_documento(c.document))
+                      for c in changes]
+        marca = maior_marca(*(reg.get("ATUALIZADO_EM") for _, _, reg in alteracoes if reg is not None))
+        with self._lock:
+            # A consulta guarda o limite de abertura do dia em que foi criada: o que já saiu
+            # da janela conta como removido, e só se ainda estava no conjunto.
+            filtradas = []
+            for tipo, doc_id, reg in alteracoes:
+                if reg is None or dentro_da_janela(reg, self.janela_dias):
+                    filtradas.append((tipo, doc_id, reg))
+                elif doc_id in self._registos:
+                    filtradas.append(('REMOVED', doc_id, None))
+            lentos = self._difundir(filtradas, marca) if filtradas or not self._pronto.is_set() else []
+        self._fechar_lentos(lentos)
+
+    def _virar_os_dias(self):
+        while True:
+            agora = datetime.now()
+            meia_noite = datetime.combine(agora.date() + timedelta(days=1), datetime.min.time())
+            # Um segundo de folga para date.today() já devolver o novo dia.
+            if self._parar.wait((meia_noite - agora).total_seconds() + 1):
+                return
+            self._podar_fora_da_janela()
+
+    def _podar_fora_da_janela(self):
+        """À meia-noite a janela de abertura avança: os registos que ficaram de fora saem do conjunto."""
+        with self._lock:
+            alteracoes = [('REMOVED', doc_id, None) for doc_id, reg in self._registos.items()
+                          if not dentro_da_janela(reg, self.janela_dias)]
+            lentos = self._difundir(alteracoes, None) if alteracoes else []
+        self._fechar_lentos(lentos)
+
+    def _difundir(self, alteracoes: List[Tuple[str, str, Optional[Dict[str, Any]]]],
+                  marca: Optional[datetime]) -> List["_LigacaoRelay"]:
+        """Aplica as alterações ao conjunto e põe-nas na fila de cada cliente (com o lock); devolve os lentos."""
+        for tipo, doc_id, reg in alteracoes:
+            if reg is None:
+                self._registos.pop(doc_id, None)
+            else:
+                self._registos[doc_id] = reg
+        self._marca = maior_marca(self._marca, marca)
+        if not self._pronto.is_set():
+            # O primeiro snapshot é o estado inicial: os clientes recebem-no como conjunto completo.
+            self._pronto.set()
+            return []
+        self._seq += 1
+        linha = _linha_relay({"tipo": "alteracoes", "retomar": f"{self.epoca}:{self._seq}", "marca": marca,
+                              "alteracoes": alteracoes})
+        self._historico.append((self._seq, linha))
+        lentos = [cliente for cliente in self._clientes if not cliente.enviar(linha)]
+        self._clientes.difference_update(lentos)
+        return lentos
+
+    def _fechar_lentos(self, lentos: List["_LigacaoRelay"]):
+        for cliente in lentos:
+            log.info("Relay: cliente %s desligado por não acompanhar as alterações.", cliente.endereco[0])
+            cliente.fechar()
+
+    def _aceitar(self):
+        while not self._parar.is_set():
+            try:
+                con, endereco = self._socket.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._atender, args=(con, endereco), name="relay-cliente", daemon=True).start()
+
+    def _perdidas_desde(self, retomar: Optional[str]) -> Optional[List[bytes]]:
+        """Mensagens posteriores ao token, ou None se o cliente tem de receber o conjunto completo."""
+        epoca, _, seq = (retomar or "").partition(":")
+        if epoca != self.epoca or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        primeira = self._historico[0][0] if self._historico else self._seq + 1
+        if int(seq) < primeira - 1:
+            return None
+        return [linha for numero, linha in self._historico if numero > int(seq)]
+
+    def _atender(self, con: socket.socket, endereco):
+        cliente = _LigacaoRelay(con, endereco)
+        try:
+            con.settimeout(TEMPO_LIGACAO_RELAY_S)
+            # A chave não passa pela rede: o cliente responde ao desafio com um HMAC do nonce.
+            nonce = secrets.token_hex(16)
+            con.sendall(_linha_relay({"tipo": "desafio", "nonce": nonce, "janela_dias": self.janela_dias}))
+            pedido = json.loads(con.makefile("rb").readline() or b"{}")
+            if not hmac.compare_digest(str(pedido.get("prova", "")).encode(), prova_relay(self.chave, nonce).encode()):
+                con.sendall(_linha_relay({"tipo": "recusado", "motivo": "Chave do relay inválida."}))
+                return
+            # Um cliente parado deixa de receber as alterações em vez de atrasar o relay.
+            con.settimeout(3 * INTERVALO_PULSO_RELAY_S)
+            self._pronto.wait()
+            with self._lock:
+                # A partir daqui as alterações novas vão para a fila do cliente, depois destas.
+                perdidas = self._perdidas_desde(pedido.get("retomar"))
+                if perdidas is None:
+                    completo = {"tipo": "completo", "retomar": f"{self.epoca}:{self._seq}", "marca": self._marca,
+                                "registos": list(self._registos.values())}
+                self._clientes.add(cliente)
+            if perdidas is None:
+                con.sendall(_linha_relay(completo))
+                del completo
+            else:
+                for linha in perdidas:
+                    con.sendall(linha)
+            # Um pulso logo a seguir diz ao cliente que já tem tudo o que perdeu.
+            con.sendall(PULSO_RELAY)
+            log.info("Relay: cliente %s ligado (%s).", endereco[0],
+                     'conjunto completo' if perdidas is None else f'{len(perdidas)} alteração(ões) em falta')
+            while not self._parar.is_set():
+                try:
+                    linha = cliente.fila.get(timeout=INTERVALO_PULSO_RELAY_S)
+                except queue.Empty:
+                    linha = PULSO_RELAY
+                con.sendall(linha)
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._clientes.discard(cliente)
+            con.close()
+
+class ClienteRelay(QObject):
+    """Liga a janela a um relay em vez de abrir um listener próprio no Firestore.
+
+    Tem a mesma interface dos listeners do Firestore (unsubscribe). Uma thread
+    lê as mensagens, converte-as em LoteSnapshot e entrega-as ao despachante.
+    Se a ligação cair, volta a ligar com espera exponencial e, com o token de
+    retoma, recebe só as alterações que perdeu. Se a janela de abertura do
+    relay for mais estreita do que `janela_dias`, não se liga e emite
+    `janela_insuficiente`.
+    """
+
+    estado_alterado = pyqtSignal(str)
+    janela_insuficiente = pyqtSignal(int)  # janela de abertura do relay, em dias
+
+    def __init__(self, endereco: Tuple[str, int], entregar: Callable[[LoteSnapshot], None],
+                 retomar: Optional[str] = None, chave: str = "", janela_dias: int = 0, parent=None):
+        super().__init__(parent)
+        self.endereco = endereco
+        self.retomar = retomar
+        self._entregar = entregar
+        self._chave = chave
+        self._janela_dias = janela_dias
+        self._con: Optional[socket.socket] = None
+        self._parar = threading.Event()
+        # Até ao primeiro lote completo ou pulso de cada ligação, a janela pode estar atrasada.
+        self._inicial_pendente = False
+
+    def iniciar(self):
+        threading.Thread(target=self._executar, name="cliente-relay", daemon=True).start()
+
+    def unsubscribe(self):
+        self._parar.set()
+        con = self._con
+        if con is not None:
+            try:
+                con.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _executar(self):
+        maquina, porta = self.endereco
+        tentativa = 0
+        while not self._parar.is_set():
+            try:
+                with socket.create_connection(self.endereco, timeout=TEMPO_LIGACAO_RELAY_S) as con:
+                    self._con = con
+                    if self._parar.is_set():
+                        return
+                    con.settimeout(3 * INTERVALO_PULSO_RELAY_S)
+                    self._inicial_pendente = True
+                    linhas = con.makefile("rb")
+                    desafio = json.loads(linhas.readline() or b"{}")
+                    if desafio.get("tipo") != "desafio":
+                        raise ValueError("o relay não enviou o desafio de autenticação")
+                    if not janela_cabe(self._janela_dias, int(desafio.get("janela_dias", 0))):
+                        self.janela_insuficiente.emit(int(desafio["janela_dias"]))
+                        return
+                    con.sendall(_linha_relay({"tipo": "assinar", "retomar": self.retomar,
+                                              "prova": prova_relay(self._chave, desafio["nonce"])}))
+                    for n, linha in enumerate(linhas):
+                        if not self._receber(linha):
+                            return
+                        if n == 0:
+                            self.estado_alterado.emit(f"Ligado ao relay {maquina}:{porta}.")
+                            tentativa = 0
+            except (OSError, ValueError) as e:
+                if self._parar.is_set():
+                    return
+                log.warning("Ligação ao relay %s:%s perdida: %s", maquina, porta, e)
+            finally:
+                self._con = None
+            if self._parar.is_set():
+                return
+            self.estado_alterado.emit(f"Sem ligação ao relay {maquina}:{porta}; a tentar de novo…")
+            tentativa += 1
+            self._parar.wait(min(0.5 * 2 ** tentativa, ESPERA_MAXIMA_RELIGAR_S) + random.uniform(0, 0.25))
+
+    def _receber(self, linha: bytes) -> bool:
+        recebido_em = time.perf_counter()
+        mensagem = json.loads(linha, object_hook=_json_objeto)
+        tipo = mensagem.get("tipo")
+        if tipo == "pulso":
+            if self._inicial_pendente and not self._parar.is_set():
+                # O relay acabou de enviar o que faltava: a janela já está igual ao servidor.
+                self._inicial_pendente = False
+                self._entregar(LoteSnapshot(retomar=self.retomar, inicial=True))
+            return True
+        if tipo == "recusado":
+            self.estado_alterado.emit(f"O relay recusou a ligação: {mensagem.get('motivo', '')}")
+            return False
+        if tipo == "completo":
+            lote = LoteSnapshot(completo=[Registo(reg) for reg in mensagem["registos"]], marca=mensagem.get("marca"),
+                                inicial=True)
+            self._inicial_pendente = False
+        else:
+            lote = LoteSnapshot(alteracoes=[(tipo, doc_id, None if reg is None else Registo(reg))
+                                            for tipo, doc_id, reg in mensagem["alteracoes"]],
+                                marca=mensagem.get("marca"))
+        metricas.registar("snapshot.decodificar", (time.perf_counter() - recebido_em) * 1000)
+        if self._parar.is_set():
+            return False  # a janela já trocou de listener
+        self.retomar = mensagem["retomar"]
+        self._entregar(lote._replace(retomar=self.retomar))
+        return True
+
+# ------------------------------
+# Janela Principal
+# ------------------------------
+
+COLUNAS_PAINEL = ["Grupo", "Registos", "Em aberto", "Vencidos", f"A vencer (até {DIAS_AVISO_PRAZO} dias)",
+                  "Quantidade HP"]
+COLUNAS_DIAGNOSTICO = ["Métrica", "Unidade", "Amostras", "Último", "p50", "p90", "p99", "Máx."]
+DESCRICOES_METRICAS = {
+    "snapshot.documentos": "Documentos recebidos em cada snapshot do Firestore.",
+    "snapshot.espera_fila": "Tempo entre a chegada do snapshot e o início da conversão.",
+    "snapshot.decodificar": "Conversão dos documentos do snapshot (fora da interface).",
+    "snapshot.aplicar": "Aplicação de um lote de snapshots à tabela (na interface).",
+    "snapshot.receber_ate_aplicar": "Da chegada do snapshot até a tabela estar atualizada.",
+    "tabela.ordenar": "Ordenação completa das linhas da tabela.",
+    "tabela.filtrar": "Aplicação da busca e dos filtros da aba Registos.",
+    "tabela.reconstruir": "Reconstrução completa da tabela (primeiro snapshot, ressincronização).",
+    "tabela.desenhar": "Pintura da área visível da tabela.",
+    "escrita.gravar": "Gravação de um registo na nuvem (salvar).",
+    "escrita.exclusao": "Commit de um lote de exclusões.",
+    "escrita.recalculo": "Commit de um lote do recálculo de prazos.",
+    "escrita.lote": "Commit de um lote de escrita.",
+    "escrita.importacao": "Commit de um lote da importação de planilha.",
+    "escrita.exclusoes_expiradas": "Commit de um lote de marcas de exclusão antigas apagadas.",
+    "ui.bloqueio": f"Períodos em que a interface esteve sem responder (>= {LIMIAR_BLOQUEIO_MS} ms).",
+}
+
+# Registos FINALIZADO não são acompanhados em tempo real: são lidos a pedido, por páginas.
+TAMANHO_PAGINA_FINALIZADOS = 200
+JANELAS_ABERTURA_DIAS = [0, 30, 90, 180, 365]
+
+class AppPA(QMainWindow):
+    # (geração do filtro, snapshots da página, registos convertidos, erro)
+    pagina_finalizados = pyqtSignal(int, object, object, object)
+    # Gravação direta (sem fila) terminada: ID SGD, doc_id editado (None num registo novo), gravado, erro
+    gravacao_direta = pyqtSignal(str, object, bool, object)
+    # Conflito encontrado pela gravação direta; a ligação é bloqueante, a resposta volta no próprio pedido.
+    conflito_direto = pyqtSignal(object)
+
+    # O cliente do Firestore pode chegar depois (ver definir_cliente): a janela abre logo.
+    def __init__(self, db_client=None, config: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.config = config if config is not None else carregar_config()
+        self.setWindowTitle("Gestor de P.A – Colaborativo (com Firebase)")
+        self.resize(1200, 720)
+
+        # Cliente e coleções do Firestore (definidos em definir_cliente)
+        self.db = None
+        self.colecao_ref = None
+        # Marcas de exclusão: permitem saber o que foi apagado desde a última sincronização.
+        self.exclusoes_ref = None
+
+        self.registros: List[Registo] = []
+        # Índices para aplicar as alterações do Firestore sem reconstruir tudo:
+        # id -> registo e a lista de chaves de ordenação paralela a self.registros.
+        self._registros_por_id: Dict[str, Registo] = {}
+        self._chaves_ordem: List[Tuple[float, str]] = []
+        self.registro_em_edicao_id = None
+        # O registo tal como estava ao ser aberto para edição: base da comparação e da pré-condição.
+        self._base_edicao: Dict[str, Any] = {}
+        # Gravações locais ainda não confirmadas pela nuvem: a versão local prevalece sobre
+        # a que chega nos snapshots, que fica adiada até a gravação terminar.
+        self.fila: Optional[FilaEscrita] = None
+        self._locais: Dict[str, Dict[str, Any]] = {}
+        self._remotos_adiados: Dict[str, Tuple[str, Optional[Dict[str, Any]]]] = {}
+        self._originais: Dict[str, Tuple[str, Optional[Dict[str, Any]]]] = {}
+        # Conflitos que o utilizador deixou para decidir depois (seq da fila) e se a pergunta está aberta.
+        self._conflitos_adiados: Set[int] = set()
+        self._a_resolver_conflitos = False
+
+        # Filtro da vista: o listener só acompanha registos não finalizados (e,
+        # opcionalmente, abertos nos últimos N dias); os finalizados vêm por páginas.
+        self._janela_dias = int(self.config["janela_abertura_dias"])
+        self._mostrar_finalizados = False
+        self._cursor_finalizados = None
+        self._finalizados_esgotados = False
+        self._pagina_em_curso = False
+        self._geracao_finalizados = 0
+        self.pagina_finalizados.connect(self._on_pagina_finalizados)
+        self.gravacao_direta.connect(self._on_gravacao_direta)
+        self.conflito_direto.connect(self._decidir_conflito_direto, Qt.BlockingQueuedConnection)
+
+        self._utilizador = utilizador_atual()
+        # Contagens por BASE GED / STATUS / CIDADE, atualizadas com cada alteração (aba Painel).
+        self.agregados = Agregados()
+        self.tabs = QTabWidget()
+        self.setCentralWidget(self.tabs)
+
+        self._build_tab_cadastro()
+        self._build_tab_registros()
+        self._build_tab_painel()
+        self._build_tab_historico()
+        self._build_tab_diagnostico()
+        self._detetor_bloqueios = DetetorBloqueios(self)
+
+        self.pb_escrita = QProgressBar()
+        self.pb_escrita.setMaximumWidth(220)
+        self.pb_escrita.setFormat("A gravar %v/%m")
+        self.pb_escrita.hide()
+        self.statusBar().addPermanentWidget(self.pb_escrita)
+        self.lbl_snapshots = QLabel()
+        self.statusBar().addPermanentWidget(self.lbl_snapshots)
+        self.lbl_fila = QLabel()
+        self.statusBar().addPermanentWidget(self.lbl_fila)
+        self._escritas_em_curso: List[EscritorEmLote] = []
+        self._exportacao: Optional[ExportadorRegistos] = None
+        self._importacao: Optional[ImportadorRegistos] = None
+        self.despachante = DespachanteSnapshots(
+            self._aplicar_lote, self.config["janela_agrupamento_ms"], parent=self
+        )
+
+        self.agenda = AgendaPrazos(self)
+        self.agenda.avisos.connect(self._on_avisos_prazo)
+        self._caixa_avisos: Optional[QMessageBox] = None
+
+        self._timer_virada_dia = QTimer(self)
+        self._timer_virada_dia.setSingleShot(True)
+        self._timer_virada_dia.timeout.connect(self._on_virada_do_dia)
+        self._agendar_virada_do_dia()
+
+        self.listener = None
+        self.listener_exclusoes = None
+        self._marca_sincronizacao: Optional[datetime] = None
+        self._leitura_completa_em: Optional[datetime] = None
+        # Com relay: token para ele enviar só o que mudou desde o último lote aplicado.
+        self._retomar_relay: Optional[str] = None
+        # O relay não serve toda a janela de abertura escolhida: lê-se diretamente do Firestore.
+        self._relay_insuficiente = False
+        # Os prazos só são recalculados quando a tabela já reflete a nuvem, não apenas a cache.
+        self._prazos_por_recalcular = False
+        self.cache: Optional[CacheLocal] = None
+        self._abrir_cache_local()
+        perfil_arranque.marcar("cache local carregada")
+        self._abrir_fila_escrita()
+        if self._usa_relay():
+            # O relay não depende da ligação ao Firebase: a tabela é atualizada desde já.
+            self._iniciar_listener_firestore()
+        perfil_arranque.marcar("janela construída")
+
+        if db_client is not None:
+            self.definir_cliente(db_client)
+        else:
+            self.statusBar().showMessage("A ligar à nuvem…")
+
+    def definir_cliente(self, db_client):
+        """Liga a janela ao Firestore: arranca o listener e o envio das gravações pendentes."""
+        perfil_arranque.marcar("cliente do Firestore entregue à janela")
+        self.db = db_client
+        self.colecao_ref = self.db.collection('registros_pa')
+        self.exclusoes_ref = self.db.collection('registros_pa_exclusoes')
+        if self.fila is not None:
+            self.fila.iniciar(self.db, self.colecao_ref)
+        self._iniciar_listener_firestore()
+        if self._mostrar_finalizados:
+            self._carregar_pagina_finalizados()
+        self._prazos_por_recalcular = True
+        self.statusBar().showMessage("Ligado à nuvem.", 3000)
+
+    def _on_falha_ligacao(self, erro: str):
+        self.statusBar().showMessage("Sem ligação à nuvem: a mostrar apenas os dados locais.")
+        msg_erro = f"ERRO CRÍTICO: Não foi possível inicializar o Firebase.\n\n" \
+                   f"Verifique as informações de diagnóstico impressas no terminal.\n\n" \
+                   f"Detalhes técnicos: {erro}"
+        msg(self, "Erro de Inicialização", msg_erro, QMessageBox.Critical)
+
+    def _ligado(self) -> bool:
+        if self.db is None:
+            self.statusBar().showMessage("Ainda sem ligação à nuvem; tente de novo dentro de momentos.", 5000)
+            return False
+        return True
+
+    def _abrir_cache_local(self):
+        """Mostra de imediato os registos da última sessão, se houver cache local."""
+        ficheiro = self.config.get("ficheiro_cache")
+        if not ficheiro:
+            return
+        try:
+            self.cache = CacheLocal(os.path.join(pasta_base(), ficheiro), self._assinatura_filtro())
+            registros, self._marca_sincronizacao = self.cache.carregar()
+            self._retomar_relay = self.cache.retomar_relay()
+            self._leitura_completa_em = self.cache.leitura_completa_em()
+        except Exception as e:
+            log.warning("Cache local indisponível: %s", e)
+            self.cache = None
+            return
+        if registros:
+            self._aplicar_snapshot_completo(registros)
+            self._append_historico(f"{len(registros)} registo(s) carregado(s) da cache local.", "cache")
+
+    def _abrir_fila_escrita(self):
+        """Retoma as gravações que ficaram por enviar na última sessão."""
+        ficheiro = self.config.get("ficheiro_fila_escrita")
+        if not ficheiro:
+            return
+        try:
+            self.fila = FilaEscrita(os.path.join(pasta_base(), ficheiro), self)
+        except Exception as e:
+            log.warning("Fila de gravações indisponível: %s", e)
+            self.fila = None
+            return
+        self.fila.estado_alterado.connect(self._on_estado_escrita)
+        self.fila.entradas(self._retomar_fila)
+
+    def _retomar_fila(self, entradas: List[EntradaFila]):
+        """Mostra na tabela as gravações que a fila ainda tem por enviar."""
+        estados: Dict[str, str] = {}
+        for entrada in entradas:
+            dados = entrada.dados
+            if entrada.operacao == 'update':
+                # Uma edição só tem os campos alterados: aplica-se sobre o registo que já está na tabela.
+                dados = {**self._registros_por_id.get(entrada.doc_id, {}), **dados}
+            self._aplicar_gravacao_local(registro_local(entrada.doc_id, dados))
+            if estados.get(entrada.doc_id, ESTADO_PENDENTE) == ESTADO_PENDENTE:
+                estados[entrada.doc_id] = entrada.estado
+        for doc_id, estado in estados.items():
+            self.modelo.definir_estado_escrita(doc_id, estado)
+        if entradas:
+            self._append_historico(f"{len(entradas)} gravação(ões) por enviar retomada(s) da última sessão.", "fila")
+        self._atualiza_estado_fila()
+        if ESTADO_CONFLITO in estados.values():
+            QTimer.singleShot(0, self._resolver_conflitos)
+
+    def _iniciar_listener_firestore(self):
+        """Cria um 'ouvinte' que atualiza a tabela sempre que há uma mudança no banco de dados.
+
+        Com uma marca de sincronização (vinda da cache local) só são pedidos os
+        documentos alterados ou excluídos depois dela: o primeiro snapshot destas
+        consultas é exatamente o que falta à cache. Sem marca, lê-se a coleção inteira.
+
+        Com um relay configurado, é ele que segura o listener: a janela só recebe
+        as alterações que lhe faltam.
+        """
+        if self._usa_relay():
+            if self.listener is None:
+                self.listener = ClienteRelay(endereco_relay(self.config["relay"]), self.despachante.enfileirar_lote,
+                                             self._retomar_relay, self.config.get("chave_relay", ""),
+                                             self._janela_dias, self)
+                self.listener.estado_alterado.connect(lambda texto: self.statusBar().showMessage(texto, 8000))
+                self.listener.janela_insuficiente.connect(self._on_janela_relay_insuficiente)
+                self.listener.iniciar()
+            return
+        if self.db is None:
+            return  # o listener arranca em definir_cliente
+        if self._leitura_completa_expirada():
+            self._marca_sincronizacao = None
+        marca = self._marca_sincronizacao
+        if marca is None:
+            self.despachante.definir_proximo_completo(True)
+            self.listener = self._consulta_ao_vivo().on_snapshot(self._on_snapshot_callback)
+        else:
+            # Sem filtro de STATUS: um registo finalizado depois da marca só sai da tabela
+            # e da cache se esta consulta o entregar, e uma consulta com STATUS != FINALIZADO
+            # nunca veria documentos que não estavam no seu resultado. Só chegam documentos
+            # gravados depois da marca; o que não pertence à vista é descartado em _aplicar_alteracoes.
+            self.despachante.definir_proximo_completo(False)
+            self.listener = self.colecao_ref.where("ATUALIZADO_EM", ">", marca).on_snapshot(
+                self._on_snapshot_callback)
+            self.listener_exclusoes = self.exclusoes_ref.where("EXCLUIDO_EM", ">", marca).on_snapshot(
+                self.despachante.enfileirar_exclusoes)
+
+    def _expirar_exclusoes(self):
+        """Depois de uma leitura completa, apaga em segundo plano as marcas de exclusão antigas."""
+        if self.db is None:
+            return
+        db, exclusoes_ref = self.db, self.exclusoes_ref
+        limite = datetime.now(timezone.utc) - IDADE_MAXIMA_LEITURA_COMPLETA
 
-# ------------------------------
-# Funções Auxiliares
-# ------------------------------
+        def trabalhar():
+            try:
+                apagadas = expirar_exclusoes(db, exclusoes_ref, limite)
+            except Exception as e:
+                log.warning("Falha ao apagar marcas de exclusão antigas: %s", e)
+                return
+            if apagadas:
+                log.info("%d marca(s) de exclusão anteriores a %s apagadas.", apagadas, limite.isoformat())
 
-STATUS_CORES = {
-    "FINALIZADO": QColor(198, 239, 206),
-    "ANÁLISE": QColor(255, 242, 204),
-    "EM ABERTO": QColor(221, 235, 247),
-}
+        threading.Thread(target=trabalhar, name="expirar-exclusoes", daemon=True).start()
 
-def dias_restantes(vencimento: date) -> int:
-    return (vencimento - date.today()).days
+    def _usa_relay(self) -> bool:
+        return bool(self.config.get("relay")) and not self._relay_insuficiente
 
-def msg(parent, title, text, icon=QMessageBox.Information):
-    box = QMessageBox(parent)
-    box.setWindowTitle(title)
-    box.setText(text)
-    box.setIcon(icon)
-    box.exec_()
+    def _on_janela_relay_insuficiente(self, dias_relay: int):
+        """O relay só tem os registos abertos nos últimos `dias_relay` dias: esta janela passa a ler do Firestore."""
+        self._relay_insuficiente = True
+        self._parar_listeners()
+        self._marca_sincronizacao = self._retomar_relay = None
+        if self.cache is not None:
+            # O que veio do relay pode ter menos registos do que esta janela de abertura pede.
+            self.cache.invalidar(self._assinatura_filtro())
+        self._iniciar_listener_firestore()
+        texto = (f"O relay só serve os registos abertos nos últimos {dias_relay} dias; "
+                 f"com \"{self.cb_janela.currentText()}\" a tabela é lida diretamente da nuvem.")
+        self.statusBar().showMessage(texto, 15000)
+        self._append_historico(texto, "relay")
 
-# ------------------------------
-# Janela Principal
-# ------------------------------
+    def _leitura_completa_expirada(self) -> bool:
+        """A última leitura da coleção inteira tem mais de IDADE_MAXIMA_LEITURA_COMPLETA (ou não há registo dela)."""
+        return (self._leitura_completa_em is None
+                or datetime.now(timezone.utc) - self._leitura_completa_em > IDADE_MAXIMA_LEITURA_COMPLETA)
 
-class AppPA(QMainWindow):
-    # Modificado para receber a ligação à base de dados
-    def __init__(self, db_client):
-        super().__init__()
-        self.setWindowTitle("Gestor de P.A – Colaborativo (com Firebase)")
-        self.resize(1200, 720)
+    def _consulta_ao_vivo(self):
+        return consulta_ao_vivo(self.colecao_ref, self._janela_dias)
 
-        # Guarda a referência ao cliente e à coleção do Firestore
-        self.db = db_client
-        self.colecao_ref = self.db.collection('registros_pa')
+    def _assinatura_filtro(self) -> str:
+        return f"abertos;janela={self._janela_dias}"
 
-        self.registros: List[Dict[str, Any]] = []
-        self.registro_em_edicao_id = None
+    def _registro_ao_vivo(self, reg: Dict[str, Any]) -> bool:
+        """Indica se o registo pertence ao conjunto acompanhado pelo listener."""
+        return reg.get("STATUS") != "FINALIZADO" and dentro_da_janela(reg, self._janela_dias)
 
-        self.tabs = QTabWidget()
-        self.setCentralWidget(self.tabs)
+    def _registro_visivel(self, reg: Dict[str, Any]) -> bool:
+        return self._registro_ao_vivo(reg) or (self._mostrar_finalizados and reg.get("STATUS") == "FINALIZADO")
 
-        self._build_tab_cadastro()
-        self._build_tab_registros()
-        self._build_tab_historico()
+    def _lote_ao_vivo(self, lote: LoteSnapshot) -> LoteSnapshot:
+        """O lote tal como deve ficar na cache: só com registos do conjunto ao vivo."""
+        if lote.completo is not None:
+            return lote._replace(completo=[reg for reg in lote.completo if self._registro_ao_vivo(reg)])
+        return lote._replace(alteracoes=[
+            (tipo, doc_id, reg) if tipo == 'REMOVED' or self._registro_ao_vivo(reg) else ('REMOVED', doc_id, None)
+            for tipo, doc_id, reg in lote.alteracoes
+        ])
 
+    def _on_janela_alterada(self):
+        dias = self.cb_janela.currentData()
+        if dias is None or dias == self._janela_dias:
+            return
+        self._janela_dias = dias
+        # Troca o listener: o primeiro snapshot da nova consulta substitui o conjunto ao vivo.
+        # Com relay, volta a tentar: a nova janela pode já caber na dele.
+        self._relay_insuficiente = False
+        self._parar_listeners()
+        self._marca_sincronizacao = self._retomar_relay = None
+        if self.cache is not None:
+            self.cache.invalidar(self._assinatura_filtro())
         self._iniciar_listener_firestore()
-        self._verificar_prazos_vencidos()
+        self._append_historico(f"Filtro alterado: {self.cb_janela.currentText()}.", "filtro")
 
-    def _iniciar_listener_firestore(self):
-        """Cria um 'ouvinte' que atualiza a tabela sempre que há uma mudança no banco de dados."""
-        self.listener = self.colecao_ref.on_snapshot(self._on_snapshot_callback)
+    def _on_vista_alterada(self):
+        self._mostrar_finalizados = self.cb_vista.currentIndex() == 1
+        self._geracao_finalizados += 1
+        self._cursor_finalizados = None
+        self._finalizados_esgotados = False
+        self._pagina_em_curso = False
+        if self._mostrar_finalizados:
+            self._carregar_pagina_finalizados()
+        else:
+            for reg in [r for r in self.registros if r.get("STATUS") == "FINALIZADO"]:
+                self._remover_registro(reg['id'])
+            self._atualiza_contagem()
+
+    def _on_rolagem_tabela(self, valor: int):
+        barra = self.tbl.verticalScrollBar()
+        if self._mostrar_finalizados and valor >= barra.maximum() - barra.pageStep() // 2:
+            self._carregar_pagina_finalizados()
+
+    def _carregar_pagina_finalizados(self):
+        """Lê a próxima página de registos FINALIZADO numa thread de trabalho."""
+        if self._pagina_em_curso or self._finalizados_esgotados or self.db is None:
+            return
+        self._pagina_em_curso = True
+        consulta = (self.colecao_ref.where("STATUS", "==", "FINALIZADO")
+                    .order_by("CRIADO_EM", direction=firestore.Query.DESCENDING)
+                    .limit(TAMANHO_PAGINA_FINALIZADOS))
+        if self._cursor_finalizados is not None:
+            consulta = consulta.start_after(self._cursor_finalizados)
+        geracao = self._geracao_finalizados
+
+        def trabalhar():
+            try:
+                docs = list(consulta.stream())
+                self.pagina_finalizados.emit(geracao, docs, [converter_documento(d) for d in docs], None)
+            except Exception as e:
+                self.pagina_finalizados.emit(geracao, [], [], e)
+
+        threading.Thread(target=trabalhar, name="pagina-finalizados", daemon=True).start()
+
+    def _on_pagina_finalizados(self, geracao: int, docs, registros, erro):
+        """Aplica uma página de finalizados (ou, com `docs` None, o resultado de uma busca por ID)."""
+        if geracao != self._geracao_finalizados:
+            return  # resposta de um filtro que entretanto mudou
+        if docs is not None:
+            self._pagina_em_curso = False
+        if erro is not None:
+            self.statusBar().showMessage(f"Falha ao carregar registos finalizados: {erro}", 8000)
+            return
+        for reg in registros:
+            if reg['id'] not in self._locais and self._registro_visivel(reg):
+                self._inserir_ou_atualizar_registro(reg)
+        self._atualiza_filtros_disponiveis()
+        if docs is None:
+            return
+        if docs:
+            self._cursor_finalizados = docs[-1]
+        self._finalizados_esgotados = len(docs) < TAMANHO_PAGINA_FINALIZADOS
+        self.statusBar().showMessage(f"{len(registros)} registo(s) finalizado(s) carregado(s).", 5000)
+
+    def _parar_listeners(self):
+        for listener in (self.listener, self.listener_exclusoes):
+            if listener is not None:
+                listener.unsubscribe()
+        self.listener = self.listener_exclusoes = None
+
+    def _ressincronizar(self):
+        """Descarta a cache local e volta a ler a coleção inteira."""
+        self._parar_listeners()
+        if self.cache is not None:
+            self.cache.invalidar()
+        self._marca_sincronizacao = self._retomar_relay = None
+        self._iniciar_listener_firestore()
+        self._append_historico("Cache local descartada; a ressincronizar com a nuvem.", "cache")
 
     def _on_snapshot_callback(self, doc_snapshot, changes, read_time):
-        """Função chamada automaticamente pelo Firebase quando os dados mudam."""
-        print("Recebida atualização do Firestore...")
-        self.registros = []
-        for doc in doc_snapshot:
-            dados = doc.to_dict()
-            dados['id'] = doc.id
-            
-            if 'ABERTURA' in dados and isinstance(dados['ABERTURA'], datetime):
-                dados['ABERTURA'] = dados['ABERTURA'].date()
-            if 'VENCIMENTO' in dados and isinstance(dados['VENCIMENTO'], datetime):
-                dados['VENCIMENTO'] = dados['VENCIMENTO'].date()
-            
-            self.registros.append(dados)
-        
-        self.registros.sort(key=lambda r: r.get('CRIADO_EM', datetime.min), reverse=True)
+        """Função chamada automaticamente pelo Firebase quando os dados mudam.
+
+        Corre numa thread do Firestore: a conversão e a atualização da tabela
+        ficam a cargo do despachante.
+        """
+        self.despachante.enfileirar(doc_snapshot, changes, read_time)
+
+    def _aplicar_lote(self, lote: LoteSnapshot):
+        if perfil_arranque.ativo and not perfil_arranque.concluido:
+            perfil_arranque.marcar("primeiro snapshot aplicado")
+            perfil_arranque.relatar()
+        if lote.completo is not None:
+            # Só o primeiro snapshot reconstrói a tabela inteira.
+            self._aplicar_snapshot_completo(lote.completo)
+            self._leitura_completa_em = datetime.now(timezone.utc)
+            if lote.retomar is None:
+                self._expirar_exclusoes()
+        else:
+            self._aplicar_alteracoes(lote.alteracoes)
+        self._marca_sincronizacao = maior_marca(self._marca_sincronizacao, lote.marca)
+        if lote.retomar is not None:
+            self._retomar_relay = lote.retomar
+        if self.cache is not None:
+            self.cache.aplicar(self._lote_ao_vivo(lote), self._marca_sincronizacao)
+        if lote.inicial and self._prazos_por_recalcular:
+            # Antes disto as linhas podiam vir só da cache: gravar TEMPO RESTANTE a partir delas
+            # sobrescreveria na nuvem valores mais recentes.
+            self._prazos_por_recalcular = False
+            self._recalcular_prazos()
+        self._append_historico("Dados sincronizados com a nuvem.", "sincronizar")
+        self._atualiza_filtros_disponiveis()
+        c = self.despachante.contadores
+        self.lbl_snapshots.setText(
+            f"Snapshots: {c['enfileirados']} recebidos · {c['coalescidos']} agrupados · {c['aplicados']} aplicados"
+        )
+
+    def _aplicar_snapshot_completo(self, registros: List[Registo]):
+        if self._locais:
+            remotos = {reg['id']: reg for reg in registros}
+            for doc_id in self._locais:
+                remoto = remotos.pop(doc_id, None)
+                self._remotos_adiados[doc_id] = ('MODIFIED', remoto) if remoto else ('REMOVED', None)
+            registros = list(remotos.values()) + list(self._locais.values())
+        registros = [reg for reg in registros if self._registro_visivel(reg)]
+        if self._mostrar_finalizados:
+            # As páginas de finalizados já carregadas não vêm do listener: mantêm-se.
+            ids = {reg['id'] for reg in registros}
+            registros += [reg for reg in self.registros if reg.get("STATUS") == "FINALIZADO" and reg['id'] not in ids]
+        self.registros = sorted(registros, key=chave_ordem)
+        self._chaves_ordem = [chave_ordem(reg) for reg in self.registros]
+        self._registros_por_id = {reg['id']: reg for reg in self.registros}
+        self.agenda.redefinir(self.registros)
+        self.agregados.redefinir(self.registros, date.today())
         self._atualiza_tabela()
-        self._append_historico("Dados sincronizados com a nuvem.")
+
+    def _aplicar_alteracoes(self, alteracoes: List[Tuple[str, str, Optional[Dict[str, Any]]]]):
+        """Aplica apenas os documentos alterados (ADDED/MODIFIED/REMOVED)."""
+        for tipo, doc_id, reg in alteracoes:
+            if doc_id in self._locais:
+                self._remotos_adiados[doc_id] = (tipo, reg)
+            elif tipo == 'REMOVED' or not self._registro_visivel(reg):
+                # Apagado, ou deixou de pertencer à vista (por exemplo, foi finalizado).
+                self._remover_registro(doc_id)
+            elif tipo in ('ADDED', 'MODIFIED'):
+                self._inserir_ou_atualizar_registro(reg)
+
+    def _retirar_da_ordem(self, reg: Dict[str, Any]):
+        pos = bisect_left(self._chaves_ordem, chave_ordem(reg))
+        if pos < len(self._chaves_ordem) and self.registros[pos] is reg:
+            del self._chaves_ordem[pos]
+            del self.registros[pos]
+
+    def _inserir_ou_atualizar_registro(self, reg: Registo):
+        antigo = self._registros_por_id.get(reg['id'])
+        chave = chave_ordem(reg)
+        pos = bisect_left(self._chaves_ordem, chave)
+        if antigo is not None and pos < len(self.registros) and self.registros[pos] is antigo:
+            # A posição não mudou: basta trocar o registo.
+            self.registros[pos] = reg
+        else:
+            if antigo is not None:
+                self._retirar_da_ordem(antigo)
+                pos = bisect_left(self._chaves_ordem, chave)
+            self._chaves_ordem.insert(pos, chave)
+            self.registros.insert(pos, reg)
+        self._registros_por_id[reg['id']] = reg
+        self.agenda.acompanhar(reg)
+        self.agregados.acompanhar(reg)
+        if antigo is None:
+            self.modelo.inserir(reg)
+        else:
+            self.modelo.atualizar(reg)
+
+    def _remover_registro(self, doc_id: str):
+        reg = self._registros_por_id.pop(doc_id, None)
+        if reg is None:
+            return
+        self._retirar_da_ordem(reg)
+        self.agenda.esquecer(doc_id)
+        self.agregados.esquecer(doc_id)
+        self.modelo.remover(doc_id)
+
+    def _agendar_virada_do_dia(self):
+        agora = datetime.now()
+        meia_noite = datetime.combine(agora.date() + timedelta(days=1), datetime.min.time())
+        # Um segundo de folga para date.today() já devolver o novo dia.
+        self._timer_virada_dia.start(int((meia_noite - agora).total_seconds() * 1000) + 1000)
+
+    def _on_virada_do_dia(self):
+        self.modelo.definir_hoje(date.today())
+        self.agregados.definir_hoje(date.today())
+        self._atualiza_tempo_restante()
+        self.agenda.verificar()
+        if self._janela_dias > 0:
+            self._podar_fora_da_janela()
+        # Com as consultas incrementais ativas há muito tempo, troca-as por uma leitura completa.
+        if self.listener_exclusoes is not None and self._leitura_completa_expirada():
+            self._parar_listeners()
+            self._marca_sincronizacao = None
+            self._iniciar_listener_firestore()
+        elif (self._janela_dias > 0 and self.listener is not None and self.listener_exclusoes is None
+              and not self._usa_relay()):
+            # A consulta ao vivo ficou com o limite de abertura de ontem: volta a ligar-se, a partir da marca.
+            self._parar_listeners()
+            self._iniciar_listener_firestore()
+        self._agendar_virada_do_dia()
+
+    def _podar_fora_da_janela(self):
+        """Tira da tabela e da cache os registos que a virada do dia deixou fora da janela de abertura."""
+        alteracoes = [('REMOVED', reg['id'], None) for reg in self.registros
+                      if not self._registro_visivel(reg) and reg['id'] not in self._locais]
+        if not alteracoes:
+            return
+        self._aplicar_alteracoes(alteracoes)
+        if self.cache is not None:
+            self.cache.aplicar(LoteSnapshot(alteracoes=alteracoes), self._marca_sincronizacao)
 
     def closeEvent(self, event):
         """Garante que o listener seja desativado ao fechar."""
-        if hasattr(self, 'listener'):
-            self.listener.unsubscribe()
+        self._parar_listeners()
+        self.despachante.parar()
+        if self.fila is not None:
+            self.fila.parar()
+        if self._exportacao is not None:
+            self._exportacao.cancelar()
+        if self._importacao is not None:
+            self._importacao.cancelar()
+        if self.config.get("ficheiro_diagnostico"):
+            try:
+                metricas.gravar_json(os.path.join(pasta_base(), self.config["ficheiro_diagnostico"]))
+            except Exception as e:
+                log.warning("Não foi possível gravar o diagnóstico: %s", e)
+        if self.cache is not None:
+            self.cache.fechar()
+        if self.registo_hist is not None:
+            self.registo_hist.fechar()
         event.accept()
 
     # ---------- Aba: Cadastro ----------
@@ -161,6 +3642,7 @@ class AppPA(QMainWindow):
         layout.addWidget(btns)
         layout.addStretch()
 
+        self.tab_cadastro = tab
         self.tabs.addTab(tab, "Cadastro")
 
     def _atualiza_tempo_restante(self):
@@ -168,23 +3650,12 @@ class AppPA(QMainWindow):
         self.sp_tempo_restante.setValue(dias_restantes(d))
 
     def _atualiza_vencimento_automatico(self):
-        base_date = self.dt_abertura.date().toPyDate()
-        tipo_pa = self.cb_pa_tipo.currentText()
-        dias_a_adicionar = 0
-        if tipo_pa == "P.A 3 dias":
-            dias_a_adicionar = 3
-        elif tipo_pa in ["P.A 7 dias", "P.A 3 e 7 dias"]:
-            dias_a_adicionar = 7
-        if dias_a_adicionar > 0:
-            nova_data_vencimento = base_date + timedelta(days=dias_a_adicionar)
+        nova_data_vencimento = calcular_vencimento(self.dt_abertura.date().toPyDate(), self.cb_pa_tipo.currentText())
+        if nova_data_vencimento is not None:
             self.dt_vencimento.setDate(QDate(nova_data_vencimento))
 
     def _validar(self) -> bool:
-        obrigatorios = {
-            "ID SGD": self.ed_id_sgd.text().strip(),
-            "Cidade": self.ed_cidade.text().strip(),
-        }
-        faltando = [k for k, v in obrigatorios.items() if not v]
+        faltando = campos_em_falta({"ID SGD": self.ed_id_sgd.text(), "CIDADE": self.ed_cidade.text()})
         if faltando:
             msg(self, "Campos obrigatórios", f"Preencha: {', '.join(faltando)}", QMessageBox.Warning)
             return False
@@ -194,7 +3665,7 @@ class AppPA(QMainWindow):
         abertura_dt = datetime.combine(self.dt_abertura.date().toPyDate(), datetime.min.time())
         vencimento_dt = datetime.combine(self.dt_vencimento.date().toPyDate(), datetime.min.time())
 
-        return {
+        dados = {
             "ID SGD": self.ed_id_sgd.text().strip(),
             "CIDADE": self.ed_cidade.text().strip(),
             "BASE GED": self.cb_base.currentText().strip(),
@@ -210,27 +3681,321 @@ class AppPA(QMainWindow):
             "CONCLUSAO": self.cb_concluido.currentText().strip(),
             "TIPO PA": self.cb_pa_tipo.currentText().strip(),
             "CRIADO_EM": datetime.now(),
+            "ATUALIZADO_EM": firestore.SERVER_TIMESTAMP,
         }
+        if not self.config["persistir_tempo_restante"]:
+            del dados["TEMPO RESTANTE"]
+        return dados
 
     def _salvar_registro(self):
         if not self._validar():
             return
         
         dados = self._coletar_form()
-        
+        novo = self.registro_em_edicao_id is None
+        id_sgd = dados["ID SGD"]
+        if not novo:
+            # Numa edição seguem só os campos alterados: CRIADO_EM e as alterações de outras pessoas ficam.
+            dados = campos_alterados(self._base_edicao, dados)
+            if not dados:
+                self.statusBar().showMessage("Sem alterações para gravar.", 5000)
+                self._limpar_form()
+                return
+            dados["ATUALIZADO_EM"] = firestore.SERVER_TIMESTAMP
+        if self.fila is None:
+            self._salvar_registro_direto(dados, id_sgd)
+            return
+
+        if novo:
+            # O ID do documento é gerado localmente, para o registo poder ser mostrado já.
+            doc_id, base, versao, local = gerar_id_documento(), None, None, dados
+        else:
+            doc_id = self.registro_em_edicao_id
+            base = {campo: self._base_edicao.get(campo) for campo in dados if campo not in CAMPOS_SEM_DIFERENCA}
+            versao = self._base_edicao.get('_versao')
+            local = {**self._registros_por_id.get(doc_id, self._base_edicao), **dados}
         try:
-            if self.registro_em_edicao_id is None:
-                self.colecao_ref.add(dados)
-                self._append_historico(f"Novo registo salvo na nuvem – ID SGD: {dados['ID SGD']}")
-                msg(self, "Sucesso", "Registo adicionado ao quadro.")
-            else:
-                self.colecao_ref.document(self.registro_em_edicao_id).set(dados)
-                self._append_historico(f"Registo atualizado na nuvem – ID SGD: {dados['ID SGD']}")
-                msg(self, "Sucesso", "Registo atualizado com sucesso.")
-            
-            self._limpar_form()
+            self.fila.enfileirar(doc_id, dados, base, versao,
+                                 ao_concluir=lambda estado: self._on_enfileirado(doc_id, estado))
         except Exception as e:
-            msg(self, "Erro de Base de Dados", f"Falha ao salvar os dados: {e}", QMessageBox.Critical)
+            msg(self, "Erro", f"Falha ao guardar a gravação localmente: {e}", QMessageBox.Critical)
+            return
+        self._aplicar_gravacao_local(registro_local(doc_id, local))
+        self.modelo.definir_estado_escrita(doc_id, ESTADO_PENDENTE)
+        self._atualiza_estado_fila()
+        if novo:
+            self._append_historico(f"Novo registo guardado (a enviar para a nuvem) – ID SGD: {id_sgd}",
+                                   "salvar", id_sgd)
+        else:
+            self._append_historico(f"Registo atualizado (a enviar para a nuvem) – ID SGD: {id_sgd} "
+                                   f"({', '.join(base)})", "salvar", id_sgd)
+        self.statusBar().showMessage("Registo guardado. Será sincronizado com a nuvem em segundo plano.", 5000)
+        self._limpar_form()
+
+    def _salvar_registro_direto(self, dados: Dict[str, Any], id_sgd: str):
+        """Grava na nuvem sem passar pela fila local (quando esta está desligada), numa thread à parte.
+
+        O formulário fica desativado até a gravação terminar (ver _on_gravacao_direta).
+        """
+        if not self._ligado():
+            return
+        doc_id = self.registro_em_edicao_id
+        if doc_id is not None:
+            base = {campo: self._base_edicao.get(campo) for campo in dados if campo not in CAMPOS_SEM_DIFERENCA}
+            versao = self._base_edicao.get('_versao')
+        self.tab_cadastro.setEnabled(False)
+
+        def trabalhar():
+            try:
+                if doc_id is None:
+                    with metricas.medir("escrita.gravar"):
+                        self.colecao_ref.add(dados)
+                    gravado = True
+                else:
+                    gravado = self._editar_na_nuvem(doc_id, dados, id_sgd, base, versao)
+            except Exception as e:
+                self.gravacao_direta.emit(id_sgd, doc_id, False, e)
+                return
+            self.gravacao_direta.emit(id_sgd, doc_id, gravado, None)
+
+        threading.Thread(target=trabalhar, name="gravacao-direta", daemon=True).start()
+
+    def _on_gravacao_direta(self, id_sgd: str, doc_id: Optional[str], gravado: bool, erro: Optional[Exception]):
+        self.tab_cadastro.setEnabled(True)
+        if erro is not None:
+            msg(self, "Erro de Base de Dados", f"Falha ao salvar os dados: {erro}", QMessageBox.Critical)
+            return
+        if not gravado:
+            self.statusBar().showMessage("Edição descartada: mantém-se a versão da nuvem.", 5000)
+        elif doc_id is None:
+            self._append_historico(f"Novo registo salvo na nuvem – ID SGD: {id_sgd}", "salvar", id_sgd)
+            msg(self, "Sucesso", "Registo adicionado ao quadro.")
+        else:
+            self._append_historico(f"Registo atualizado na nuvem – ID SGD: {id_sgd}", "salvar", id_sgd)
+            msg(self, "Sucesso", "Registo atualizado com sucesso.")
+        # Entretanto pode ter sido aberto outro registo para edição: esse fica no formulário.
+        if self.registro_em_edicao_id == doc_id:
+            self._limpar_form()
+
+    def _decidir_conflito_direto(self, pedido: Dict[str, Any]):
+        """Na thread da interface: pergunta o conflito e, para recriar um registo apagado, junta o registo inteiro."""
+        pedido["manter"] = self._perguntar_conflito(pedido["id_sgd"], pedido["alteracoes"], pedido["base"],
+                                                    pedido["remoto"], adiar=False)
+        if pedido["manter"] and pedido["remoto"] is None:
+            pedido["recriar"] = self._registo_para_recriar(pedido["doc_id"], pedido["alteracoes"])
+
+    def _editar_na_nuvem(self, doc_id: str, alteracoes: Dict[str, Any], id_sgd: str, base: Dict[str, Any],
+                         versao: Optional[str]) -> bool:
+        """Envia a edição com a pré-condição da versão aberta; devolve False se o utilizador preferir a da nuvem.
+
+        Corre na thread da gravação direta; as perguntas de conflito são feitas na interface.
+        """
+        ref = self.colecao_ref.document(doc_id)
+        while True:
+            try:
+                with metricas.medir("escrita.gravar"):
+                    enviar_edicao(self.db, ref, alteracoes, versao)
+                return True
+            except Exception as e:
+                if not conflito_de_versao(e):
+                    raise
+            snap = ref.get()
+            remoto = snap.to_dict() if snap.exists else None
+            if remoto is None or campos_em_conflito(base, alteracoes, remoto):
+                pedido = {"id_sgd": id_sgd, "doc_id": doc_id, "alteracoes": alteracoes, "base": base, "remoto": remoto}
+                self.conflito_direto.emit(pedido)
+                manter = pedido["manter"]
+                if remoto is None:
+                    if not manter:
+                        return False
+                    with metricas.medir("escrita.gravar"):
+                        ref.set(pedido["recriar"])
+                    return True
+                if not manter:
+                    alteracoes = self._sem_colisoes(alteracoes, base, remoto)
+                    if not alteracoes:
+                        return False
+                base = {campo: remoto.get(campo) for campo in alteracoes if campo not in CAMPOS_SEM_DIFERENCA}
+            # Sem colisões (ou já resolvidas): tenta de novo sobre a versão atual.
+            versao = versao_documento(snap)
+
+    def _perguntar_conflito(self, id_sgd: str, alteracoes: Dict[str, Any], base: Dict[str, Any],
+                            remoto: Optional[Dict[str, Any]], adiar: bool = True) -> Optional[bool]:
+        """Mostra os campos em conflito; True mantém a edição local, False fica a da nuvem, None decide depois."""
+        if remoto is None:
+            texto = f"O registo {id_sgd} foi apagado na nuvem depois de ser aberto para edição."
+            manter, nuvem = "Recriar com a minha versão", "Descartar a minha edição"
+        else:
+            linhas = [f"{campo}: a sua versão «{texto_valor(alteracoes[campo])}», "
+                      f"na nuvem «{texto_valor(remoto.get(campo))}»"
+                      for campo in campos_em_conflito(base, alteracoes, remoto)]
+            texto = (f"O registo {id_sgd} foi alterado por outra pessoa depois de ser aberto para edição.\n\n"
+                     + "\n".join(linhas))
+            manter, nuvem = "Manter a minha versão", "Usar a da nuvem"
+        caixa = QMessageBox(QMessageBox.Warning, "Conflito de edição", texto, parent=self)
+        if remoto is not None:
+            caixa.setInformativeText("Os campos que só você alterou são gravados em qualquer dos casos.")
+        bt_manter = caixa.addButton(manter, QMessageBox.AcceptRole)
+        bt_nuvem = caixa.addButton(nuvem, QMessageBox.DestructiveRole)
+        bt_depois = caixa.addButton("Decidir depois", QMessageBox.RejectRole) if adiar else None
+        caixa.setEscapeButton(bt_depois or bt_nuvem)
+        caixa.exec_()
+        if bt_depois is not None and caixa.clickedButton() is bt_depois:
+            return None
+        return caixa.clickedButton() is bt_manter
+
+    @staticmethod
+    def _sem_colisoes(alteracoes: Dict[str, Any], base: Dict[str, Any], remoto: Dict[str, Any]) -> Dict[str, Any]:
+        """A edição sem os campos em conflito (vazia se não sobra nenhum campo alterado)."""
+        colisoes = set(campos_em_conflito(base, alteracoes, remoto))
+        restantes = {campo: valor for campo, valor in alteracoes.items() if campo not in colisoes}
+        return restantes if set(restantes) - CAMPOS_SEM_DIFERENCA else {}
+
+    def _registo_para_recriar(self, doc_id: str, alteracoes: Dict[str, Any]) -> Dict[str, Any]:
+        """O registo inteiro, com a edição, para o gravar de novo depois de ter sido apagado na nuvem."""
+        reg = {**self._locais.get(doc_id, self._base_edicao), **alteracoes}
+        dados = {campo: valor for campo, valor in reg.items() if campo not in ('id', '_versao')}
+        for campo in ("ABERTURA", "VENCIMENTO"):
+            if type(dados.get(campo)) is date:
+                dados[campo] = datetime.combine(dados[campo], datetime.min.time())
+        dados["ATUALIZADO_EM"] = firestore.SERVER_TIMESTAMP
+        return dados
+
+    def _aplicar_gravacao_local(self, reg: Registo):
+        """Mostra de imediato a versão local de um registo, antes da confirmação da nuvem."""
+        doc_id = reg['id']
+        if doc_id not in self._locais:
+            atual = self._registros_por_id.get(doc_id)
+            self._originais[doc_id] = ('MODIFIED', atual) if atual else ('REMOVED', None)
+        self._locais[doc_id] = reg
+        if self._registro_visivel(reg):
+            self._inserir_ou_atualizar_registro(reg)
+        else:
+            self._remover_registro(doc_id)
+
+    def _largar_versao_local(self, doc_id: str, repor_original: bool):
+        """Deixa de sobrepor a versão local e aplica a última recebida da nuvem, se houver."""
+        self._locais.pop(doc_id, None)
+        original = self._originais.pop(doc_id, None)
+        remoto = self._remotos_adiados.pop(doc_id, None)
+        if remoto is None and repor_original:
+            remoto = original
+        if remoto is not None:
+            tipo, reg = remoto
+            self._aplicar_alteracoes([(tipo, doc_id, reg)])
+
+    def _on_enfileirado(self, doc_id: str, estado: str):
+        """A gravação já está no ficheiro da fila; se uma anterior do documento a bloqueia, a linha mostra-o."""
+        if estado != ESTADO_PENDENTE and doc_id in self._locais:
+            self.modelo.definir_estado_escrita(doc_id, estado)
+            self._atualiza_estado_fila()
+
+    def _on_estado_escrita(self, doc_id: str, estado: str, erro: str):
+        self.modelo.definir_estado_escrita(doc_id, estado, erro)
+        if not estado:
+            self._largar_versao_local(doc_id, repor_original=False)
+        elif estado == ESTADO_FALHOU:
+            reg = self._locais.get(doc_id, {})
+            self._append_historico(f"Falha ao enviar para a nuvem – ID SGD: {reg.get('ID SGD', doc_id)}: {erro}",
+                                   "falha_gravacao", reg.get('ID SGD', ''))
+        elif estado == ESTADO_CONFLITO:
+            reg = self._locais.get(doc_id, {})
+            self._append_historico(f"Edição em conflito com a nuvem – ID SGD: {reg.get('ID SGD', doc_id)}: {erro}",
+                                   "conflito", reg.get('ID SGD', ''))
+            QTimer.singleShot(0, self._resolver_conflitos)
+        self._atualiza_estado_fila()
+
+    def _atualiza_estado_fila(self):
+        estados = [self.modelo.estado_escrita(doc_id) for doc_id in self._locais]
+        falhados, conflitos = estados.count(ESTADO_FALHOU), estados.count(ESTADO_CONFLITO)
+        pendentes = len(estados) - falhados - conflitos
+        partes = []
+        if pendentes:
+            partes.append(f"{pendentes} por enviar")
+        if falhados:
+            partes.append(f"{falhados} com falha")
+        if conflitos:
+            partes.append(f"{conflitos} em conflito")
+        self.lbl_fila.setText("Gravações: " + " · ".join(partes) if partes else "")
+        self.bt_falhas.setVisible(bool(falhados or conflitos))
+
+    def _resolver_conflitos(self, incluir_adiados: bool = False):
+        """Pergunta, um registo de cada vez, o que fazer às edições que colidiram com as de outra pessoa."""
+        if self.fila is None or self._a_resolver_conflitos:
+            return
+        if incluir_adiados:
+            self._conflitos_adiados.clear()
+        self._a_resolver_conflitos = True
+        self.fila.entradas(self._resolver_proximo_conflito, ESTADO_CONFLITO)
+
+    def _resolver_proximo_conflito(self, entradas: List[EntradaFila]):
+        """Pergunta pelo primeiro conflito por decidir e volta a pedir a lista à fila, que já reflete a escolha."""
+        entradas = [e for e in entradas if e.seq not in self._conflitos_adiados]
+        if not entradas or self.fila is None:
+            self._a_resolver_conflitos = False
+            self._atualiza_estado_fila()
+            return
+        entrada = entradas[0]
+        id_sgd = self._locais.get(entrada.doc_id, {}).get('ID SGD', entrada.doc_id)
+        escolha = self._perguntar_conflito(id_sgd, entrada.dados, entrada.base or {}, entrada.remoto)
+        if escolha is None:
+            self._conflitos_adiados.add(entrada.seq)
+            self._resolver_proximo_conflito(entradas)
+            return
+        if entrada.remoto is None:
+            dados = self._registo_para_recriar(entrada.doc_id, entrada.dados) if escolha else {}
+        elif escolha:
+            dados = entrada.dados
+        else:
+            dados = self._sem_colisoes(entrada.dados, entrada.base or {}, entrada.remoto)
+        if dados:
+            self.fila.reaplicar(entrada, dados)
+            if entrada.remoto is not None:
+                # A versão local passa a ser a da nuvem com as alterações que seguem por cima.
+                self._aplicar_gravacao_local(registro_local(entrada.doc_id, {**entrada.remoto, **dados}))
+            self.modelo.definir_estado_escrita(entrada.doc_id, ESTADO_PENDENTE)
+        else:
+            self.fila.descartar(entrada.seq, lambda resta: self._on_gravacao_descartada(entrada.doc_id, resta))
+        resultado = "mantida a versão local" if escolha else "mantida a versão da nuvem"
+        self._append_historico(f"Conflito de edição resolvido ({resultado}) – ID SGD: {id_sgd}", "conflito", id_sgd)
+        self.fila.entradas(self._resolver_proximo_conflito, ESTADO_CONFLITO)
+
+    def _on_gravacao_descartada(self, doc_id: str, resta: bool):
+        """Uma gravação saiu da fila sem ser enviada: sem outras do documento, volta a versão da nuvem."""
+        if resta:
+            self.modelo.definir_estado_escrita(doc_id, ESTADO_PENDENTE)
+        else:
+            self.modelo.definir_estado_escrita(doc_id, "")
+            self._largar_versao_local(doc_id, repor_original=True)
+        self._atualiza_estado_fila()
+
+    def _tratar_falhas_escrita(self):
+        if self.fila is None:
+            return
+        estados = {self.modelo.estado_escrita(doc_id) for doc_id in self._locais}
+        if ESTADO_CONFLITO in estados:
+            self._resolver_conflitos(incluir_adiados=True)
+        if ESTADO_FALHOU not in estados:
+            return
+        caixa = QMessageBox(QMessageBox.Question, "Gravações falhadas",
+                            "Algumas gravações foram recusadas pela nuvem. Passe o rato sobre as linhas "
+                            "assinaladas para ver o erro.\n\nRepetir o envio ou descartar as alterações locais?",
+                            QMessageBox.Retry | QMessageBox.Discard | QMessageBox.Cancel, self)
+        resposta = caixa.exec_()
+        if resposta == QMessageBox.Retry:
+            self.fila.repetir_falhadas(self._on_falhadas_repetidas)
+        elif resposta == QMessageBox.Discard:
+            self.fila.descartar_falhadas(self._on_falhadas_descartadas)
+
+    def _on_falhadas_repetidas(self, ids: List[str]):
+        for doc_id in ids:
+            self.modelo.definir_estado_escrita(doc_id, ESTADO_PENDENTE)
+        self._atualiza_estado_fila()
+
+    def _on_falhadas_descartadas(self, descartadas: List[Tuple[str, bool]]):
+        for doc_id, pendente in descartadas:
+            self._on_gravacao_descartada(doc_id, pendente)
+        self._append_historico("Gravações falhadas descartadas.", "fila")
 
     def _limpar_form(self):
         self.ed_id_sgd.clear()
@@ -248,43 +4013,93 @@ class AppPA(QMainWindow):
         self.cb_pa_tipo.setCurrentIndex(0)
         self._atualiza_tempo_restante()
         self.registro_em_edicao_id = None
+        self._base_edicao = {}
         self.bt_salvar.setText("Salvar registo")
 
     # ---------- Aba: Registos ----------
     def _build_tab_registros(self):
         tab = QWidget(); layout = QVBoxLayout(tab)
         top = QWidget(); h = QHBoxLayout(top); h.setContentsMargins(0,0,0,0)
-        self.bt_exportar = QPushButton("Exportar para Excel…")
+        self.bt_exportar = QPushButton("Exportar…")
         self.bt_exportar.clicked.connect(self._exportar_excel)
+        self.bt_importar = QPushButton("Importar…")
+        self.bt_importar.setToolTip("Importa registos de uma planilha ou CSV com as colunas da exportação.")
+        self.bt_importar.clicked.connect(self._importar_ficheiro)
         self.bt_excluir = QPushButton("Excluir selecionados")
         self.bt_excluir.clicked.connect(self._excluir_selecionados)
         self.bt_recalc = QPushButton("Recalcular prazos")
         self.bt_recalc.clicked.connect(self._recalcular_prazos)
-        h.addWidget(self.bt_exportar); h.addWidget(self.bt_excluir); h.addWidget(self.bt_recalc); h.addStretch(1)
+        self.bt_ressinc = QPushButton("Ressincronizar")
+        self.bt_ressinc.setToolTip("Descarta a cache local e volta a ler todos os registos da nuvem.")
+        self.bt_ressinc.clicked.connect(self._ressincronizar)
+        self.bt_falhas = QPushButton("Gravações por resolver…")
+        self.bt_falhas.clicked.connect(self._tratar_falhas_escrita)
+        self.bt_falhas.hide()
+        self.cb_vista = QComboBox(); self.cb_vista.addItems(["Em aberto", "Em aberto e finalizados"])
+        self.cb_vista.currentIndexChanged.connect(self._on_vista_alterada)
+        self.cb_janela = QComboBox()
+        janelas = sorted(set(JANELAS_ABERTURA_DIAS) | {self._janela_dias})
+        for dias in janelas:
+            self.cb_janela.addItem("Qualquer abertura" if dias <= 0 else f"Abertos nos últimos {dias} dias", dias)
+        self.cb_janela.setCurrentIndex(janelas.index(self._janela_dias))
+        self.cb_janela.currentIndexChanged.connect(self._on_janela_alterada)
+        h.addWidget(self.bt_exportar); h.addWidget(self.bt_importar)
+        h.addWidget(self.bt_excluir); h.addWidget(self.bt_recalc)
+        h.addWidget(self.bt_ressinc); h.addWidget(self.bt_falhas); h.addStretch(1)
+        h.addWidget(QLabel("Mostrar:")); h.addWidget(self.cb_vista); h.addWidget(self.cb_janela)
 
-        self.tbl = QTableWidget(0, 14)
-        headers = [
-            "ID SGD","CIDADE","BASE GED","CAIXA MAPA","CAIXA SISTEMA","Quantidade HP",
-            "PA","ABERTO POR","ABERTURA","VENCIMENTO","TEMPO RESTANTE","STATUS",
-            "CONCLUSAO","TIPO PA"
-        ]
-        self.tbl.setHorizontalHeaderLabels(headers)
+        filtros = QWidget(); hf = QHBoxLayout(filtros); hf.setContentsMargins(0,0,0,0)
+        self.ed_busca = QLineEdit()
+        self.ed_busca.setPlaceholderText("Procurar ID SGD, cidade ou caixa…")
+        self.ed_busca.setClearButtonEnabled(True)
+        self.ed_busca.textChanged.connect(self._aplicar_filtro)
+        self.cb_filtro_status = QComboBox()
+        self.cb_filtro_base = QComboBox()
+        self.cb_filtro_tipo = QComboBox()
+        self._combos_filtro = {
+            "STATUS": (self.cb_filtro_status, "Todos os status"),
+            "BASE GED": (self.cb_filtro_base, "Todas as bases"),
+            "TIPO PA": (self.cb_filtro_tipo, "Todas as necessidades"),
+        }
+        for cb, rotulo in self._combos_filtro.values():
+            cb.addItem(rotulo, "")
+            cb.currentIndexChanged.connect(self._aplicar_filtro)
+        self.lbl_contagem = QLabel()
+        hf.addWidget(self.ed_busca, 1); hf.addWidget(self.cb_filtro_status)
+        hf.addWidget(self.cb_filtro_base); hf.addWidget(self.cb_filtro_tipo); hf.addWidget(self.lbl_contagem)
+        self._timer_busca_nuvem = QTimer(self)
+        self._timer_busca_nuvem.setSingleShot(True)
+        self._timer_busca_nuvem.setInterval(400)
+        self._timer_busca_nuvem.timeout.connect(self._procurar_finalizados_na_nuvem)
+
+        self.modelo = ModeloRegistros(self)
+        self.tbl = TabelaRegistos()
+        self.tbl.setModel(self.modelo)
+        # Sem indicador, a ordem inicial é a do modelo: mais recentes primeiro.
+        self.tbl.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
         self.tbl.setSortingEnabled(True)
         self.tbl.setAlternatingRowColors(True)
         self.tbl.setSelectionBehavior(self.tbl.SelectRows)
         self.tbl.setEditTriggers(self.tbl.NoEditTriggers)
         self.tbl.verticalHeader().setVisible(False)
         self.tbl.horizontalHeader().setStretchLastSection(True)
-        self.tbl.cellDoubleClicked.connect(self._carregar_registro_para_edicao)
+        # O ajuste de largura das colunas mede só uma amostra de linhas.
+        self.tbl.horizontalHeader().setResizeContentsPrecision(200)
+        self.tbl.doubleClicked.connect(self._carregar_registro_para_edicao)
+        self.tbl.verticalScrollBar().valueChanged.connect(self._on_rolagem_tabela)
 
         layout.addWidget(top)
+        layout.addWidget(filtros)
         layout.addWidget(self.tbl)
 
         self.tabs.addTab(tab, "Registos")
 
-    def _carregar_registro_para_edicao(self, row, column):
-        dados = self.registros[row]
+    def _carregar_registro_para_edicao(self, index):
+        dados = self._registros_por_id.get(self.modelo.id_na_linha(index.row()))
+        if dados is None:
+            return
         self.registro_em_edicao_id = dados.get('id')
+        self._base_edicao = dict(dados)
         
         self.ed_id_sgd.setText(dados.get("ID SGD",""))
         self.ed_cidade.setText(dados.get("CIDADE",""))
@@ -305,195 +4120,706 @@ class AppPA(QMainWindow):
         self.tabs.setCurrentIndex(0)
 
     def _atualiza_tabela(self):
-        self.tbl.setRowCount(len(self.registros))
-        for r, reg in enumerate(self.registros):
-            abertura_str = reg.get("ABERTURA").strftime("%d/%m/%Y") if reg.get("ABERTURA") else ""
-            vencimento_str = reg.get("VENCIMENTO").strftime("%d/%m/%Y") if reg.get("VENCIMENTO") else ""
-
-            valores = [
-                reg.get("ID SGD",""), reg.get("CIDADE",""), reg.get("BASE GED",""),
-                reg.get("CAIXA MAPA",""), reg.get("CAIXA SISTEMA",""), str(reg.get("Quantidade HP",0)),
-                reg.get("PA",""), reg.get("ABERTO POR",""), abertura_str,
-                vencimento_str, str(reg.get("TEMPO RESTANTE",0)),
-                reg.get("STATUS",""), reg.get("CONCLUSAO",""),
-                reg.get("TIPO PA", "")
-            ]
-            for c, v in enumerate(valores):
-                item = QTableWidgetItem(v)
-                if c in (5,10):
-                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
-                self.tbl.setItem(r, c, item)
-
-            cor = STATUS_CORES.get(reg.get("STATUS",""))
-            if cor:
-                temp_item = QTableWidgetItem()
-                cor_texto = temp_item.foreground().color()
-                if cor_texto.lightness() > 128:
-                    cor_texto = QColor("black")
-                
-                for c in range(self.tbl.columnCount()):
-                    self.tbl.item(r,c).setBackground(cor)
-                    self.tbl.item(r,c).setForeground(cor_texto)
+        with metricas.medir("tabela.reconstruir"):
+            self.modelo.redefinir(self.registros)
+            self.tbl.resizeColumnsToContents()
+        self._atualiza_filtros_disponiveis()
+
+    def _criterios_filtro(self) -> CriteriosFiltro:
+        return CriteriosFiltro(
+            normalizar(self.ed_busca.text()),
+            self.cb_filtro_status.currentData() or "",
+            self.cb_filtro_base.currentData() or "",
+            self.cb_filtro_tipo.currentData() or "",
+        )
 
+    def _aplicar_filtro(self):
+        criterios = self._criterios_filtro()
+        self.modelo.definir_filtro(criterios)
+        self._atualiza_contagem()
+        if self._mostrar_finalizados and criterios.texto and not self.modelo.indice.contem_id(criterios.texto):
+            # O ID pode estar num registo finalizado que ainda não foi carregado.
+            self._timer_busca_nuvem.start()
+
+    def _atualiza_contagem(self):
+        visiveis, total = self.modelo.rowCount(), self.modelo.total()
+        self.lbl_contagem.setText(f"{visiveis} de {total}" if visiveis != total else f"{total} registo(s)")
+
+    def _atualiza_filtros_disponiveis(self):
+        """Acrescenta às caixas de filtro os valores que passaram a existir nos registos."""
+        for campo, (cb, _) in self._combos_filtro.items():
+            existentes = {cb.itemData(i) for i in range(1, cb.count())}
+            for valor in self.modelo.indice.valores(campo):
+                if valor not in existentes:
+                    cb.addItem(valor, valor)
+        self._atualiza_contagem()
+
+    def _procurar_finalizados_na_nuvem(self):
+        texto = self.ed_busca.text().strip()
+        if not texto or not self._mostrar_finalizados or self.db is None:
+            return
+        consulta = self.colecao_ref.where(caminho_campo("ID SGD"), "==", texto).limit(TAMANHO_PAGINA_FINALIZADOS)
+        geracao = self._geracao_finalizados
+
+        def trabalhar():
             try:
-                if reg.get("STATUS", "") != "FINALIZADO":
-                    tr = int(reg.get("TEMPO RESTANTE",0))
-                    if tr <= 0:
-                        cor_prazo = QColor(255, 100, 100)
-                    elif tr <= 3:
-                        cor_prazo = QColor(255, 180, 90)
-                    else:
-                        cor_prazo = None
-                    if cor_prazo:
-                        self.tbl.item(r,10).setBackground(cor_prazo)
-                        self.tbl.item(r,10).setForeground(QColor("black"))
-            except Exception:
-                pass
+                docs = list(consulta.stream())
+                self.pagina_finalizados.emit(geracao, None, [converter_documento(d) for d in docs], None)
+            except Exception as e:
+                self.pagina_finalizados.emit(geracao, None, [], e)
 
-        self.tbl.resizeColumnsToContents()
+        threading.Thread(target=trabalhar, name="busca-finalizados", daemon=True).start()
 
     def _excluir_selecionados(self):
-        linhas = sorted({i.row() for i in self.tbl.selectedIndexes()}, reverse=True)
-        if not linhas:
+        ids = [self.modelo.id_na_linha(i.row()) for i in self.tbl.selectionModel().selectedRows()]
+        if not ids:
             msg(self, "Excluir", "Nenhuma linha selecionada.")
             return
-            
-        for idx in linhas:
-            try:
-                reg_para_excluir = self.registros[idx]
-                doc_id = reg_para_excluir.get('id')
-                if doc_id:
-                    self.colecao_ref.document(doc_id).delete()
-                    self._append_historico(f"Registo removido da nuvem – ID SGD: {reg_para_excluir.get('ID SGD','')}.")
-            except Exception as e:
-                msg(self, "Erro de Base de Dados", f"Falha ao excluir os dados: {e}", QMessageBox.Critical)
+        if not self._ligado():
+            return
+
+        # Cada exclusão deixa uma marca em registos_pa_exclusoes, para os outros
+        # clientes a verem na sincronização incremental. As duas operações ficam
+        # seguidas e, como o limite do lote é par, vão sempre no mesmo lote.
+        operacoes = []
+        for doc_id in [i for i in ids if i]:
+            rotulo = self._registros_por_id.get(doc_id, {}).get('ID SGD', doc_id)
+            operacoes.append(OperacaoEscrita('delete', self.colecao_ref.document(doc_id), rotulo=rotulo))
+            operacoes.append(OperacaoEscrita('set', self.exclusoes_ref.document(doc_id),
+                                             {"EXCLUIDO_EM": firestore.SERVER_TIMESTAMP}, rotulo))
+
+        def concluido(resultado: ResultadoEscrita):
+            removidos = sorted({op.rotulo for op in operacoes} - {r for r, _ in resultado.falhas})
+            if removidos:
+                detalhe = f" – ID SGD: {', '.join(removidos)}" if len(removidos) <= 10 else ""
+                self._append_historico(f"{len(removidos)} registo(s) removido(s) da nuvem{detalhe}.", "excluir",
+                                       removidos[0] if len(removidos) == 1 else "")
+            self._reportar_falhas_escrita("Falha ao excluir os dados", resultado)
+
+        self._executar_em_lote(operacoes, "Exclusão", concluido, "escrita.exclusao")
 
     def _recalcular_prazos(self):
-        if not self.registros:
+        if not self.config["persistir_tempo_restante"]:
+            # Os dias restantes são calculados a partir do VENCIMENTO: nada a gravar.
+            self.modelo.definir_hoje(date.today())
+            self.agregados.definir_hoje(date.today())
+            return
+        if not self.registros or not self._ligado():
             return
 
-        batch = self.db.batch()
+        operacoes = []
         for reg in self.registros:
+            if not reg.get("VENCIMENTO"):
+                continue
             novo_tr = dias_restantes(reg["VENCIMENTO"])
             if reg.get("TEMPO RESTANTE") != novo_tr:
                 doc_ref = self.colecao_ref.document(reg['id'])
-                batch.update(doc_ref, {"TEMPO RESTANTE": novo_tr})
-        
-        try:
-            batch.commit()
-            self._append_historico("Recalculo de prazos executado e sincronizado com a nuvem.")
-        except Exception as e:
-            msg(self, "Erro de Base de Dados", f"Falha ao recalcular prazos: {e}", QMessageBox.Critical)
+                operacoes.append(OperacaoEscrita(
+                    'update', doc_ref,
+                    {caminho_campo("TEMPO RESTANTE"): novo_tr, "ATUALIZADO_EM": firestore.SERVER_TIMESTAMP},
+                    reg.get('ID SGD', '')))
+        if not operacoes:
+            return
 
-    def _verificar_prazos_vencidos(self):
-        self._recalcular_prazos()
-        vencidos = []
-        for reg in self.registros:
-            if reg.get("STATUS") != "FINALIZADO" and reg.get("TEMPO RESTANTE", 1) <= 0:
-                vencidos.append(reg.get("ID SGD", "N/A"))
-        if vencidos:
-            texto_aviso = "Os seguintes registos estão com o prazo vencido ou vencendo hoje:\n\n"
-            texto_aviso += "- " + "\n- ".join(vencidos)
-            texto_aviso += "\n\nVerifique a aba 'Registos' para mais detalhes."
-            msg(self, "Aviso de Prazos", texto_aviso, QMessageBox.Warning)
+        def concluido(resultado: ResultadoEscrita):
+            if resultado.sucesso:
+                self._append_historico("Recalculo de prazos executado e sincronizado com a nuvem.", "prazos")
+            self._reportar_falhas_escrita("Falha ao recalcular prazos", resultado)
+
+        self._executar_em_lote(operacoes, "Recálculo de prazos", concluido, "escrita.recalculo")
+
+    def _executar_em_lote(self, operacoes: List[OperacaoEscrita], descricao: str,
+                          ao_concluir: Callable[[ResultadoEscrita], None], metrica: str = "escrita.lote"):
+        """Grava as operações em segundo plano, com o progresso na barra de estado."""
+        escritor = EscritorEmLote(self.db, operacoes, self, metrica)
+        self._escritas_em_curso.append(escritor)
+
+        def progresso(feitas: int, total: int):
+            self.pb_escrita.setRange(0, total)
+            self.pb_escrita.setValue(feitas)
+
+        def concluido(resultado: ResultadoEscrita):
+            self._escritas_em_curso.remove(escritor)
+            if not self._escritas_em_curso:
+                self.pb_escrita.hide()
+            self.statusBar().showMessage(
+                f"{descricao}: {resultado.sucesso} de {resultado.total} operação(ões) gravada(s).", 8000
+            )
+            ao_concluir(resultado)
+            escritor.deleteLater()
 
+        escritor.progresso.connect(progresso)
+        escritor.concluido.connect(concluido)
+        self.pb_escrita.setRange(0, len(operacoes))
+        self.pb_escrita.setValue(0)
+        self.pb_escrita.show()
+        self.statusBar().showMessage(f"{descricao}: a gravar {len(operacoes)} operação(ões)…")
+        escritor.iniciar()
+
+    def _reportar_falhas_escrita(self, titulo: str, resultado: ResultadoEscrita):
+        """Mostra uma única mensagem com todas as falhas de uma escrita em lote."""
+        if not resultado.falhas:
+            return
+        linhas = [f"- {rotulo}: {erro}" for rotulo, erro in resultado.falhas[:15]]
+        if len(resultado.falhas) > 15:
+            linhas.append(f"… e mais {len(resultado.falhas) - 15}.")
+        texto = (f"{titulo}: {len(resultado.falhas)} de {resultado.total} operação(ões) falharam.\n\n"
+                 + "\n".join(linhas))
+        msg(self, "Erro de Base de Dados", texto, QMessageBox.Critical)
+
+    def _on_avisos_prazo(self, avisos: List[Tuple[str, int, date]]):
+        """Mostra numa só janela, sem bloquear, os registos que entraram numa faixa de prazo."""
+        rotulos = {FAIXA_VENCIDO: [], FAIXA_A_VENCER: []}
+        for doc_id, faixa, vencimento in sorted(avisos, key=lambda a: a[2]):
+            reg = self._registros_por_id.get(doc_id, {})
+            rotulos[faixa].append(f"{reg.get('ID SGD', 'N/A')} ({texto_data(vencimento)})")
+        partes = []
+        for faixa, titulo in ((FAIXA_VENCIDO, "Prazo vencido ou vencendo hoje"),
+                              (FAIXA_A_VENCER, f"A vencer em até {DIAS_AVISO_PRAZO} dias")):
+            if rotulos[faixa]:
+                linhas = rotulos[faixa][:15]
+                if len(rotulos[faixa]) > 15:
+                    linhas.append(f"… e mais {len(rotulos[faixa]) - 15}.")
+                partes.append(f"{titulo}:\n- " + "\n- ".join(linhas))
+                self._append_historico(f"{titulo}: {len(rotulos[faixa])} registo(s).", "prazos")
+        texto = "\n\n".join(partes)
+
+        caixa = self._caixa_avisos
+        if caixa is not None and caixa.isVisible():
+            # Ainda por ler: os novos avisos juntam-se aos anteriores.
+            caixa.setText(caixa.text() + "\n\n" + texto)
+            return
+        if caixa is None:
+            caixa = self._caixa_avisos = QMessageBox(QMessageBox.Warning, "Aviso de Prazos", "", QMessageBox.Ok, self)
+            caixa.setWindowModality(Qt.NonModal)
+            caixa.setInformativeText("Verifique a aba 'Registos' para mais detalhes.")
+        caixa.setText(texto)
+        caixa.show()
 
     def _exportar_excel(self):
-        if pd is None:
-            msg(self, "Exportar", "A exportação requer a biblioteca 'pandas'. Instale com:\n\n    pip install pandas openpyxl", QMessageBox.Warning)
+        """Exporta a vista atual (filtro e ordenação da tabela) em segundo plano."""
+        if self._exportacao is not None:
             return
-        if not self.registros:
+        ids = self.modelo.ids_visiveis()
+        if not ids:
             msg(self, "Exportar", "Não há registos para exportar.")
             return
-        caminho, _ = QFileDialog.getSaveFileName(self, "Salvar como", "PA_Registos.xlsx", "Planilha Excel (*.xlsx)")
+        caminho, filtro = QFileDialog.getSaveFileName(
+            self, "Salvar como", "PA_Registos.xlsx", ";;".join(FORMATOS_EXPORTACAO.values())
+        )
+        if not caminho:
+            return
+        extensao = os.path.splitext(caminho)[1].lower()
+        if extensao not in FORMATOS_EXPORTACAO:
+            extensao = next(ext for ext, f in FORMATOS_EXPORTACAO.items() if f == filtro)
+            caminho += extensao
+        aviso = formato_disponivel(extensao)
+        if aviso:
+            msg(self, "Exportar", aviso, QMessageBox.Warning)
+            return
+
+        registros = [self._registros_por_id[i] for i in ids]
+        exportador = self._exportacao = ExportadorRegistos(registros, caminho, self)
+        dialogo = QProgressDialog(f"A exportar {len(registros)} registo(s)…", "Cancelar", 0, len(registros), self)
+        dialogo.setWindowTitle("Exportar")
+        dialogo.setWindowModality(Qt.NonModal)
+        dialogo.setMinimumDuration(500)
+        dialogo.setAutoClose(False)
+        dialogo.setAutoReset(False)
+        dialogo.canceled.connect(exportador.cancelar)
+        self.bt_exportar.setEnabled(False)
+
+        def concluido(erro: Optional[Exception]):
+            self._exportacao = None
+            self.bt_exportar.setEnabled(True)
+            dialogo.close()
+            dialogo.deleteLater()
+            exportador.deleteLater()
+            if isinstance(erro, ExportacaoCancelada):
+                self.statusBar().showMessage("Exportação cancelada.", 5000)
+            elif erro is not None:
+                msg(self, "Exportar", f"Falha ao salvar: {erro}", QMessageBox.Critical)
+            else:
+                self._append_historico(f"Exportação realizada: {os.path.basename(caminho)} ({len(registros)} registo(s))", "exportar")
+                msg(self, "Exportar", "Ficheiro gerado com sucesso.")
+
+        exportador.progresso.connect(lambda feitas, total: dialogo.setValue(feitas))
+        exportador.concluido.connect(concluido)
+        exportador.iniciar()
+
+    def _importar_ficheiro(self):
+        """Importa um .xlsx/.csv em segundo plano, com opção de só validar (sem gravar)."""
+        if self._importacao is not None or not self._ligado():
+            return
+        caminho, _ = QFileDialog.getOpenFileName(self, "Importar registos", "", FORMATOS_IMPORTACAO)
         if not caminho:
             return
-        linhas = []
-        for r in self.registros:
-            linhas.append({
-                "ID SGD": r.get("ID SGD",""),
-                "CIDADE": r.get("CIDADE",""),
-                "BASE GED": r.get("BASE GED",""),
-                "CAIXA MAPA": r.get("CAIXA MAPA",""),
-                "CAIXA SISTEMA": r.get("CAIXA SISTEMA",""),
-                "Quantidade HP": r.get("Quantidade HP",0),
-                "PA": r.get("PA",""),
-                "ABERTO POR": r.get("ABERTO POR",""),
-                "ABERTURA": r.get("ABERTURA").strftime("%d/%m/%Y"),
-                "VENCIMENTO": r.get("VENCIMENTO").strftime("%d/%m/%Y"),
-                "TEMPO RESTANTE": r.get("TEMPO RESTANTE",0),
-                "STATUS": r.get("STATUS",""),
-                "CONCLUSAO": r.get("CONCLUSAO",""),
-                "TIPO PA": r.get("TIPO PA", ""),
-            })
-        df = pd.DataFrame(linhas)
+        aviso = formato_disponivel(os.path.splitext(caminho)[1].lower(), "importação")
+        if aviso:
+            msg(self, "Importar", aviso, QMessageBox.Warning)
+            return
+        pergunta = QMessageBox(QMessageBox.Question, "Importar",
+                               f"Importar os registos de {os.path.basename(caminho)} para a nuvem?\n\n"
+                               "Linhas inválidas ou com um ID SGD já existente não são importadas. "
+                               "\"Só validar\" verifica o ficheiro sem gravar nada.", parent=self)
+        bt_importar = pergunta.addButton("Importar", QMessageBox.AcceptRole)
+        bt_validar = pergunta.addButton("Só validar", QMessageBox.ActionRole)
+        pergunta.addButton("Cancelar", QMessageBox.RejectRole)
+        pergunta.exec_()
+        if pergunta.clickedButton() not in (bt_importar, bt_validar):
+            return
+        simular = pergunta.clickedButton() is bt_validar
+
+        importador = self._importacao = ImportadorRegistos(
+            self.db, self.colecao_ref, caminho, simular, self.config["persistir_tempo_restante"], self
+        )
+        dialogo = QProgressDialog("A validar…" if simular else "A importar…", "Cancelar", 0, 0, self)
+        dialogo.setWindowTitle("Importar")
+        dialogo.setWindowModality(Qt.NonModal)
+        dialogo.setMinimumDuration(500)
+        dialogo.setAutoClose(False)
+        dialogo.setAutoReset(False)
+        dialogo.canceled.connect(importador.cancelar)
+        self.bt_importar.setEnabled(False)
+
+        def progresso(lidas: int, total: int):
+            # Sem total conhecido, o máximo fica a 0 e a barra mostra só atividade.
+            if total:
+                dialogo.setMaximum(total)
+                dialogo.setValue(min(lidas, total))
+            dialogo.setLabelText(f"{'A validar' if simular else 'A importar'}… {lidas} linha(s) lida(s)")
+
+        def concluido(resultado):
+            self._importacao = None
+            self.bt_importar.setEnabled(True)
+            dialogo.close()
+            dialogo.deleteLater()
+            importador.deleteLater()
+            if isinstance(resultado, Exception):
+                msg(self, "Importar", f"Falha ao importar: {resultado}", QMessageBox.Critical)
+                return
+            self._relatar_importacao(caminho, resultado)
+
+        importador.progresso.connect(progresso)
+        importador.concluido.connect(concluido)
+        importador.iniciar()
+
+    def _relatar_importacao(self, caminho: str, relatorio: RelatorioImportacao):
+        nome = os.path.basename(caminho)
+        if relatorio.simulacao:
+            resumo = f"Validação de {nome}: {relatorio.importadas} de {relatorio.lidas} linha(s) podem ser importadas."
+        else:
+            resumo = f"Importação de {nome}: {relatorio.importadas} de {relatorio.lidas} registo(s) importado(s)."
+            self._append_historico(resumo, "importar")
+        if relatorio.interrompida:
+            resumo += "\nCancelada antes do fim do ficheiro."
+        if not relatorio.erros:
+            msg(self, "Importar", resumo)
+            return
+        detalhe = "\n".join(f"Linha {e.linha}: {e.id_sgd or '(sem ID SGD)'} – {e.motivo}" for e in relatorio.erros[:10])
+        if len(relatorio.erros) > 10:
+            detalhe += f"\n… e mais {len(relatorio.erros) - 10}."
+        caixa = QMessageBox(QMessageBox.Warning, "Importar",
+                            f"{resumo}\n\n{len(relatorio.erros)} linha(s) com problemas:\n{detalhe}", parent=self)
+        bt_gravar = caixa.addButton("Gravar relatório…", QMessageBox.ActionRole)
+        caixa.addButton(QMessageBox.Close)
+        caixa.exec_()
+        if caixa.clickedButton() is not bt_gravar:
+            return
+        destino, _ = QFileDialog.getSaveFileName(
+            self, "Gravar relatório", os.path.splitext(caminho)[0] + "_erros.csv", FORMATOS_EXPORTACAO[".csv"]
+        )
+        if not destino:
+            return
         try:
-            df.to_excel(caminho, index=False)
-            self._append_historico(f"Exportação realizada: {os.path.basename(caminho)}")
-            msg(self, "Exportar", "Ficheiro gerado com sucesso.")
+            gravar_relatorio_importacao(destino, relatorio.erros)
         except Exception as e:
-            msg(self, "Exportar", f"Falha ao salvar: {e}", QMessageBox.Critical)
+            msg(self, "Importar", f"Falha ao gravar o relatório: {e}", QMessageBox.Critical)
+
+    # ---------- Aba: Painel ----------
+    def _build_tab_painel(self):
+        tab = QWidget(); layout = QVBoxLayout(tab)
+        tip = QLabel("Totais dos registos carregados na aba Registos, atualizados a cada alteração. "
+                     "Vencidos e a vencer contam só os registos em aberto.")
+        tip.setWordWrap(True)
+        topo = QWidget(); h = QHBoxLayout(topo); h.setContentsMargins(0,0,0,0)
+        self.cb_dimensao_painel = QComboBox()
+        self.cb_dimensao_painel.addItems(DIMENSOES_AGREGADOS)
+        self.cb_dimensao_painel.currentIndexChanged.connect(lambda _: self._atualiza_painel(forcar=True))
+        bt_copiar = QPushButton("Copiar")
+        bt_copiar.setToolTip("Copia a tabela para colar no Excel ou num e-mail.")
+        bt_copiar.clicked.connect(self._copiar_painel)
+        h.addWidget(QLabel("Agrupar por:")); h.addWidget(self.cb_dimensao_painel)
+        h.addWidget(bt_copiar); h.addStretch(1)
+
+        self.tbl_painel = QTableWidget(0, len(COLUNAS_PAINEL))
+        self.tbl_painel.setHorizontalHeaderLabels(COLUNAS_PAINEL)
+        self.tbl_painel.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.tbl_painel.verticalHeader().setVisible(False)
+        self.tbl_painel.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.tbl_painel.setSortingEnabled(True)
+        self.lbl_total_painel = QLabel()
+        layout.addWidget(tip)
+        layout.addWidget(topo)
+        layout.addWidget(self.tbl_painel)
+        layout.addWidget(self.lbl_total_painel)
+        self.tab_painel = tab
+        self.tabs.addTab(tab, "Painel")
+
+        # Só atualiza enquanto a aba está à vista, e só se os agregados mudaram.
+        self._versao_painel = None
+        self._timer_painel = QTimer(self)
+        self._timer_painel.setInterval(1000)
+        self._timer_painel.timeout.connect(self._atualiza_painel)
+
+    def _atualiza_painel(self, forcar: bool = False):
+        if not forcar and self._versao_painel == self.agregados.versao:
+            return
+        self._versao_painel = self.agregados.versao
+        grupos = self.agregados.grupos(self.cb_dimensao_painel.currentText())
+        self.tbl_painel.setSortingEnabled(False)
+        self.tbl_painel.setRowCount(len(grupos))
+        for linha, (grupo, c) in enumerate(sorted(grupos.items())):
+            celulas = [grupo or "(vazio)", c.registos, c.em_aberto, c.vencidos, c.a_vencer, c.qtd_hp]
+            for coluna, valor in enumerate(celulas):
+                item = QTableWidgetItem()
+                # Números como números, para a ordenação pelo cabeçalho ser numérica.
+                item.setData(Qt.DisplayRole, valor)
+                if coluna >= 1:
+                    item.setTextAlignment(int(Qt.AlignRight | Qt.AlignVCenter))
+                if coluna == 3 and valor:
+                    item.setBackground(COR_VENCIDO); item.setForeground(COR_TEXTO_DESTAQUE)
+                elif coluna == 4 and valor:
+                    item.setBackground(COR_A_VENCER); item.setForeground(COR_TEXTO_DESTAQUE)
+                self.tbl_painel.setItem(linha, coluna, item)
+        self.tbl_painel.setSortingEnabled(True)
+        t = self.agregados.total()
+        self.lbl_total_painel.setText(
+            f"Total: {t.registos} registo(s) · {t.em_aberto} em aberto · {t.vencidos} vencido(s) · "
+            f"{t.a_vencer} a vencer · {t.qtd_hp} HP"
+        )
+
+    def _copiar_painel(self):
+        linhas = ["\t".join(COLUNAS_PAINEL)]
+        for linha in range(self.tbl_painel.rowCount()):
+            linhas.append("\t".join(self.tbl_painel.item(linha, coluna).text()
+                                    for coluna in range(self.tbl_painel.columnCount())))
+        QApplication.clipboard().setText("\n".join(linhas))
+        self.statusBar().showMessage("Painel copiado.", 3000)
 
     # ---------- Aba: Histórico ----------
     def _build_tab_historico(self):
         tab = QWidget(); layout = QVBoxLayout(tab)
-        tip = QLabel("Registo de ações desta sessão. Os dados são sincronizados com a nuvem (Firebase).")
+        tip = QLabel("Registo de ações desta sessão. Os dados são sincronizados com a nuvem (Firebase). "
+                     "A pesquisa procura também nas sessões anteriores.")
         tip.setWordWrap(True)
-        self.txt_hist = QTextEdit(); self.txt_hist.setReadOnly(True)
-        self.txt_hist.setFont(QFont("Consolas", 10))
+        topo = QWidget(); h = QHBoxLayout(topo); h.setContentsMargins(0,0,0,0)
+        self.ed_busca_hist = QLineEdit()
+        self.ed_busca_hist.setPlaceholderText("Pesquisar no histórico (texto, ação, utilizador ou ID SGD)…")
+        self.ed_busca_hist.setClearButtonEnabled(True)
+        self.ed_busca_hist.textChanged.connect(self._on_busca_historico)
+        self.lbl_busca_hist = QLabel()
+        h.addWidget(self.ed_busca_hist, 1); h.addWidget(self.lbl_busca_hist)
+
+        self.modelo_hist = ModeloHistorico(CAPACIDADE_HISTORICO, self)
+        self.modelo_busca_hist = ModeloHistorico(parent=self)
+        self.lst_hist = QListView()
+        self.lst_hist.setModel(self.modelo_hist)
+        # Linhas todas com a mesma altura: a vista só mede e desenha as visíveis.
+        self.lst_hist.setUniformItemSizes(True)
+        self.lst_hist.setFont(QFont("Consolas", 10))
         layout.addWidget(tip)
-        layout.addWidget(self.txt_hist)
+        layout.addWidget(topo)
+        layout.addWidget(self.lst_hist)
         self.tabs.addTab(tab, "Histórico")
 
-    def _append_historico(self, texto: str):
-        ts = datetime.now().strftime("%d/%m/%Y %H:%M:%S")
-        self.txt_hist.append(f"[{ts}] {texto}")
+        self._timer_busca_hist = QTimer(self)
+        self._timer_busca_hist.setSingleShot(True)
+        self._timer_busca_hist.setInterval(300)
+        self._timer_busca_hist.timeout.connect(self._pesquisar_historico)
+        self._geracao_busca_hist = 0
+        # scrollToBottom refaz o layout da lista: faz-se uma vez por ciclo de eventos, não por linha.
+        self._timer_rolar_hist = QTimer(self)
+        self._timer_rolar_hist.setSingleShot(True)
+        self._timer_rolar_hist.setInterval(0)
+        self._timer_rolar_hist.timeout.connect(self.lst_hist.scrollToBottom)
+
+        self.registo_hist: Optional[RegistoHistorico] = None
+        ficheiro = self.config.get("ficheiro_historico")
+        if ficheiro:
+            try:
+                self.registo_hist = RegistoHistorico(os.path.join(pasta_base(), ficheiro), self)
+                self.registo_hist.resultados.connect(self._on_resultados_historico)
+            except Exception as e:
+                log.warning("Ficheiro de histórico indisponível: %s", e)
+
+    def _append_historico(self, texto: str, acao: str = "info", id_sgd: str = ""):
+        entrada = EntradaHistorico(datetime.now(), acao, texto, self._utilizador, id_sgd)
+        ultima = self.modelo_hist.ultima()
+        fim = self.lst_hist.verticalScrollBar()
+        no_fim = fim.value() == fim.maximum()
+        if ultima is not None and (ultima.acao, ultima.texto, ultima.id_sgd) == (acao, texto, id_sgd):
+            # Mensagens repetidas seguidas (ex.: cada snapshot) ocupam uma só linha, com contador;
+            # no ficheiro fica apenas a primeira.
+            self.modelo_hist.substituir_ultima(entrada._replace(repeticoes=ultima.repeticoes + 1))
+        else:
+            self.modelo_hist.acrescentar(entrada)
+            if self.registo_hist is not None:
+                self.registo_hist.registar(entrada)
+        if no_fim and self.lst_hist.model() is self.modelo_hist:
+            self._timer_rolar_hist.start()
+
+    def _on_busca_historico(self, texto: str):
+        if texto.strip():
+            self._timer_busca_hist.start()
+            return
+        self._timer_busca_hist.stop()
+        self._geracao_busca_hist = 0
+        self.lbl_busca_hist.clear()
+        self.lst_hist.setModel(self.modelo_hist)
+        self.lst_hist.scrollToBottom()
+
+    def _pesquisar_historico(self):
+        termo = self.ed_busca_hist.text().strip()
+        if not termo:
+            return
+        if self.registo_hist is None:
+            # Sem ficheiro, pesquisa só nas entradas em memória.
+            alvo = normalizar(termo)
+            entradas = [e for e in self.modelo_hist._entradas
+                        if alvo in normalizar(" ".join((e.texto, e.acao, e.utilizador, e.id_sgd)))]
+            self._mostrar_resultados_historico(entradas)
+            return
+        self.lbl_busca_hist.setText("A pesquisar…")
+        self._geracao_busca_hist = self.registo_hist.pesquisar(termo)
+
+    def _on_resultados_historico(self, geracao: int, entradas: List[EntradaHistorico]):
+        if geracao == self._geracao_busca_hist:
+            self._mostrar_resultados_historico(entradas)
+
+    def _mostrar_resultados_historico(self, entradas: List[EntradaHistorico]):
+        self.modelo_busca_hist.definir(entradas)
+        limite = " (as mais recentes)" if len(entradas) >= RESULTADOS_PESQUISA_HISTORICO else ""
+        self.lbl_busca_hist.setText(f"{len(entradas)} resultado(s){limite}")
+        self.lst_hist.setModel(self.modelo_busca_hist)
+        self.lst_hist.scrollToBottom()
+
+    # ---------- Aba: Diagnóstico ----------
+    def _build_tab_diagnostico(self):
+        tab = QWidget(); layout = QVBoxLayout(tab)
+        tip = QLabel("Tempos medidos nesta sessão (últimas amostras de cada métrica). "
+                     "Passe o rato sobre o nome de uma métrica para ver o que mede.")
+        tip.setWordWrap(True)
+        topo = QWidget(); h = QHBoxLayout(topo); h.setContentsMargins(0,0,0,0)
+        bt_gravar = QPushButton("Gravar JSON…")
+        bt_gravar.clicked.connect(self._gravar_diagnostico)
+        bt_limpar = QPushButton("Limpar")
+        bt_limpar.clicked.connect(self._limpar_diagnostico)
+        h.addWidget(bt_gravar); h.addWidget(bt_limpar); h.addStretch(1)
+
+        self.tbl_diagnostico = QTableWidget(0, len(COLUNAS_DIAGNOSTICO))
+        self.tbl_diagnostico.setHorizontalHeaderLabels(COLUNAS_DIAGNOSTICO)
+        self.tbl_diagnostico.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.tbl_diagnostico.verticalHeader().setVisible(False)
+        self.tbl_diagnostico.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        layout.addWidget(tip)
+        layout.addWidget(topo)
+        layout.addWidget(self.tbl_diagnostico)
+        self.tab_diagnostico = tab
+        self.tabs.addTab(tab, "Diagnóstico")
+
+        # Só atualiza enquanto a aba está à vista.
+        self._timer_diagnostico = QTimer(self)
+        self._timer_diagnostico.setInterval(1000)
+        self._timer_diagnostico.timeout.connect(self._atualiza_diagnostico)
+        self.tabs.currentChanged.connect(self._on_aba_alterada)
+
+    def _on_aba_alterada(self, indice: int):
+        if self.tabs.widget(indice) is self.tab_diagnostico:
+            self._atualiza_diagnostico()
+            self._timer_diagnostico.start()
+        else:
+            self._timer_diagnostico.stop()
+        if self.tabs.widget(indice) is self.tab_painel:
+            self._atualiza_painel()
+            self._timer_painel.start()
+        else:
+            self._timer_painel.stop()
+
+    def _atualiza_diagnostico(self):
+        resumo = metricas.resumo()
+        self.tbl_diagnostico.setRowCount(len(resumo))
+        for linha, (nome, valores) in enumerate(resumo.items()):
+            celulas = [nome, valores["unidade"], valores["total"]] + [
+                valores.get(campo, "") for campo in ("ultimo", "p50", "p90", "p99", "max")
+            ]
+            for coluna, valor in enumerate(celulas):
+                item = QTableWidgetItem(str(valor))
+                if coluna >= 2:
+                    item.setTextAlignment(int(Qt.AlignRight | Qt.AlignVCenter))
+                if coluna == 0:
+                    item.setToolTip(DESCRICOES_METRICAS.get(nome, ""))
+                self.tbl_diagnostico.setItem(linha, coluna, item)
+
+    def _limpar_diagnostico(self):
+        metricas.limpar()
+        self._atualiza_diagnostico()
+
+    def _gravar_diagnostico(self):
+        caminho, _ = QFileDialog.getSaveFileName(self, "Gravar diagnóstico", "diagnostico_pa.json", "JSON (*.json)")
+        if not caminho:
+            return
+        try:
+            metricas.gravar_json(caminho)
+            self._append_historico(f"Diagnóstico gravado: {os.path.basename(caminho)}", "diagnostico")
+        except Exception as e:
+            msg(self, "Diagnóstico", f"Falha ao gravar: {e}", QMessageBox.Critical)
+
+
+# ------------------------------
+# Ligação ao Firebase
+# ------------------------------
+
+def ligar_firebase():
+    """Inicializa o Firebase com a chave da pasta base e devolve o cliente do Firestore."""
+    # Determina o caminho base de forma fiável
+    base_path = pasta_base()
+
+    key_path = os.path.join(base_path, "serviceAccountKey.json")
+
+    # A verificação mais importante:
+    key_exists = os.path.exists(key_path)
+    log.info("Pasta base: %s", base_path)
+    log.debug("Chave de serviço: %s (existe: %s)", key_path, key_exists)
+
+    if not key_exists:
+        # Lança um erro claro se o ficheiro não for encontrado
+        raise FileNotFoundError(f"O ficheiro da chave '{key_path}' não foi encontrado.")
+
+    # Se o ficheiro existe, continua com a inicialização
+    importlib.import_module("firebase_admin")
+    perfil_arranque.marcar("importar firebase_admin")
+    importlib.import_module("firebase_admin.firestore")
+    perfil_arranque.marcar("importar firestore (grpc)")
+    cred = credentials.Certificate(key_path)
+    perfil_arranque.marcar("ler credenciais")
+    firebase_admin.initialize_app(cred)
+    perfil_arranque.marcar("initialize_app")
+    db_client = firestore.client()
+    perfil_arranque.marcar("firestore.client()")
+    return db_client
+
+class LigacaoFirebase(QObject):
+    """Inicializa o Firebase numa thread à parte, enquanto a janela já está visível.
+
+    Importar o firebase_admin (grpc, protobuf) e criar o cliente demora
+    segundos; os sinais chegam à thread da interface quando terminar.
+    """
+
+    pronto = pyqtSignal(object)
+    falhou = pyqtSignal(str)
+
+    def iniciar(self):
+        threading.Thread(target=self._executar, name="ligacao-firebase", daemon=True).start()
+
+    def _executar(self):
+        try:
+            db_client = ligar_firebase()
+        except Exception as e:
+            self.falhou.emit(str(e))
+            return
+        self.pronto.emit(db_client)
 
 
 # ------------------------------
 # Executar aplicativo
 # ------------------------------
-def main():
-    # --- INICIALIZAÇÃO COM DIAGNÓSTICO FINAL ---
-    # Primeiro, vamos criar a aplicação. Isto garante que podemos mostrar mensagens de erro.
-    app = QApplication(sys.argv)
-    
-    # Agora, vamos tentar ligar ao Firebase e imprimir cada passo.
+
+def importar_pela_linha_de_comandos(caminho: str, simular: bool, relatorio_csv: Optional[str]) -> int:
+    """Importação sem interface (--importar); devolve o código de saída do processo."""
+    config = carregar_config()
     try:
-        print("--- A iniciar diagnóstico de caminho ---")
-        
-        # Determina o caminho base de forma fiável
-        if getattr(sys, 'frozen', False):
-            base_path = os.path.dirname(sys.executable)
-        else:
-            base_path = os.path.dirname(os.path.abspath(__file__))
+        db_client = ligar_firebase()
+    except Exception as e:
+        print(f"ERRO CRÍTICO: Não foi possível inicializar o Firebase: {e}", file=sys.stderr)
+        return 2
+    total = contar_linhas_importacao(caminho)
 
-        key_path = os.path.join(base_path, "serviceAccountKey.json")
+    def progresso(lidas: int):
+        print(f"\r{lidas}/{total or '?'} linha(s) lida(s)", end="", file=sys.stderr, flush=True)
 
-        print(f"Pasta base do script detetada: {base_path}")
-        print(f"Caminho completo para a chave que será usado: {key_path}")
-        
-        # A verificação mais importante:
-        key_exists = os.path.exists(key_path)
-        print(f"O ficheiro da chave existe neste caminho? -> {key_exists}")
-        print("--- Fim do diagnóstico ---")
+    try:
+        relatorio = importar_registos(db_client, db_client.collection('registros_pa'), caminho, simular,
+                                      config["persistir_tempo_restante"], ao_progresso=progresso)
+    except Exception as e:
+        print(f"\nFalha ao importar: {e}", file=sys.stderr)
+        return 2
+    print(file=sys.stderr)
+    acao = "podem ser importada(s) (simulação, nada foi gravado)" if simular else "importada(s)"
+    print(f"{relatorio.importadas} de {relatorio.lidas} linha(s) {acao}; {len(relatorio.erros)} com problemas.")
+    if relatorio_csv:
+        gravar_relatorio_importacao(relatorio_csv, relatorio.erros)
+        print(f"Relatório de erros gravado em {relatorio_csv}")
+    else:
+        for erro in relatorio.erros:
+            print(f"Linha {erro.linha}: {erro.id_sgd or '(sem ID SGD)'} – {erro.motivo}")
+    return 1 if relatorio.erros else 0
 
-        if not key_exists:
-            # Lança um erro claro se o ficheiro não for encontrado
-            raise FileNotFoundError(f"O ficheiro da chave '{key_path}' não foi encontrado.")
+def servir_relay(endereco: str) -> int:
+    """Modo relay (--relay): segura o listener do Firestore e serve as janelas da rede local até Ctrl+C."""
+    config = carregar_config()
+    try:
+        db_client = ligar_firebase()
+    except Exception as e:
+        print(f"ERRO CRÍTICO: Não foi possível inicializar o Firebase: {e}", file=sys.stderr)
+        return 2
+    try:
+        servidor = ServidorRelay(db_client, endereco_relay(endereco), config.get("chave_relay", ""),
+                                 janela_dias=int(config["janela_abertura_dias"]))
+    except (OSError, ValueError) as e:
+        print(f"Não foi possível abrir o relay em {endereco}: {e}", file=sys.stderr)
+        return 2
+    servidor.iniciar()
+    maquina, porta = servidor.endereco
+    print(f"Relay a servir em {maquina or '0.0.0.0'}:{porta} (Ctrl+C para terminar).")
+    if servidor.janela_dias > 0:
+        print(f"Só são servidos os registos abertos nos últimos {servidor.janela_dias} dias (janela_abertura_dias).")
+    if not config.get("chave_relay"):
+        print("Aviso: sem chave_relay no app_config.json, qualquer máquina da rede pode ler os registos.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    servidor.parar()
+    return 0
 
-        # Se o ficheiro existe, continua com a inicialização
-        cred = credentials.Certificate(key_path)
-        firebase_admin.initialize_app(cred)
-        db_client = firestore.client()
+def main():
+    parser = argparse.ArgumentParser(description="Gestor de P.A.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="imprime no terminal quanto demorou cada passo do arranque")
+    parser.add_argument("--importar", metavar="FICHEIRO",
+                        help="importa um .xlsx/.csv (colunas da exportação) para a nuvem, sem abrir a janela")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="com --importar: valida o ficheiro e verifica duplicados, sem gravar nada")
+    parser.add_argument("--relatorio", metavar="CSV",
+                        help="com --importar: grava as linhas rejeitadas neste CSV em vez de as listar")
+    parser.add_argument("--relay", nargs="?", const=f":{PORTA_RELAY}", metavar="[MÁQUINA]:PORTA",
+                        help=f"sem janela: ouve o Firestore uma vez e serve as alterações às janelas da rede "
+                             f"local (por omissão em todas as interfaces, porta {PORTA_RELAY})")
+    args, resto = parser.parse_known_args()
+    # O QueueListener é parado à saída, para escrever as últimas mensagens no ficheiro.
+    atexit.register(configurar_log(carregar_config()).stop)
+    if args.relay:
+        sys.exit(servir_relay(args.relay))
+    if args.importar:
+        sys.exit(importar_pela_linha_de_comandos(args.importar, args.dry_run, args.relatorio))
+    perfil_arranque.ativo = args.profile_startup
+    perfil_arranque.marcar("módulos importados", _FIM_IMPORTACOES)
 
-    except Exception as e:
-        # Se qualquer erro acontecer, mostramos a mensagem e saímos.
-        msg_erro = f"ERRO CRÍTICO: Não foi possível inicializar o Firebase.\n\n" \
-                   f"Verifique as informações de diagnóstico impressas no terminal.\n\n" \
-                   f"Detalhes técnicos: {e}"
-        msg(None, "Erro de Inicialização", msg_erro, QMessageBox.Critical)
-        return # Encerra a função main se a ligação falhar
+    # Primeiro, vamos criar a aplicação. Isto garante que podemos mostrar mensagens de erro.
+    app = QApplication(sys.argv[:1] + resto)
+    perfil_arranque.marcar("QApplication criada")
 
     # Se a inicialização for bem-sucedida, o resto do código é executado
     app.setStyle("Fusion")
@@ -508,16 +4834,30 @@ def main():
         QPushButton { background-color: #0078D7; color: white; border: none; border-radius: 5px; padding: 8px 16px; font-weight: bold; }
         QPushButton:hover { background-color: #1085E0; }
         QPushButton:pressed { background-color: #006ABC; }
-        QTableWidget { background-color: #3C3C3C; gridline-color: #555555; color: #E0E0E0; alternate-background-color: #464646; }
+        QTableView { background-color: #3C3C3C; gridline-color: #555555; color: #E0E0E0; alternate-background-color: #464646; }
         QHeaderView::section { background-color: #555555; color: #E0E0E0; padding: 4px; border: 1px solid #3C3C3C; font-weight: bold; }
-        QTableWidget::item:selected { background-color: #0078D7; color: white; }
+        QTableView::item:selected { background-color: #0078D7; color: white; }
         QTabBar::tab { background: #3C3C3C; color: #AAAAAA; padding: 8px; border: 1px solid #555555; border-bottom: none; border-top-left-radius: 4px; border-top-right-radius: 4px; }
         QTabBar::tab:selected, QTabBar::tab:hover { background: #4A4A4A; color: #FFFFFF; }
         QTabWidget::pane { border: 1px solid #555555; }
         QMessageBox { background-color: #3C3C3C; }
     """
     app.setStyleSheet(style_sheet)
-    
-    w = AppPA(db_client)
+
+    # A ligação ao Firebase corre em paralelo com a construção da janela.
+    # Os sinais são ligados antes de a thread arrancar, para nenhum se perder;
+    # chegam pelo ciclo de eventos, portanto já depois de a janela existir.
+    w: Optional[AppPA] = None
+    ligacao = LigacaoFirebase()
+    ligacao.pronto.connect(lambda db_client: w.definir_cliente(db_client))
+    ligacao.falhou.connect(lambda erro: w._on_falha_ligacao(erro))
+    ligacao.iniciar()
+
+    w = AppPA()
     w.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    perfil_arranque.marcar("janela visível")
+    sys.exit(app.exec_())
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
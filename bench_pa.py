@@ -0,0 +1,288 @@
+"""Medições de desempenho do Gestor de P.A. com um Firestore em memória.
+
+Abre a janela principal sem ecrã (plataforma "offscreen" do Qt) ligada ao
+firestore_memoria, com coleções sintéticas de vários tamanhos, e mede os
+caminhos mais pesados: primeiro snapshot, alteração de um documento,
+reconstrução da tabela, recálculo de prazos, exportação, ordenação e exclusão
+de linhas selecionadas, além da memória ocupada pelos registos. Cada tamanho
+corre num processo à parte, para o pico de memória (RSS) ser o desse tamanho.
+
+O resultado é um JSON, para comparar execuções ao longo do tempo:
+
+    python bench_pa.py                          # 1k, 10k e 100k registos
+    python bench_pa.py --tamanhos 1000 5000 --saida bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Optional
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+TAMANHOS_PADRAO = [1000, 10000, 100000]
+ALTERACOES_UNITARIAS = 20
+# Fração de registos finalizados: não entram no listener, como na aplicação real.
+FRACAO_FINALIZADOS = 0.3
+MAX_LINHAS_EXCLUSAO = 1000
+COLUNAS_ORDENACAO = {"ID SGD": 0, "CIDADE": 1, "VENCIMENTO": 9, "STATUS": 11}
+TEMPO_LIMITE_S = 600
+
+CIDADES = ["São Paulo", "Campinas", "Santos", "Sorocaba", "Ribeirão Preto", "Bauru", "Marília", "Franca"]
+BASES = ["NORTE", "SUL", "LESTE", "OESTE"]
+TIPOS = ["NORMAL", "URGENTE", "RECORRENTE"]
+STATUS_ABERTOS = ["EM ABERTO", "EM ANDAMENTO", "AGUARDANDO"]
+
+
+def gerar_registos(n: int, semente: int = 42) -> Dict[str, Dict[str, Any]]:
+    """Documentos sintéticos com a forma dos de registros_pa."""
+    aleatorio = random.Random(semente)
+    hoje = datetime.combine(datetime.now().date(), datetime.min.time())
+    criado_base = hoje - timedelta(days=400)
+    documentos = {}
+    for i in range(n):
+        abertura = hoje - timedelta(days=aleatorio.randint(0, 365))
+        finalizado = aleatorio.random() < FRACAO_FINALIZADOS
+        documentos[f"doc{i:07d}"] = {
+            "ID SGD": f"SGD{1000000 + i}",
+            "CIDADE": aleatorio.choice(CIDADES),
+            "BASE GED": aleatorio.choice(BASES),
+            "CAIXA MAPA": f"CX-{aleatorio.randint(1, 500)}",
+            "CAIXA SISTEMA": f"SIS{aleatorio.randint(1, 2000)}",
+            "Quantidade HP": aleatorio.randint(0, 50),
+            "PA": f"PA {aleatorio.randint(1, 99)}",
+            "ABERTO POR": f"Utilizador {aleatorio.randint(1, 40)}",
+            "ABERTURA": abertura,
+            "VENCIMENTO": abertura + timedelta(days=aleatorio.randint(5, 60)),
+            "STATUS": "FINALIZADO" if finalizado else aleatorio.choice(STATUS_ABERTOS),
+            "CONCLUSAO": "SIM" if finalizado else "NÃO",
+            "TIPO PA": aleatorio.choice(TIPOS),
+            "CRIADO_EM": criado_base + timedelta(seconds=i * 30),
+        }
+    return documentos
+
+
+def pico_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 2 ** 20, 1)
+        except Exception:
+            return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KiB, macOS devolve bytes.
+    return round(pico / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def medir_registos(documentos: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """Memória ocupada pelos registos da aplicação (tracemalloc) e o tempo de os criar.
+
+    Os documentos passam antes por JSON, como na cache local: cada um fica com
+    os seus próprios textos e datas, como os que chegam do Firestore. Só conta
+    o que a aplicação guarda, não o Firestore em memória.
+    """
+    import tracemalloc
+    import PA
+    textos = [(doc_id, json.dumps(d, default=PA._json_padrao)) for doc_id, d in documentos.items()]
+    inicio = time.perf_counter()
+    registos = [PA.converter_dados(doc_id, json.loads(texto, object_hook=PA._json_objeto)) for doc_id, texto in textos]
+    tempo_ms = (time.perf_counter() - inicio) * 1000
+    del registos
+    tracemalloc.start()
+    registos = [PA.converter_dados(doc_id, json.loads(texto, object_hook=PA._json_objeto)) for doc_id, texto in textos]
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {"converter_ms": round(tempo_ms, 2), "memoria_mb": round(memoria / 2 ** 20, 1),
+            "bytes_por_registo": round(memoria / max(1, len(registos)))}
+
+
+def _resumo(amostras: List[float]) -> Dict[str, float]:
+    ordenadas = sorted(amostras)
+    return {
+        "mediana": round(statistics.median(ordenadas), 2),
+        "p95": round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))], 2),
+        "max": round(ordenadas[-1], 2),
+    }
+
+
+def medir_tamanho(n: int) -> Dict[str, Any]:
+    """Corre todas as medições para uma coleção de n documentos (no processo atual)."""
+    from PyQt5.QtCore import Qt, QItemSelection, QItemSelectionModel
+    from PyQt5.QtWidgets import QApplication, QFileDialog
+
+    import PA
+    from firestore_memoria import ClienteMemoria
+
+    app = QApplication.instance() or QApplication([])
+    pasta = tempfile.mkdtemp(prefix="bench_pa_")
+    # Sem diálogos modais e com a cache/fila locais numa pasta temporária.
+    PA.msg = lambda *a, **k: None
+    PA.pasta_base = lambda: pasta
+
+    aplicacoes_ms: List[float] = []
+    aplicar_original = PA.AppPA._aplicar_lote
+
+    def aplicar_cronometrado(self, lote):
+        inicio = time.perf_counter()
+        aplicar_original(self, lote)
+        aplicacoes_ms.append((time.perf_counter() - inicio) * 1000)
+
+    PA.AppPA._aplicar_lote = aplicar_cronometrado
+
+    def esperar(condicao: Callable[[], bool]):
+        limite = time.perf_counter() + TEMPO_LIMITE_S
+        while not condicao():
+            if time.perf_counter() > limite:
+                raise TimeoutError("A medição excedeu o tempo limite.")
+            app.processEvents()
+            time.sleep(0.001)
+
+    def cronometrar(funcao: Callable[[], None], ate: Optional[Callable[[], bool]] = None) -> float:
+        inicio = time.perf_counter()
+        funcao()
+        if ate is not None:
+            esperar(ate)
+        return round((time.perf_counter() - inicio) * 1000, 2)
+
+    db = ClienteMemoria()
+    colecao = db.collection("registros_pa")
+    documentos = gerar_registos(n)
+    colecao.carregar(documentos)
+    abertos = [doc_id for doc_id, d in documentos.items() if d["STATUS"] != "FINALIZADO"]
+    tempos: Dict[str, Any] = {}
+
+    # Primeiro snapshot: da criação da janela até a tabela ter todos os registos em aberto.
+    janela = None
+
+    def criar():
+        nonlocal janela
+        janela = PA.AppPA(db)
+
+    tempos["arranque_ms"] = cronometrar(criar)
+    tempos["primeiro_snapshot_ms"] = cronometrar(lambda: None, ate=lambda: janela.modelo.total() == len(abertos))
+    tempos["primeiro_snapshot_aplicar_ms"] = round(sum(aplicacoes_ms), 2)
+    pico_apos_carga = pico_rss_mb()
+
+    # Alteração de um documento: da escrita até a tabela a mostrar.
+    aleatorio = random.Random(7)
+    latencias, custos = [], []
+    for i in range(ALTERACOES_UNITARIAS):
+        doc_id, cidade = aleatorio.choice(abertos), f"Cidade {i}"
+        antes = len(aplicacoes_ms)
+        latencias.append(cronometrar(
+            lambda: db.collection("registros_pa").document(doc_id).update({"CIDADE": cidade}),
+            ate=lambda: janela._registros_por_id[doc_id].get("CIDADE") == cidade,
+        ))
+        custos.append(sum(aplicacoes_ms[antes:]))
+    tempos["alteracao_unitaria_latencia_ms"] = _resumo(latencias)
+    tempos["alteracao_unitaria_aplicar_ms"] = _resumo(custos)
+
+    tempos["atualiza_tabela_ms"] = _resumo([cronometrar(janela._atualiza_tabela) for _ in range(3)])
+
+    tempos["recalcular_prazos_ms"] = cronometrar(janela._recalcular_prazos)
+    janela.config["persistir_tempo_restante"] = True
+    tempos["recalcular_prazos_persistido_ms"] = cronometrar(
+        janela._recalcular_prazos, ate=lambda: not janela._escritas_em_curso
+    )
+    janela.config["persistir_tempo_restante"] = False
+
+    for extensao in (".xlsx", ".csv"):
+        caminho = os.path.join(pasta, "exportacao" + extensao)
+        QFileDialog.getSaveFileName = staticmethod(
+            lambda *a, caminho=caminho, extensao=extensao, **k: (caminho, PA.FORMATOS_EXPORTACAO[extensao])
+        )
+        tempos[f"exportar{extensao.replace('.', '_')}_ms"] = cronometrar(
+            janela._exportar_excel, ate=lambda: janela._exportacao is None
+        )
+
+    ordenacao = {}
+    for nome, coluna in COLUNAS_ORDENACAO.items():
+        for ordem, sufixo in ((Qt.AscendingOrder, "asc"), (Qt.DescendingOrder, "desc")):
+            ordenacao[f"{nome} {sufixo}"] = cronometrar(lambda: janela.tbl.sortByColumn(coluna, ordem))
+    tempos["ordenar_ms"] = ordenacao
+
+    # Exclusão das primeiras linhas selecionadas, até desaparecerem da tabela.
+    quantidade = min(MAX_LINHAS_EXCLUSAO, max(1, janela.modelo.rowCount() // 10))
+    modelo = janela.modelo
+    selecao = QItemSelection(modelo.index(0, 0), modelo.index(quantidade - 1, len(PA.COLUNAS) - 1))
+    janela.tbl.selectionModel().select(selecao, QItemSelectionModel.ClearAndSelect | QItemSelectionModel.Rows)
+    total_antes = modelo.total()
+    tempos["excluir_selecionados_linhas"] = quantidade
+    tempos["excluir_selecionados_ms"] = cronometrar(
+        janela._excluir_selecionados, ate=lambda: modelo.total() == total_antes - quantidade
+    )
+
+    janela.close()
+    pico = pico_rss_mb()
+    return {
+        "registos": n,
+        "registos_ao_vivo": len(abertos),
+        "tempos": tempos,
+        "pico_rss_apos_carga_mb": pico_apos_carga,
+        "pico_rss_mb": pico,
+        # Medido no fim: o tracemalloc não entra no pico de memória acima.
+        "registos_em_memoria": medir_registos(documentos),
+    }
+
+
+def _commit_atual() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Medições de desempenho do Gestor de P.A.")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=TAMANHOS_PADRAO,
+                        help="números de registos a medir (por omissão: 1000 10000 100000)")
+    parser.add_argument("--saida", help="ficheiro JSON de saída (por omissão, o JSON vai para o ecrã)")
+    parser.add_argument("--_tamanho", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--_resultado", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._tamanho is not None:
+        resultado = medir_tamanho(args._tamanho)
+        with open(args._resultado, "w", encoding="utf-8") as f:
+            json.dump(resultado, f)
+        return
+
+    resultados = []
+    for n in args.tamanhos:
+        print(f"A medir {n} registos…", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as pasta:
+            caminho = os.path.join(pasta, "resultado.json")
+            # Um processo por tamanho: o pico de memória de um não contamina o seguinte.
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--_tamanho", str(n), "--_resultado", caminho],
+                           stdout=subprocess.DEVNULL, check=True)
+            with open(caminho, encoding="utf-8") as f:
+                resultados.append(json.load(f))
+
+    relatorio = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_atual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "resultados": resultados,
+    }
+    texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Configuração dos testes: Qt sem ecrã e os ficheiros da aplicação numa pasta temporária.
+
+Os testes usam o Firestore em memória (firestore_memoria.py); não precisam de rede nem da chave de serviço.
+"""
+
+import os
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pytest
+from PyQt5.QtWidgets import QApplication
+
+import PA
+from firestore_memoria import ClienteMemoria
+
+
+@pytest.fixture(scope="session")
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture(autouse=True)
+def pasta(tmp_path, monkeypatch):
+    """Cache, fila e histórico de cada teste ficam na sua pasta; as caixas de mensagem não abrem."""
+    monkeypatch.setattr(PA, "pasta_base", lambda: str(tmp_path))
+    monkeypatch.setattr(PA, "msg", lambda *args, **kwargs: None)
+    return tmp_path
+
+
+@pytest.fixture
+def db():
+    return ClienteMemoria()
+
+
+@pytest.fixture
+def esperar(app):
+    """Processa os eventos do Qt até a condição se verificar (ou falha ao fim de `limite` segundos)."""
+
+    def esperar(condicao, limite: float = 5.0):
+        fim = time.monotonic() + limite
+        while not condicao():
+            if time.monotonic() > fim:
+                raise AssertionError("a condição não se verificou a tempo")
+            app.processEvents()
+            time.sleep(0.01)
+
+    return esperar
+
+
+@pytest.fixture
+def janela(app, db, esperar):
+    """Abre AppPA ligada ao Firestore em memória; fecha as que ficarem abertas no fim do teste."""
+    abertas = []
+
+    def fechar(w):
+        abertas.remove(w)
+        w.close()
+
+    def abrir(config=None):
+        w = PA.AppPA(db, dict(PA.CONFIG_PADRAO, **(config or {})))
+        abertas.append(w)
+        esperar(lambda: w.despachante.contadores["aplicados"] > 0)
+        return w
+
+    abrir.fechar = fechar
+    yield abrir
+    for w in list(abertas):
+        fechar(w)
+    app.processEvents()
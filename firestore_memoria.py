@@ -0,0 +1,386 @@
+"""Substituto em memória do cliente do Firestore, para medições e ensaios sem rede.
+
+Implementa apenas o que o PA.py usa: coleções, documentos, consultas com
+where/order_by/limit/start_after, on_snapshot, lotes de escrita e a pré-condição
+last_update_time. Tal como no Firestore, os snapshots são entregues numa thread
+à parte, pela ordem das escritas, SERVER_TIMESTAMP é substituído pela hora da
+gravação e cada escrita tem um update_time diferente.
+
+Uso:
+    from firestore_memoria import ClienteMemoria
+    app = AppPA(ClienteMemoria())
+"""
+
+import enum
+import queue
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Any, Tuple, Optional, Callable
+
+# O SDK é opcional: sem ele, usam-se equivalentes com os mesmos nomes, códigos e regras.
+try:
+    from google.api_core.exceptions import FailedPrecondition, NotFound
+except ImportError:
+    class FailedPrecondition(Exception):
+        """Equivalente a google.api_core.exceptions.FailedPrecondition."""
+        code = 400
+
+    class NotFound(Exception):
+        """Equivalente a google.api_core.exceptions.NotFound."""
+        code = 404
+
+try:
+    from google.cloud.firestore_v1.field_path import parse_field_path
+    from google.cloud.firestore_v1.transforms import SERVER_TIMESTAMP
+except ImportError:
+    SERVER_TIMESTAMP = object()
+    _NOME_SIMPLES = re.compile(r"[_a-zA-Z][_a-zA-Z0-9]*")
+    _NOME_CITADO = re.compile(r"`((?:[^`\\]|\\.)+)`")
+
+    def parse_field_path(api_repr: str) -> List[str]:
+        """Mesmas regras do split_field_path do SDK: nomes com espaços têm de vir entre acentos graves."""
+        partes, pos = [], 0
+        while True:
+            simples = _NOME_SIMPLES.match(api_repr, pos)
+            citado = None if simples else _NOME_CITADO.match(api_repr, pos)
+            if simples is None and citado is None:
+                raise ValueError(f"Path {api_repr} not consumed, residue: {api_repr[pos:]}")
+            partes.append(simples.group() if simples else re.sub(r"\\(.)", r"\1", citado.group(1)))
+            pos = (simples or citado).end()
+            if pos == len(api_repr):
+                return partes
+            if api_repr[pos] != ".":
+                raise ValueError(f"Path {api_repr} not consumed, residue: {api_repr[pos:]}")
+            pos += 1
+
+# Nomes usados pelos ensaios anteriores.
+PrecondicaoFalhada = FailedPrecondition
+NaoEncontrado = NotFound
+
+# Igual a firestore.Query.DESCENDING.
+DESCENDING = "DESCENDING"
+
+# O Firestore recusa lotes com mais de 500 operações.
+LIMITE_OPERACOES_LOTE = 500
+
+
+class ResultadoGravacao:
+    """Equivalente a WriteResult."""
+
+    def __init__(self, update_time: datetime):
+        self.update_time = update_time
+
+
+class OpcaoEscrita:
+    """Equivalente a LastUpdateOption: a escrita só é feita se o documento estiver nesta versão."""
+
+    def __init__(self, last_update_time: datetime):
+        self.last_update_time = last_update_time
+
+
+def _campo(caminho: str) -> str:
+    """Nome do campo de um caminho de consulta ou de snapshot; como o Firestore, recusa "ID SGD" sem aspas."""
+    partes = parse_field_path(caminho)
+    if len(partes) != 1:
+        raise NotImplementedError(f"Só são suportados caminhos de um nível: {caminho}")
+    return partes[0]
+
+
+def _campo_atualizacao(caminho: str) -> str:
+    """Nome do campo de uma chave do update(); aqui o Firestore aceita espaços sem aspas (FieldPath.from_string)."""
+    return _campo(caminho) if "`" in caminho else caminho
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class Alteracao:
+    """Equivalente a google.cloud.firestore.DocumentChange."""
+
+    def __init__(self, tipo: ChangeType, document: "SnapshotDocumento", old_index: int, new_index: int):
+        self.type = tipo
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+
+class SnapshotDocumento:
+    def __init__(self, reference: "DocumentoRef", dados: Optional[Dict[str, Any]], update_time: Optional[datetime]):
+        self.id = reference.id
+        self.reference = reference
+        self.exists = dados is not None
+        self.update_time = update_time
+        self._dados = dados
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._dados) if self._dados is not None else None
+
+    def get(self, campo: str):
+        if self._dados is None:
+            return None
+        nome = _campo(campo)
+        if nome not in self._dados:
+            raise KeyError(f"{nome!r} is not contained in the data")
+        return self._dados[nome]
+
+
+class DocumentoRef:
+    def __init__(self, colecao: "ColecaoMemoria", doc_id: str):
+        self._colecao = colecao
+        self.id = doc_id
+
+    def set(self, dados: Dict[str, Any], merge: bool = False, timeout: Optional[float] = None) -> ResultadoGravacao:
+        return self._colecao._escrever([("set", self.id, dados, None)])
+
+    def update(self, dados: Dict[str, Any], option: Optional[OpcaoEscrita] = None,
+               timeout: Optional[float] = None) -> ResultadoGravacao:
+        return self._colecao._escrever([("update", self.id, dados, option)])
+
+    def delete(self, option: Optional[OpcaoEscrita] = None, timeout: Optional[float] = None) -> ResultadoGravacao:
+        return self._colecao._escrever([("delete", self.id, None, option)])
+
+    def get(self, timeout: Optional[float] = None) -> SnapshotDocumento:
+        with self._colecao._lock:
+            dados = self._colecao._docs.get(self.id)
+            return SnapshotDocumento(self, dict(dados) if dados is not None else None,
+                                     self._colecao._atualizado.get(self.id))
+
+
+class Ouvinte:
+    """Um on_snapshot ativo; entrega os snapshots por ordem numa thread própria."""
+
+    def __init__(self, colecao: "ColecaoMemoria", consulta: "ConsultaMemoria", callback: Callable):
+        self._colecao = colecao
+        self._consulta = consulta
+        self._callback = callback
+        self._dentro: set = set()
+        self._fila: "queue.Queue" = queue.Queue()
+        threading.Thread(target=self._entregar, name="firestore-memoria", daemon=True).start()
+
+    def unsubscribe(self):
+        with self._colecao._lock:
+            if self in self._colecao._ouvintes:
+                self._colecao._ouvintes.remove(self)
+        self._fila.put(None)
+
+    def _entregar(self):
+        while True:
+            item = self._fila.get()
+            if item is None:
+                return
+            self._callback(*item)
+
+    def _notificar(self, mudados: List[str]):
+        """Chamado com o lock da coleção: calcula as alterações que esta consulta vê."""
+        colecao = self._colecao
+        alteracoes = []
+        for doc_id in mudados:
+            dados = colecao._docs.get(doc_id)
+            passa = dados is not None and self._consulta._passa(dados)
+            snap = SnapshotDocumento(DocumentoRef(colecao, doc_id), dict(dados) if dados else None,
+                                     colecao._atualizado.get(doc_id))
+            if passa and doc_id in self._dentro:
+                alteracoes.append(Alteracao(ChangeType.MODIFIED, snap, 0, 0))
+            elif passa:
+                self._dentro.add(doc_id)
+                alteracoes.append(Alteracao(ChangeType.ADDED, snap, -1, 0))
+            elif doc_id in self._dentro:
+                self._dentro.discard(doc_id)
+                alteracoes.append(Alteracao(ChangeType.REMOVED, snap, 0, -1))
+        if alteracoes:
+            # Como no Firestore, os snapshots seguintes ao primeiro só trazem as alterações.
+            self._fila.put(([], alteracoes, datetime.now(timezone.utc)))
+
+
+class ConsultaMemoria:
+    def __init__(self, colecao: "ColecaoMemoria", filtros: Tuple = (), ordem: Optional[Tuple[str, str]] = None,
+                 limite: Optional[int] = None, depois_de: Optional[SnapshotDocumento] = None):
+        self._colecao = colecao
+        self._filtros = filtros
+        self._ordem = ordem
+        self._limite = limite
+        self._depois_de = depois_de
+
+    def _copia(self, **alterar) -> "ConsultaMemoria":
+        atual = dict(filtros=self._filtros, ordem=self._ordem, limite=self._limite, depois_de=self._depois_de)
+        atual.update(alterar)
+        return ConsultaMemoria(self._colecao, **atual)
+
+    def where(self, campo: str, operador: str, valor) -> "ConsultaMemoria":
+        return self._copia(filtros=self._filtros + ((_campo(campo), operador, valor),))
+
+    def order_by(self, campo: str, direction: str = "ASCENDING") -> "ConsultaMemoria":
+        return self._copia(ordem=(_campo(campo), direction))
+
+    def limit(self, n: int) -> "ConsultaMemoria":
+        return self._copia(limite=n)
+
+    def start_after(self, snapshot: SnapshotDocumento) -> "ConsultaMemoria":
+        return self._copia(depois_de=snapshot)
+
+    def _passa(self, dados: Dict[str, Any]) -> bool:
+        for campo, operador, valor in self._filtros:
+            atual = dados.get(campo)
+            try:
+                if operador == "==":
+                    ok = atual == valor
+                elif operador == "!=":
+                    ok = atual is not None and atual != valor
+                elif operador == "in":
+                    ok = atual in valor
+                elif atual is None:
+                    ok = False
+                elif operador == ">":
+                    ok = atual > valor
+                elif operador == ">=":
+                    ok = atual >= valor
+                elif operador == "<":
+                    ok = atual < valor
+                elif operador == "<=":
+                    ok = atual <= valor
+                else:
+                    raise ValueError(f"Operador não suportado: {operador}")
+            except TypeError:
+                ok = False
+            if not ok:
+                return False
+        return True
+
+    def stream(self, timeout: Optional[float] = None) -> List[SnapshotDocumento]:
+        colecao = self._colecao
+        with colecao._lock:
+            itens = [(doc_id, dict(dados)) for doc_id, dados in colecao._docs.items() if self._passa(dados)]
+            atualizado = dict(colecao._atualizado)
+        if self._ordem is not None:
+            campo, direcao = self._ordem
+            itens = [item for item in itens if item[1].get(campo) is not None]
+            itens.sort(key=lambda item: (item[1][campo], item[0]), reverse=direcao == DESCENDING)
+            if self._depois_de is not None:
+                ids = [doc_id for doc_id, _ in itens]
+                itens = itens[ids.index(self._depois_de.id) + 1:] if self._depois_de.id in ids else []
+        if self._limite is not None:
+            itens = itens[:self._limite]
+        return [SnapshotDocumento(DocumentoRef(colecao, doc_id), dados, atualizado[doc_id]) for doc_id, dados in itens]
+
+    get = stream
+
+    def on_snapshot(self, callback: Callable) -> Ouvinte:
+        colecao = self._colecao
+        with colecao._lock:
+            ouvinte = Ouvinte(colecao, self, callback)
+            colecao._ouvintes.append(ouvinte)
+            snaps = [SnapshotDocumento(DocumentoRef(colecao, doc_id), dict(dados), colecao._atualizado[doc_id])
+                     for doc_id, dados in colecao._docs.items() if self._passa(dados)]
+            ouvinte._dentro = {snap.id for snap in snaps}
+            alteracoes = [Alteracao(ChangeType.ADDED, snap, -1, n) for n, snap in enumerate(snaps)]
+            ouvinte._fila.put((snaps, alteracoes, datetime.now(timezone.utc)))
+        return ouvinte
+
+
+class ColecaoMemoria(ConsultaMemoria):
+    def __init__(self, nome: str):
+        super().__init__(self)
+        self.nome = nome
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._atualizado: Dict[str, datetime] = {}
+        self._ultima_escrita = datetime.min.replace(tzinfo=timezone.utc)
+        self._ouvintes: List[Ouvinte] = []
+        self._lock = threading.RLock()
+        # Se definido, as escritas levantam esta exceção (para simular falta de rede ou recusa).
+        self.falha: Optional[Exception] = None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def document(self, doc_id: Optional[str] = None) -> DocumentoRef:
+        return DocumentoRef(self, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, dados: Dict[str, Any]) -> Tuple[datetime, DocumentoRef]:
+        ref = self.document()
+        ref.set(dados)
+        return self._atualizado[ref.id], ref
+
+    def carregar(self, documentos: Dict[str, Dict[str, Any]]):
+        """Insere muitos documentos de uma vez, sem notificar os ouvintes (para preparar dados)."""
+        agora = datetime.now(timezone.utc)
+        with self._lock:
+            for doc_id, dados in documentos.items():
+                self._docs[doc_id] = self._resolver(dados, agora)
+                self._atualizado[doc_id] = agora
+
+    @staticmethod
+    def _resolver(dados: Dict[str, Any], agora: datetime) -> Dict[str, Any]:
+        return {campo: agora if valor is SERVER_TIMESTAMP else valor for campo, valor in dados.items()}
+
+    def _escrever(self, operacoes: List[Tuple[str, str, Optional[Dict[str, Any]], Optional[OpcaoEscrita]]]
+                  ) -> ResultadoGravacao:
+        if self.falha is not None:
+            raise self.falha
+        with self._lock:
+            # Como no Firestore, duas escritas nunca têm o mesmo update_time.
+            agora = max(datetime.now(timezone.utc), self._ultima_escrita + timedelta(microseconds=1))
+            for operacao, doc_id, dados, opcao in operacoes:
+                if operacao == "update" and doc_id not in self._docs:
+                    raise NotFound(f"No document to update: {doc_id}")
+                if opcao is not None and self._atualizado.get(doc_id) != opcao.last_update_time:
+                    raise FailedPrecondition(f"The document {doc_id} was modified after the given update time.")
+            for operacao, doc_id, dados, _ in operacoes:
+                if operacao == "set":
+                    self._docs[doc_id] = self._resolver(dados, agora)
+                elif operacao == "update":
+                    self._docs[doc_id].update(self._resolver({_campo_atualizacao(c): v for c, v in dados.items()}, agora))
+                else:
+                    self._docs.pop(doc_id, None)
+                self._atualizado[doc_id] = agora
+            self._ultima_escrita = agora
+            mudados = list(dict.fromkeys(operacao[1] for operacao in operacoes))
+            for ouvinte in list(self._ouvintes):
+                ouvinte._notificar(mudados)
+        return ResultadoGravacao(agora)
+
+
+class LoteMemoria:
+    """Equivalente a WriteBatch: as operações são aplicadas de uma vez no commit()."""
+
+    def __init__(self):
+        self._operacoes: List[Tuple[DocumentoRef, str, Optional[Dict[str, Any]], Optional[OpcaoEscrita]]] = []
+
+    def set(self, ref: DocumentoRef, dados: Dict[str, Any], merge: bool = False):
+        self._operacoes.append((ref, "set", dados, None))
+
+    def update(self, ref: DocumentoRef, dados: Dict[str, Any], option: Optional[OpcaoEscrita] = None):
+        self._operacoes.append((ref, "update", dados, option))
+
+    def delete(self, ref: DocumentoRef, option: Optional[OpcaoEscrita] = None):
+        self._operacoes.append((ref, "delete", None, option))
+
+    def commit(self, timeout: Optional[float] = None):
+        if len(self._operacoes) > LIMITE_OPERACOES_LOTE:
+            raise ValueError(f"maximum {LIMITE_OPERACOES_LOTE} writes allowed per request")
+        por_colecao: Dict[int, Tuple[ColecaoMemoria, list]] = {}
+        for ref, operacao, dados, opcao in self._operacoes:
+            por_colecao.setdefault(id(ref._colecao), (ref._colecao, []))[1].append((operacao, ref.id, dados, opcao))
+        for colecao, operacoes in por_colecao.values():
+            colecao._escrever(operacoes)
+
+
+class ClienteMemoria:
+    """Equivalente a firestore.client()."""
+
+    def __init__(self):
+        self._colecoes: Dict[str, ColecaoMemoria] = {}
+
+    def collection(self, nome: str) -> ColecaoMemoria:
+        return self._colecoes.setdefault(nome, ColecaoMemoria(nome))
+
+    def batch(self) -> LoteMemoria:
+        return LoteMemoria()
+
+    @staticmethod
+    def write_option(last_update_time: datetime) -> OpcaoEscrita:
+        return OpcaoEscrita(last_update_time)
@@ -0,0 +1,676 @@
+"""Testes do PA.py.
+
+Correr com: python -m pytest -q
+"""
+
+import json
+import queue
+import re
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pytest
+from google.api_core import exceptions as gexc
+from PyQt5.QtCore import Qt
+
+import PA
+from PA import CriteriosFiltro, LoteSnapshot, normalizar
+
+
+def registo(id_sgd: str, **campos):
+    """Documento como o formulário o grava; os campos indicados substituem os valores por omissão."""
+    dados = {
+        "ID SGD": id_sgd, "CIDADE": "Campinas", "BASE GED": "NORTE", "CAIXA MAPA": "", "CAIXA SISTEMA": "",
+        "Quantidade HP": 1, "PA": "", "ABERTO POR": "", "ABERTURA": datetime(2026, 1, 5),
+        "VENCIMENTO": datetime(2026, 1, 20), "STATUS": "EM ABERTO", "CONCLUSAO": "", "TIPO PA": "",
+        "CRIADO_EM": datetime(2026, 1, 5), "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP,
+    }
+    dados.update(campos)
+    return dados
+
+
+def lido(doc_id: str, dados):
+    """O registo como a aplicação o guarda depois de ler o documento."""
+    return PA.converter_dados(doc_id, dados)
+
+
+def versao(colecao, doc_id: str) -> str:
+    return PA.versao_documento(colecao.document(doc_id).get())
+
+
+# ------------------------------
+# Firestore em memória
+# ------------------------------
+
+def test_memoria_recusa_caminhos_sem_aspas_como_o_firestore(db):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    with pytest.raises(ValueError):
+        colecao.where("ID SGD", "==", "S1")
+    with pytest.raises(ValueError):
+        colecao.document("d1").get().get("ID SGD")
+    docs = colecao.where(PA.caminho_campo("ID SGD"), "==", "S1").stream()
+    assert [doc.id for doc in docs] == ["d1"]
+    assert docs[0].get(PA.caminho_campo("ID SGD")) == "S1"
+
+
+def test_edicao_com_versao_antiga_levanta_failed_precondition(db):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    lida = versao(colecao, "d1")
+    colecao.document("d1").update({"PA": "outra pessoa"})
+    with pytest.raises(gexc.FailedPrecondition) as erro:
+        PA.enviar_edicao(db, colecao.document("d1"), {"CIDADE": "Santos"}, lida)
+    assert erro.value.code == 400
+
+
+# ------------------------------
+# Fila de gravações
+# ------------------------------
+
+@pytest.fixture
+def fila(app, tmp_path):
+    fila = PA.FilaEscrita(str(tmp_path / "fila.sqlite3"))
+    yield fila
+    fila.parar()
+
+
+@pytest.fixture
+def pedir(esperar):
+    """Faz um pedido à fila e devolve a resposta, que chega pela thread da interface."""
+    def pedir(metodo, *args, **kwargs):
+        respostas = []
+        metodo(*args, ao_concluir=respostas.append, **kwargs)
+        esperar(lambda: respostas)
+        return respostas[0]
+    return pedir
+
+
+@pytest.fixture
+def esperar_fila(pedir):
+    def esperar_fila(fila, condicao, limite: float = 5.0):
+        fim = time.monotonic() + limite
+        while not condicao(pedir(fila.entradas)):
+            assert time.monotonic() < fim, pedir(fila.entradas)
+            time.sleep(0.02)
+    return esperar_fila
+
+
+def test_fila_reaplica_edicao_quando_outra_pessoa_mudou_outro_campo(db, fila, esperar_fila):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1", PA="PA 1")})
+    lida = versao(colecao, "d1")
+    colecao.document("d1").update({"PA": "PA 2"})
+    fila.enfileirar("d1", {"CIDADE": "Santos"}, base={"CIDADE": "Campinas"}, versao=lida)
+    fila.iniciar(db, colecao)
+    esperar_fila(fila, lambda entradas: not entradas)
+    assert colecao.document("d1").get().to_dict()["CIDADE"] == "Santos"
+    assert colecao.document("d1").get().to_dict()["PA"] == "PA 2"
+
+
+def test_fila_deixa_em_conflito_quando_o_mesmo_campo_mudou(db, fila, pedir, esperar_fila):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    lida = versao(colecao, "d1")
+    colecao.document("d1").update({"CIDADE": "Bauru"})
+    fila.enfileirar("d1", {"CIDADE": "Santos"}, base={"CIDADE": "Campinas"}, versao=lida)
+    fila.iniciar(db, colecao)
+    esperar_fila(fila, lambda entradas: entradas and entradas[0].estado == PA.ESTADO_CONFLITO)
+    entrada = pedir(fila.entradas)[0]
+    assert entrada.remoto["CIDADE"] == "Bauru"
+    assert "CIDADE" in entrada.erro
+    # Manter a versão local: a edição é reenviada sobre a versão da nuvem.
+    fila.reaplicar(entrada, entrada.dados)
+    esperar_fila(fila, lambda entradas: not entradas)
+    assert colecao.document("d1").get().to_dict()["CIDADE"] == "Santos"
+
+
+def test_fila_repete_erros_transitorios_e_marca_os_restantes(db, fila, pedir, esperar_fila):
+    colecao = db.collection("registros_pa")
+    colecao.falha = gexc.ServiceUnavailable("sem rede")
+    fila.enfileirar("d1", registo("S1"))
+    fila.iniciar(db, colecao)
+    time.sleep(0.3)
+    assert [e.estado for e in pedir(fila.entradas)] == [PA.ESTADO_PENDENTE]
+    colecao.falha = gexc.PermissionDenied("recusado")
+    esperar_fila(fila, lambda entradas: entradas[0].estado == PA.ESTADO_FALHOU)
+    # Uma gravação falhada bloqueia as seguintes do mesmo documento.
+    assert pedir(fila.enfileirar, "d1", {"PA": "x"}, base={"PA": ""}) == PA.ESTADO_FALHOU
+    colecao.falha = None
+    assert pedir(fila.repetir_falhadas) == ["d1"]
+    esperar_fila(fila, lambda entradas: not entradas)
+    assert colecao.document("d1").get().to_dict()["PA"] == "x"
+
+
+# ------------------------------
+# Conflitos de edição
+# ------------------------------
+
+def test_conflito_de_versao_usa_as_excecoes_do_cliente():
+    assert PA.conflito_de_versao(gexc.FailedPrecondition("versão mudou"))
+    assert PA.conflito_de_versao(gexc.NotFound("apagado"))
+    assert not PA.conflito_de_versao(gexc.ServiceUnavailable("sem rede"))
+    assert not PA.conflito_de_versao(ValueError("412"))
+
+
+def abrir_para_edicao(w, doc_id: str):
+    linha = w.modelo._linha_do_slot(w.modelo._slot_por_id[doc_id])
+    w._carregar_registro_para_edicao(w.modelo.index(linha, 0))
+
+
+def test_edicao_direta_em_conflito_pergunta_e_funde(db, janela, esperar, monkeypatch):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    perguntas = []
+
+    def perguntar(self, id_sgd, alteracoes, base, remoto, adiar=True):
+        perguntas.append(PA.campos_em_conflito(base, alteracoes, remoto))
+        return True
+
+    monkeypatch.setattr(PA.AppPA, "_perguntar_conflito", perguntar)
+    w = janela({"ficheiro_fila_escrita": ""})
+
+    # Outra pessoa mudou outro campo: a edição é reaplicada sem perguntar nada.
+    abrir_para_edicao(w, "d1")
+    colecao.document("d1").update({"PA": "remoto", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    w.ed_cidade.setText("Santos")
+    w._salvar_registro()
+    esperar(lambda: w.tab_cadastro.isEnabled() and w.registro_em_edicao_id is None)
+    assert perguntas == []
+    assert colecao.document("d1").get().to_dict()["CIDADE"] == "Santos"
+    assert colecao.document("d1").get().to_dict()["PA"] == "remoto"
+
+    # O mesmo campo: a pergunta é feita na interface e a versão local é mantida.
+    esperar(lambda: w._registros_por_id["d1"]["CIDADE"] == "Santos")
+    abrir_para_edicao(w, "d1")
+    colecao.document("d1").update({"CIDADE": "Bauru", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    w.ed_cidade.setText("Itu")
+    w._salvar_registro()
+    esperar(lambda: w.tab_cadastro.isEnabled() and w.registro_em_edicao_id is None)
+    assert perguntas == [["CIDADE"]]
+    assert colecao.document("d1").get().to_dict()["CIDADE"] == "Itu"
+
+
+def test_edicao_pela_fila_em_conflito_pergunta_e_descarta(db, janela, esperar, monkeypatch):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    perguntas = []
+
+    def perguntar(self, id_sgd, alteracoes, base, remoto, adiar=True):
+        perguntas.append(PA.campos_em_conflito(base, alteracoes, remoto))
+        return False
+
+    monkeypatch.setattr(PA.AppPA, "_perguntar_conflito", perguntar)
+    w = janela()
+    abrir_para_edicao(w, "d1")
+    colecao.document("d1").update({"CIDADE": "Bauru", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    w.ed_cidade.setText("Itu")
+    w._salvar_registro()
+    assert w._registros_por_id["d1"]["CIDADE"] == "Itu"  # a versão local aparece logo
+    # Manter a versão da nuvem: a gravação sai da fila e a linha volta a mostrar a nuvem.
+    esperar(lambda: perguntas and not w._a_resolver_conflitos and not w._locais)
+    assert perguntas == [["CIDADE"]]
+    esperar(lambda: w._registros_por_id["d1"]["CIDADE"] == "Bauru")
+    assert w.modelo.estado_escrita("d1") is None
+    assert colecao.document("d1").get().to_dict()["CIDADE"] == "Bauru"
+
+
+# ------------------------------
+# Importação
+# ------------------------------
+
+def test_importacao_rejeita_id_sgd_repetido_no_ficheiro_e_na_nuvem(db, tmp_path):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"x": registo("S1")})
+    caminho = tmp_path / "importar.csv"
+    caminho.write_text("\n".join([
+        "ID SGD;CIDADE;ABERTURA;VENCIMENTO",
+        "S1;Campinas;05/01/2026;20/01/2026",
+        "S2;Campinas;05/01/2026;20/01/2026",
+        "S2;Bauru;06/01/2026;21/01/2026",
+        "S3;;05/01/2026;20/01/2026",
+    ]), encoding="utf-8")
+
+    simulado = PA.importar_registos(db, colecao, str(caminho), simular=True)
+    assert (simulado.lidas, simulado.importadas, len(colecao)) == (4, 1, 1)
+
+    relatorio = PA.importar_registos(db, colecao, str(caminho))
+    assert (relatorio.lidas, relatorio.importadas) == (4, 1)
+    assert [(e.linha, e.id_sgd) for e in relatorio.erros] == [(2, "S1"), (4, "S2"), (5, "S3")]
+    assert relatorio.erros[0].motivo == "ID SGD já existe na nuvem"
+    assert relatorio.erros[1].motivo == "ID SGD repetido no ficheiro (linha 3)"
+    assert sorted(doc.to_dict()["ID SGD"] for doc in colecao.stream()) == ["S1", "S2"]
+
+
+def test_ids_existentes_consulta_por_blocos(db):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({f"d{i}": registo(f"S{i}") for i in range(0, 80, 2)})
+    ids = [f"S{i}" for i in range(80)]
+    assert PA.ids_existentes(colecao, ids) == {f"S{i}" for i in range(0, 80, 2)}
+
+
+# ------------------------------
+# Finalizados
+# ------------------------------
+
+def test_procura_finalizado_por_id_na_nuvem(db, janela, esperar, monkeypatch):
+    monkeypatch.setattr(PA, "TAMANHO_PAGINA_FINALIZADOS", 1)
+    colecao = db.collection("registros_pa")
+    colecao.carregar({f"f{i}": registo(f"F{i}", STATUS="FINALIZADO", CRIADO_EM=datetime(2026, 1, 1 + i))
+                      for i in range(3)})
+    w = janela()
+    w.cb_vista.setCurrentIndex(1)
+    esperar(lambda: "f2" in w._registros_por_id)
+    assert "f0" not in w._registros_por_id
+
+    w.ed_busca.setText("F0")
+    w._procurar_finalizados_na_nuvem()
+    esperar(lambda: "f0" in w._registros_por_id)
+
+
+# ------------------------------
+# Snapshots
+# ------------------------------
+
+def test_fundir_lotes_fica_com_o_ultimo_estado_de_cada_documento():
+    a1, a2, b1, c1 = ({"id": doc_id, "v": v} for doc_id, v in (("a", 1), ("a", 2), ("b", 1), ("c", 1)))
+    marca = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    lote = PA.fundir_lotes([
+        LoteSnapshot(alteracoes=[("ADDED", "a", a1), ("MODIFIED", "b", b1)], marca=marca),
+        LoteSnapshot(alteracoes=[("MODIFIED", "a", a2), ("ADDED", "c", c1)], retomar="e:1", inicial=True),
+        LoteSnapshot(alteracoes=[("REMOVED", "c", None), ("REMOVED", "b", None)],
+                     marca=marca + timedelta(seconds=1)),
+    ])
+    assert lote.completo is None
+    assert sorted(lote.alteracoes, key=lambda alteracao: alteracao[1]) == [("ADDED", "a", a2), ("REMOVED", "b", None)]
+    assert (lote.marca, lote.retomar, lote.inicial) == (marca + timedelta(seconds=1), "e:1", True)
+
+    completo = PA.fundir_lotes([
+        LoteSnapshot(alteracoes=[("ADDED", "x", {"id": "x"})]),
+        LoteSnapshot(completo=[a1, b1]),
+        LoteSnapshot(alteracoes=[("MODIFIED", "a", a2), ("REMOVED", "b", None), ("ADDED", "c", c1)]),
+    ])
+    assert completo.completo == [a2, c1]
+
+
+def test_leitura_completa_apanha_documentos_sem_atualizado_em(db, janela, esperar):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1")})
+    janela.fechar(janela())
+    sem_marca = registo("S2")
+    del sem_marca["ATUALIZADO_EM"]
+    colecao.carregar({"d2": sem_marca})
+
+    w = janela()
+    assert w.listener_exclusoes is not None  # consultas incrementais: d2 escapa-lhes
+    assert "d2" not in w._registros_por_id
+    w._leitura_completa_em = datetime.now(timezone.utc) - PA.IDADE_MAXIMA_LEITURA_COMPLETA - timedelta(hours=1)
+    w._on_virada_do_dia()
+    esperar(lambda: "d2" in w._registros_por_id)
+    assert w.listener_exclusoes is None
+
+
+def amanha_no_limite(monkeypatch):
+    """Faz de conta que já é amanhã para a janela de abertura."""
+    amanha = date.today() + timedelta(days=1)
+    monkeypatch.setattr(PA, "limite_abertura", lambda dias: amanha - timedelta(days=dias) if dias > 0 else None)
+
+
+def test_alteracoes_na_nuvem_sao_aplicadas_a_tabela(db, janela, esperar):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({f"d{i}": registo(f"S{i}") for i in range(5)})
+    w = janela()
+    assert w.modelo.total() == 5
+    colecao.document("d1").update({"CIDADE": "Santos", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    colecao.document("d9").set(registo("S9"))
+    colecao.document("d2").update({"STATUS": "FINALIZADO", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    colecao.document("d3").delete()
+    esperar(lambda: set(w._registros_por_id) == {"d0", "d1", "d4", "d9"})
+    assert w._registros_por_id["d1"]["CIDADE"] == "Santos"
+    assert sorted(w.modelo.ids_visiveis()) == ["d0", "d1", "d4", "d9"]
+
+
+def test_virada_do_dia_avanca_a_janela_de_abertura(db, janela, esperar, monkeypatch):
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"limite": registo("S1", ABERTURA=hoje - timedelta(days=30)),
+                      "recente": registo("S2", ABERTURA=hoje - timedelta(days=2))})
+    w = janela({"janela_abertura_dias": 30})
+    assert sorted(w._registros_por_id) == ["limite", "recente"]
+
+    amanha_no_limite(monkeypatch)
+    w._on_virada_do_dia()
+    assert sorted(w._registros_por_id) == ["recente"]
+    assert w.listener_exclusoes is not None  # a consulta com o limite de ontem foi substituída
+    for doc_id in ("limite", "recente"):
+        colecao.document(doc_id).update({"CIDADE": "Santos", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    esperar(lambda: w._registros_por_id["recente"]["CIDADE"] == "Santos")
+    assert "limite" not in w._registros_por_id
+
+
+def test_leitura_completa_apaga_as_marcas_de_exclusao_antigas(db, janela, esperar):
+    agora = datetime.now(timezone.utc)
+    exclusoes = db.collection("registros_pa_exclusoes")
+    exclusoes.carregar({"velha": {"EXCLUIDO_EM": agora - PA.IDADE_MAXIMA_LEITURA_COMPLETA - timedelta(hours=1)},
+                        "recente": {"EXCLUIDO_EM": agora - timedelta(hours=1)}})
+    janela()
+    esperar(lambda: len(exclusoes) == 1)
+    assert exclusoes.document("recente").get().exists
+
+
+def test_prazos_recalculados_so_depois_de_sincronizar_com_a_nuvem(db, janela, esperar):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1", **{"TEMPO RESTANTE": -999})})
+    janela.fechar(janela())
+    # Enquanto a janela esteve fechada, outra pessoa mudou o vencimento e gravou o prazo certo.
+    vencimento = datetime.combine(date.today() + timedelta(days=10), datetime.min.time())
+    colecao.document("d1").update({"VENCIMENTO": vencimento, "`TEMPO RESTANTE`": 10,
+                                   "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+
+    w = janela({"persistir_tempo_restante": True})
+    esperar(lambda: w._registros_por_id["d1"]["TEMPO RESTANTE"] == 10 and not w._escritas_em_curso)
+    # Recalcular a partir da linha da cache gravaria o prazo do vencimento antigo por cima deste.
+    assert colecao.document("d1").get().to_dict()["TEMPO RESTANTE"] == 10
+
+
+# ------------------------------
+# Índice de busca
+# ------------------------------
+
+REGISTOS_INDICE = {
+    0: {"ID SGD": "SGD-10", "CIDADE": "São Paulo", "CAIXA MAPA": "CX 7", "STATUS": "EM ABERTO", "BASE GED": "NORTE"},
+    1: {"ID SGD": "SGD-11", "CIDADE": "Santos", "CAIXA MAPA": "", "STATUS": "ANÁLISE", "BASE GED": "SUL"},
+    2: {"ID SGD": "SGD-12", "CIDADE": "Bauru", "CAIXA MAPA": "Sala São João", "STATUS": "EM ABERTO",
+        "BASE GED": "SUL"},
+}
+
+
+def consultar_a_mao(registos, criterios: CriteriosFiltro):
+    def passa(reg):
+        textos = [normalizar(reg.get(campo, "")) for campo in ("ID SGD",) + PA.CAMPOS_TEXTO_BUSCA]
+        q = criterios.texto
+        texto_ok = not q or any(t.startswith(q) if len(q) < 3 else q in t for t in textos)
+        return texto_ok and all(reg.get(campo, "") == valor for campo, valor in criterios.categorias())
+    return {slot for slot, reg in registos.items() if passa(reg)}
+
+
+@pytest.mark.parametrize("criterios", [
+    CriteriosFiltro(texto="sao"), CriteriosFiltro(texto="sa"), CriteriosFiltro(texto="sgd-11"),
+    CriteriosFiltro(texto="sgd-1"), CriteriosFiltro(texto="d-1"), CriteriosFiltro(texto="sg"),
+    CriteriosFiltro(status="EM ABERTO"), CriteriosFiltro(texto="sao", base="SUL"),
+    CriteriosFiltro(status="EM ABERTO", base="SUL"), CriteriosFiltro(texto="xyz"),
+])
+def test_indice_busca_igual_a_filtrar_registo_a_registo(criterios):
+    indice = PA.IndiceBusca()
+    indice.reconstruir(REGISTOS_INDICE.items())
+    assert indice.consultar(criterios) == consultar_a_mao(REGISTOS_INDICE, criterios)
+
+    # As alterações incrementais deixam o índice como uma reconstrução.
+    registos = dict(REGISTOS_INDICE)
+    indice.remover(0)
+    del registos[0]
+    registos[5] = {"ID SGD": "SGD-15", "CIDADE": "Sapucaia", "STATUS": "EM ABERTO", "BASE GED": "SUL"}
+    indice.adicionar(5, registos[5])
+    assert indice.consultar(criterios) == consultar_a_mao(registos, criterios)
+    assert all(indice.corresponde(slot, criterios) == (slot in consultar_a_mao(registos, criterios))
+               for slot in registos)
+    assert indice.consultar(CriteriosFiltro()) is None
+
+
+# ------------------------------
+# Modelo da tabela
+# ------------------------------
+
+def ids_por_linha(modelo):
+    return [modelo.id_na_linha(linha) for linha in range(modelo.rowCount())]
+
+
+def test_modelo_mantem_a_ordem_nas_alteracoes(app):
+    registos = {f"d{i}": lido(f"d{i}", registo(f"S{i}", CRIADO_EM=datetime(2026, 1, 1) + timedelta(hours=i),
+                                               **{"Quantidade HP": (i * 7) % 5}))
+                for i in range(12)}
+    modelo = PA.ModeloRegistros()
+    modelo.redefinir([registos[f"d{i}"] for i in range(8)])
+    assert ids_por_linha(modelo) == [f"d{i}" for i in range(7, -1, -1)]  # mais recentes primeiro
+    modelo.sort(PA.COL_QTD_HP, Qt.DescendingOrder)
+
+    for i in range(8, 12):
+        modelo.inserir(registos[f"d{i}"])
+    registos["d2"] = lido("d2", registo("S2", CIDADE="Bauru", **{"Quantidade HP": 9}))
+    modelo.atualizar(registos["d2"])
+    modelo.remover("d6")
+    del registos["d6"]
+
+    esperados = sorted(registos.values(), key=lambda reg: (reg["Quantidade HP"], PA.chave_ordem(reg)), reverse=True)
+    assert ids_por_linha(modelo) == [reg["id"] for reg in esperados]
+    assert modelo.data(modelo.index(0, 0)) == "S2"
+    assert modelo.data(modelo.index(0, 1)) == "Bauru"
+
+
+def test_modelo_mantem_ordem_e_filtro_nas_alteracoes(app):
+    registos = {f"d{i}": lido(f"d{i}", registo(
+        f"S{i}", CIDADE=("Campinas", "Bauru", "Campo Limpo")[i % 3], STATUS=("EM ABERTO", "ANÁLISE")[i % 2],
+        CRIADO_EM=datetime(2026, 1, 1) + timedelta(hours=i), **{"Quantidade HP": (i * 7) % 5}))
+        for i in range(12)}
+    criterios = CriteriosFiltro(texto="camp", status="EM ABERTO")
+    modelo = PA.ModeloRegistros()
+    modelo.redefinir([registos[f"d{i}"] for i in range(8)])
+    modelo.sort(PA.COL_QTD_HP, Qt.DescendingOrder)
+    modelo.definir_filtro(criterios)
+
+    for i in range(8, 12):
+        modelo.inserir(registos[f"d{i}"])
+    registos["d2"] = lido("d2", registo("S2", CIDADE="Bauru", **{"Quantidade HP": 9}))
+    registos["d4"] = lido("d4", registo("S4", CIDADE="Campinas", **{"Quantidade HP": 9}))
+    modelo.atualizar(registos["d2"])
+    modelo.atualizar(registos["d4"])
+    modelo.remover("d6")
+    del registos["d6"]
+
+    visiveis = [reg for reg in registos.values()
+                if "camp" in normalizar(reg["CIDADE"]) and reg["STATUS"] == "EM ABERTO"]
+    visiveis.sort(key=lambda reg: (reg["Quantidade HP"], PA.chave_ordem(reg)), reverse=True)
+    assert ids_por_linha(modelo) == [reg["id"] for reg in visiveis]
+    assert modelo.data(modelo.index(0, 0)) == visiveis[0]["ID SGD"]
+    assert modelo.total() == 11
+
+
+# ------------------------------
+# Prazos
+# ------------------------------
+
+def test_agenda_avisa_cada_mudanca_de_faixa_uma_vez(app, esperar):
+    hoje = date.today()
+    avisos = []
+    agenda = PA.AgendaPrazos()
+    agenda.avisos.connect(avisos.extend)
+
+    def reg(doc_id, dias, status="EM ABERTO"):
+        return {"id": doc_id, "STATUS": status, "VENCIMENTO": hoje + timedelta(days=dias)}
+
+    agenda.redefinir([reg("d1", 2), reg("d2", 10), reg("d3", -1, "FINALIZADO")])
+    esperar(lambda: avisos)
+    assert avisos == [("d1", PA.FAIXA_A_VENCER, hoje + timedelta(days=2))]
+    assert len(agenda) == 2
+
+    avisos.clear()
+    agenda.acompanhar(reg("d1", 2))  # sem mudança de vencimento: não volta a avisar
+    agenda.verificar(hoje + timedelta(days=7))
+    esperar(lambda: avisos)
+    assert sorted(avisos) == [("d1", PA.FAIXA_VENCIDO, hoje + timedelta(days=2)),
+                              ("d2", PA.FAIXA_A_VENCER, hoje + timedelta(days=10))]
+
+    # Um registo removido deixa de ocupar memória; se voltar, é avisado de novo.
+    avisos.clear()
+    agenda.esquecer("d1")
+    assert "d1" not in agenda._avisados and len(agenda) == 1
+    agenda.acompanhar(reg("d1", 2))
+    esperar(lambda: avisos)
+    assert avisos == [("d1", PA.FAIXA_A_VENCER, hoje + timedelta(days=2))]
+
+
+# ------------------------------
+# Painel
+# ------------------------------
+
+def contagens(agregados: PA.Agregados):
+    def tupla(c):
+        return c.registos, c.em_aberto, c.vencidos, c.a_vencer, c.qtd_hp
+    return tupla(agregados.total()), {d: {g: tupla(c) for g, c in agregados.grupos(d).items()}
+                                      for d in agregados.dimensoes}
+
+
+def test_agregados_incrementais_iguais_a_recontar():
+    hoje = date(2026, 3, 10)
+
+    def reg(doc_id, base, status, dias, qtd):
+        vencimento = datetime.combine(hoje, datetime.min.time()) + timedelta(days=dias)
+        return lido(doc_id, registo(doc_id, **{"BASE GED": base, "STATUS": status, "Quantidade HP": qtd,
+                                               "VENCIMENTO": vencimento}))
+
+    registos = {"a": reg("a", "NORTE", "EM ABERTO", 10, 2), "b": reg("b", "NORTE", "ANÁLISE", 2, 3),
+                "c": reg("c", "SUL", "FINALIZADO", -5, 1)}
+    agregados = PA.Agregados()
+    agregados.redefinir(registos.values(), hoje=hoje)
+    assert agregados.total().em_aberto == 2 and agregados.total().a_vencer == 1 and agregados.total().qtd_hp == 6
+
+    semana_seguinte = hoje + timedelta(days=7)
+    agregados.definir_hoje(semana_seguinte)
+    registos["b"] = reg("b", "SUL", "FINALIZADO", 2, 3)
+    agregados.acompanhar(registos["b"])
+    agregados.esquecer("c")
+    del registos["c"]
+
+    recontados = PA.Agregados()
+    recontados.redefinir(registos.values(), hoje=semana_seguinte)
+    assert contagens(agregados) == contagens(recontados)
+    assert agregados.total().a_vencer == 1
+
+
+# ------------------------------
+# Diagnóstico
+# ------------------------------
+
+def test_metrica_conta_as_amostras_de_todas_as_threads():
+    metrica = PA.Metrica()
+    threads = [threading.Thread(target=lambda: [metrica.registar(1.0) for _ in range(20000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        metrica.resumo()  # percorre as amostras enquanto as outras threads as acrescentam
+    assert metrica.resumo()["total"] == 80000
+
+
+def test_todas_as_metricas_tem_descricao():
+    with open(PA.__file__, encoding="utf-8") as f:
+        fonte = f.read()
+    nomes = set(re.findall(r'"((?:snapshot|tabela|escrita|ui)\.[a-z_]+)"', fonte))
+    assert nomes and nomes <= set(PA.DESCRICOES_METRICAS)
+
+
+# ------------------------------
+# Relay
+# ------------------------------
+
+@pytest.fixture
+def relay(db):
+    """Abre servidores do relay; relay.ligar() liga-lhes clientes que entregam os lotes numa fila.
+
+    No fim, os clientes são desligados e as suas threads terminam antes de os objetos serem libertados.
+    """
+    servidores, clientes = [], []
+
+    def abrir(**kwargs):
+        servidor = PA.ServidorRelay(db, ("127.0.0.1", 0), chave="segredo", **kwargs)
+        servidor.iniciar()
+        servidores.append(servidor)
+        return servidor
+
+    def ligar(servidor, retomar=None, janela_dias=0):
+        lotes: "queue.Queue" = queue.Queue()
+        cliente = PA.ClienteRelay(servidor.endereco, lotes.put, retomar, "segredo", janela_dias)
+        cliente.iniciar()
+        clientes.append(cliente)
+        return cliente, lotes
+
+    abrir.ligar = ligar
+    yield abrir
+    for cliente in clientes:
+        cliente.unsubscribe()
+    for servidor in servidores:
+        servidor.parar()
+    for thread in threading.enumerate():
+        if thread.name == "cliente-relay":
+            thread.join(timeout=5)
+
+
+def test_relay_envia_conjunto_completo_e_retoma_so_o_que_falta(db, relay, esperar):
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"d1": registo("S1"), "d2": registo("S2"), "f1": registo("F1", STATUS="FINALIZADO")})
+    servidor = relay()
+    cliente, lotes = relay.ligar(servidor)
+    primeiro = lotes.get(timeout=5)
+    assert sorted(reg["id"] for reg in primeiro.completo) == ["d1", "d2"]
+
+    colecao.document("d1").update({"CIDADE": "Santos", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    segundo = lotes.get(timeout=5)
+    assert [(tipo, doc_id, reg["CIDADE"]) for tipo, doc_id, reg in segundo.alteracoes] == [("MODIFIED", "d1", "Santos")]
+    cliente.unsubscribe()
+
+    colecao.document("d2").update({"CIDADE": "Bauru", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    esperar(lambda: servidor._registos["d2"]["CIDADE"] == "Bauru")
+    _, retomados = relay.ligar(servidor, retomar=segundo.retomar)
+    lote = retomados.get(timeout=5)
+    assert lote.completo is None
+    assert [(doc_id, reg["CIDADE"]) for _, doc_id, reg in lote.alteracoes] == [("d2", "Bauru")]
+    # A seguir, um lote vazio marca o fim do que faltava: a janela já está igual ao relay.
+    assert retomados.get(timeout=5) == LoteSnapshot(retomar=lote.retomar, inicial=True)
+
+
+def test_relay_aplica_a_janela_de_abertura(db, relay, monkeypatch):
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    colecao = db.collection("registros_pa")
+    colecao.carregar({"antigo": registo("S1", ABERTURA=hoje - timedelta(days=90)),
+                      "limite": registo("S2", ABERTURA=hoje - timedelta(days=30)),
+                      "recente": registo("S3", ABERTURA=hoje - timedelta(days=2))})
+    servidor = relay(janela_dias=30)
+    _, lotes = relay.ligar(servidor, janela_dias=30)
+    assert sorted(reg["id"] for reg in lotes.get(timeout=5).completo) == ["limite", "recente"]
+
+    amanha_no_limite(monkeypatch)
+    servidor._podar_fora_da_janela()
+    assert lotes.get(timeout=5).alteracoes == [("REMOVED", "limite", None)]
+    # O listener ainda tem o limite de ontem: o que já saiu da janela não volta a ser enviado.
+    for doc_id in ("limite", "recente"):
+        colecao.document(doc_id).update({"CIDADE": "Santos", "ATUALIZADO_EM": PA.firestore.SERVER_TIMESTAMP})
+    assert [doc_id for _, doc_id, _ in lotes.get(timeout=5).alteracoes] == ["recente"]
+
+
+def test_relay_pede_prova_da_chave_sem_a_receber(db, relay):
+    db.collection("registros_pa").carregar({"d1": registo("S1")})
+    servidor = relay()
+
+    def assinar(resposta):
+        with socket.create_connection(servidor.endereco, timeout=5) as con:
+            linhas = con.makefile("rb")
+            desafio = json.loads(linhas.readline())
+            assert desafio["tipo"] == "desafio"
+            con.sendall(PA._linha_relay({"tipo": "assinar", "prova": resposta(desafio["nonce"])}))
+            return json.loads(linhas.readline())["tipo"]
+
+    assert assinar(lambda nonce: "segredo") == "recusado"
+    assert assinar(lambda nonce: PA.prova_relay("outra", nonce)) == "recusado"
+    assert assinar(lambda nonce: PA.prova_relay("segredo", nonce)) == "completo"
+
+
+def test_janela_mais_larga_que_a_do_relay_le_da_nuvem(db, relay, janela, esperar):
+    hoje = datetime.combine(date.today(), datetime.min.time())
+    db.collection("registros_pa").carregar({"antigo": registo("S1", ABERTURA=hoje - timedelta(days=90)),
+                                            "recente": registo("S2", ABERTURA=hoje - timedelta(days=2))})
+    servidor = relay(janela_dias=30)
+    w = janela({"relay": "%s:%d" % servidor.endereco, "chave_relay": "segredo"})
+    esperar(lambda: "antigo" in w._registros_por_id)
+    assert not isinstance(w.listener, PA.ClienteRelay)
+    assert sorted(w._registros_por_id) == ["antigo", "recente"]